@@ -0,0 +1,321 @@
+"""Throughput analytics for the admin and bank dashboards.
+
+Metrics are aggregated per day into `analytics_buckets` (metric, day,
+scope_id = bank, dim) and reports sum the buckets of the requested window:
+
+- turnaround: hours a request sat in pending before the company acted on it
+  (submit / reject / missing documents), per company. Uses LAG() over each
+  request's transition history to find when it entered pending.
+- value: submitted valuation vs. the amount the bank requested, per bank and
+  company. Read from the valuation_submitted events so resubmissions keep the
+  value they had at the time.
+- volume: requests created per wilaya.
+- visits: finalized visit appointments per company and the scheduling lead
+  time, bucketed by visit day.
+
+`refresh_analytics()` is incremental: it only recomputes days from the last
+refresh minus ANALYTICS_REFRESH_DAYS, and runs at most once per
+ANALYTICS_TTL_SECONDS. `flask rebuild-analytics` recomputes everything.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Tuple
+import json
+import logging
+import threading
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, func, select
+from sqlalchemy.exc import IntegrityError
+from db_routing import use_primary
+from models import (
+    db, User, ValuationRequest, ValuationRequestTransition, ValuationRequestEvent, VisitAppointment,
+    AnalyticsBucket, AnalyticsWatermark,
+)
+
+log = logging.getLogger(__name__)
+
+METRIC_TURNAROUND = 'turnaround'
+METRIC_VALUE = 'value'
+METRIC_VOLUME = 'volume'
+METRIC_VISITS = 'visits'
+UNKNOWN_WILAYA = ''
+
+_refresh_lock = threading.Lock()
+
+
+# ---- SQL helpers ----
+def _hours_between(later, earlier):
+    if db.engine.dialect.name == 'sqlite':
+        return (func.julianday(later) - func.julianday(earlier)) * 24.0
+    return func.extract('epoch', later - earlier) / 3600.0
+
+
+def _as_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+# ---- metric computations: {(day, scope_id, dim): [count, sum_a, sum_b, max_a]} ----
+def _compute_turnaround(since: Optional[datetime]):
+    T = ValuationRequestTransition
+    history = select(
+        T.valuation_request_id,
+        T.from_status,
+        T.to_status,
+        T.actor_id,
+        T.created_at,
+        func.lag(T.created_at).over(
+            partition_by=T.valuation_request_id, order_by=(T.created_at, T.id),
+        ).label('entered_at'),
+    )
+    if since is not None:
+        # The window needs each touched request's full history, not just the recent rows
+        recent = select(T.valuation_request_id).where(T.created_at >= since)
+        history = history.where(T.valuation_request_id.in_(recent))
+    h = history.subquery()
+
+    started = func.coalesce(h.c.entered_at, ValuationRequest.created_at)
+    hours = _hours_between(h.c.created_at, started).label('hours')
+    day = func.date(h.c.created_at).label('day')
+    q = (
+        db.session.query(day, func.coalesce(ValuationRequest.bank_id, 0), h.c.actor_id,
+                         func.count(), func.sum(hours), func.max(hours))
+        .join(ValuationRequest, ValuationRequest.id == h.c.valuation_request_id)
+        .join(User, and_(User.id == h.c.actor_id, User.role == 'company'))
+        .filter(h.c.from_status == 'pending', h.c.to_status != 'pending', started.isnot(None))
+    )
+    if since is not None:
+        q = q.filter(h.c.created_at >= since)
+    q = q.group_by(day, func.coalesce(ValuationRequest.bank_id, 0), h.c.actor_id)
+    return {
+        (_as_date(d), scope_id, str(company_id)): [cnt, total or 0.0, 0.0, peak]
+        for d, scope_id, company_id, cnt, total, peak in q
+    }
+
+
+def _compute_value(since: Optional[datetime]):
+    E = ValuationRequestEvent
+    q = (
+        db.session.query(E.created_at, E.payload, ValuationRequest.bank_id,
+                         ValuationRequest.company_id, ValuationRequest.requested_amount)
+        .join(ValuationRequest, ValuationRequest.id == E.valuation_request_id)
+        .filter(E.event_type == 'valuation_submitted', ValuationRequest.requested_amount > 0)
+    )
+    if since is not None:
+        q = q.filter(E.created_at >= since)
+    # The value lives in the event payload (JSON text), so this one sums in Python
+    acc = defaultdict(lambda: [0, 0.0, 0.0, None])
+    for created_at, payload, bank_id, company_id, requested in q:
+        try:
+            value = float(json.loads(payload or '{}').get('value'))
+        except (TypeError, ValueError):
+            continue
+        row = acc[(created_at.date(), bank_id or 0, str(company_id or 0))]
+        ratio = value / requested
+        row[0] += 1
+        row[1] += value
+        row[2] += requested
+        # max_a: largest value/requested ratio
+        row[3] = ratio if row[3] is None else max(row[3], ratio)
+    return acc
+
+
+def _compute_volume(since: Optional[datetime]):
+    day = func.date(ValuationRequest.created_at).label('day')
+    scope = func.coalesce(ValuationRequest.bank_id, 0)
+    wilaya = func.coalesce(ValuationRequest.wilaya, UNKNOWN_WILAYA)
+    q = (
+        db.session.query(day, scope, wilaya, func.count(ValuationRequest.id))
+        .filter(ValuationRequest.created_at.isnot(None))
+    )
+    if since is not None:
+        q = q.filter(ValuationRequest.created_at >= since)
+    q = q.group_by(day, scope, wilaya)
+    return {(_as_date(d), scope_id, w): [cnt, 0.0, 0.0, None] for d, scope_id, w, cnt in q}
+
+
+def _compute_visits(since: Optional[datetime]):
+    A = VisitAppointment
+    day = func.date(A.proposed_time).label('day')
+    scope = func.coalesce(ValuationRequest.bank_id, 0)
+    lead = _hours_between(A.proposed_time, A.created_at)
+    q = (
+        db.session.query(day, scope, ValuationRequest.company_id,
+                         func.count(A.id), func.sum(lead), func.max(lead))
+        .join(ValuationRequest, ValuationRequest.id == A.valuation_request_id)
+        .filter(A.status == 'final')
+    )
+    if since is not None:
+        q = q.filter(A.proposed_time >= since)
+    q = q.group_by(day, scope, ValuationRequest.company_id)
+    return {
+        (_as_date(d), scope_id, str(company_id or 0)): [cnt, total or 0.0, 0.0, peak]
+        for d, scope_id, company_id, cnt, total, peak in q
+    }
+
+
+METRICS = {
+    METRIC_TURNAROUND: _compute_turnaround,
+    METRIC_VALUE: _compute_value,
+    METRIC_VOLUME: _compute_volume,
+    METRIC_VISITS: _compute_visits,
+}
+
+
+# ---- refresh ----
+def _refresh_metric(metric: str, now: datetime, full: bool) -> int:
+    mark = db.session.get(AnalyticsWatermark, metric)
+    if mark is None or full:
+        since = None
+    else:
+        refresh_days = int(current_app.config.get('ANALYTICS_REFRESH_DAYS', 2))
+        since = datetime.combine(mark.refreshed_at.date() - timedelta(days=refresh_days), datetime.min.time())
+
+    rows = METRICS[metric](since)
+    table = AnalyticsBucket.__table__
+    delete = table.delete().where(table.c.metric == metric)
+    if since is not None:
+        delete = delete.where(table.c.day >= since.date())
+    db.session.execute(delete)
+    if rows:
+        db.session.execute(table.insert(), [
+            {'metric': metric, 'day': d, 'scope_id': scope_id, 'dim': dim,
+             'count': cnt, 'sum_a': sum_a, 'sum_b': sum_b, 'max_a': max_a}
+            for (d, scope_id, dim), (cnt, sum_a, sum_b, max_a) in rows.items()
+        ])
+    if mark is None:
+        db.session.add(AnalyticsWatermark(metric=metric, refreshed_at=now))
+    else:
+        mark.refreshed_at = now
+    return len(rows)
+
+
+def refresh_analytics(force: bool = False, full: bool = False) -> bool:
+    """Bring the day buckets up to date; returns False when they were still fresh."""
+    ttl = int(current_app.config.get('ANALYTICS_TTL_SECONDS', 300))
+    now = datetime.utcnow()
+    if not (force or full):
+        oldest = db.session.query(func.min(AnalyticsWatermark.refreshed_at)).scalar()
+        known = db.session.query(func.count(AnalyticsWatermark.metric)).scalar()
+        if known == len(METRICS) and oldest and (now - oldest).total_seconds() < ttl:
+            return False
+    if not _refresh_lock.acquire(blocking=False):
+        return False  # another thread of this worker is already refreshing
+    try:
+        # Recount from the primary so buckets never trail the read replica
+        with use_primary():
+            for metric in METRICS:
+                _refresh_metric(metric, now, full)
+            db.session.commit()
+    except IntegrityError:
+        # Another worker refreshed the same days concurrently; its buckets stand
+        db.session.rollback()
+        return False
+    finally:
+        _refresh_lock.release()
+    return True
+
+
+# ---- reports ----
+def period_from_args(args) -> Tuple[date, date]:
+    """(start, end) dates from ?from=YYYY-MM-DD&to=YYYY-MM-DD, defaulting to the last ANALYTICS_DEFAULT_DAYS."""
+    end = start = None
+    try:
+        if args.get('to'):
+            end = date.fromisoformat(args.get('to'))
+        if args.get('from'):
+            start = date.fromisoformat(args.get('from'))
+    except ValueError:
+        pass
+    end = end or datetime.utcnow().date()
+    if start is None or start > end:
+        start = end - timedelta(days=int(current_app.config.get('ANALYTICS_DEFAULT_DAYS', 30)) - 1)
+    return start, end
+
+
+def _sum_buckets(metric: str, group_col, start: date, end: date, bank_id: Optional[int]):
+    B = AnalyticsBucket
+    q = (
+        db.session.query(group_col, func.sum(B.count), func.sum(B.sum_a), func.sum(B.sum_b), func.max(B.max_a))
+        .filter(B.metric == metric, B.day >= start, B.day <= end)
+    )
+    if bank_id is not None:
+        q = q.filter(B.scope_id == bank_id)
+    return q.group_by(group_col).all()
+
+
+def _names(ids) -> Dict[int, str]:
+    ids = {int(i) for i in ids if i and int(i)}
+    if not ids:
+        return {}
+    return dict(db.session.query(User.id, User.name).filter(User.id.in_(ids)).all())
+
+
+def _avg(total, count) -> Optional[float]:
+    return round(total / count, 2) if count else None
+
+
+def analytics_report(start: date, end: date, bank_id: Optional[int] = None) -> dict:
+    """JSON-ready report over [start, end]; `bank_id` limits it to one bank's requests."""
+    B = AnalyticsBucket
+    turnaround = _sum_buckets(METRIC_TURNAROUND, B.dim, start, end, bank_id)
+    visits = _sum_buckets(METRIC_VISITS, B.dim, start, end, bank_id)
+    # Admins compare banks; a bank compares the companies valuing its requests
+    value_group = B.dim if bank_id is not None else B.scope_id
+    value = _sum_buckets(METRIC_VALUE, value_group, start, end, bank_id)
+    volume = _sum_buckets(METRIC_VOLUME, B.dim, start, end, bank_id)
+    names = _names([r[0] for r in turnaround] + [r[0] for r in visits] + [r[0] for r in value])
+
+    def company_rows(rows, count_key):
+        out = [{
+            'company_id': int(dim),
+            'company': names.get(int(dim), '-'),
+            count_key: int(cnt),
+            'avg_hours': _avg(total, cnt),
+            'max_hours': round(peak, 2) if peak is not None else None,
+        } for dim, cnt, total, _, peak in rows]
+        return sorted(out, key=lambda r: -r[count_key])
+
+    value_rows = []
+    for key, cnt, total_value, total_requested, peak in value:
+        entry = {
+            'valuations': int(cnt),
+            'value_total': round(total_value, 2),
+            'requested_total': round(total_requested, 2),
+            'value_to_requested': round(total_value / total_requested, 4) if total_requested else None,
+            'max_ratio': round(peak, 4) if peak is not None else None,
+        }
+        label = 'company' if bank_id is not None else 'bank'
+        entry[f'{label}_id'] = int(key)
+        entry[label] = names.get(int(key), '-')
+        value_rows.append(entry)
+    value_rows.sort(key=lambda r: -r['valuations'])
+
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'turnaround': company_rows(turnaround, 'requests'),
+        'value_vs_requested': value_rows,
+        'volume_by_wilaya': sorted(
+            ({'wilaya': dim or None, 'requests': int(cnt)} for dim, cnt, _, _, _ in volume),
+            key=lambda r: -r['requests'],
+        ),
+        'visits': company_rows(visits, 'visits'),
+    }
+
+
+@click.command('rebuild-analytics')
+@with_appcontext
+def rebuild_analytics_command() -> None:
+    """Recompute every analytics day bucket from scratch."""
+    refresh_analytics(full=True)
+    click.echo(f"{db.session.query(func.count()).select_from(AnalyticsBucket).scalar()} bucket(s) rebuilt")
+
+
+def init_app(app) -> None:
+    app.cli.add_command(rebuild_analytics_command)
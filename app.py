@@ -3,7 +3,6 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 from flask_login import LoginManager, current_user, login_required
 from models import db, User, ValuationRequest, BankProfile, BankOffer
-from sqlalchemy import inspect, text
 from authlib.integrations.flask_client import OAuth  # ✅ ضروري
 from config import Config
 from dotenv import load_dotenv
@@ -31,22 +30,39 @@ def create_app() -> Flask:
     app.config.from_object(Config)
     # Respect proxy headers
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1)
+    # SQLite pragmas and pool settings must be in place before the engine is created
+    import db_tuning
+    db_tuning.init_app(app)
     db.init_app(app)
-
-    # Arabic labels for request document types and Jinja filter
-    DOC_TYPE_LABELS_AR = {
-        "ids": "بطاقات هوية",
-        "kroki": "كروكي",
-        "deed": "صك الملكية",
-        "completion_certificate": "شهادة إتمام البناء",
-        "maps": "خرائط",
-        "contractor_agreement": "اتفاقية المقاول",
-    }
+    import db_routing
+    db_routing.init_app(app)
+    import sql_stats
+    sql_stats.init_app(app)
+    from realtime import bus
+    bus.init_app(app)
+    from rollups import verifier as rollup_verifier
+    rollup_verifier.init_app(app)
+    import analytics
+    analytics.init_app(app)
+    import company_directory
+    company_directory.init_app(app)
+    from catalog import versions as catalog_versions
+    catalog_versions.init_app(app)
+    import index_audit
+    index_audit.init_app(app)
+    import migrations
+    migrations.init_app(app)
+
+    # Arabic labels for request document types (shared with the ZIP bundle names)
+    from utils import doc_label_ar as _doc_label_ar, status_label_ar as _status_label_ar
 
     @app.template_filter('doc_label_ar')
     def doc_label_ar(doc_type: str) -> str:
-        key = str(doc_type or "").strip()
-        return DOC_TYPE_LABELS_AR.get(key, key)
+        return _doc_label_ar(doc_type)
+
+    @app.template_filter('status_label_ar')
+    def status_label_ar(status: str) -> str:
+        return _status_label_ar(status)
 
     @app.template_filter('static_or_external')
     def static_or_external(path: str) -> str:
@@ -188,83 +204,9 @@ app = create_app()
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
-        # ----------------------------------------
-        # تحديث الجداول الموجودة كما في الكود الأصلي
-        # (لا يتم المساس بأي عملية حالية)
-        # ----------------------------------------
-        try:
-            inspector = inspect(db.engine)
-            cols = [c['name'] for c in inspector.get_columns('company_approved_banks')]
-            if 'limit_value' not in cols:
-                with db.engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE company_approved_banks ADD COLUMN limit_value FLOAT'))
-
-            user_cols = [c['name'] for c in inspector.get_columns('users')]
-            with db.engine.connect() as conn:
-                if 'oauth_provider' not in user_cols:
-                    conn.execute(text("ALTER TABLE users ADD COLUMN oauth_provider VARCHAR(50)"))
-                if 'oauth_subject' not in user_cols:
-                    conn.execute(text("ALTER TABLE users ADD COLUMN oauth_subject VARCHAR(255)"))
-                if 'email_verified' not in user_cols:
-                    conn.execute(text("ALTER TABLE users ADD COLUMN email_verified BOOLEAN DEFAULT 0 NOT NULL"))
-
-            ads_cols = [c['name'] for c in inspector.get_columns('advertisements')]
-            if 'stored_in_utc' not in ads_cols:
-                with db.engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE advertisements ADD COLUMN stored_in_utc BOOLEAN DEFAULT 0 NOT NULL'))
-
-            vr_cols = [c['name'] for c in inspector.get_columns('valuation_requests')]
-            if 'valuation_type' not in vr_cols:
-                with db.engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE valuation_requests ADD COLUMN valuation_type VARCHAR(50)'))
-            if 'requested_amount' not in vr_cols:
-                with db.engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE valuation_requests ADD COLUMN requested_amount FLOAT'))
-            if 'rejection_reason' not in vr_cols:
-                with db.engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE valuation_requests ADD COLUMN rejection_reason TEXT'))
-            if 'rejected_at' not in vr_cols:
-                with db.engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE valuation_requests ADD COLUMN rejected_at DATETIME'))
-
-            # Land prices
-            land_cols = [c['name'] for c in inspector.get_columns('land_prices')]
-            with db.engine.connect() as conn:
-                for col in ['wilaya','created_at','price_housing','price_commercial','price_industrial','price_agricultural','price_per_sqm','price_per_meter']:
-                    if col not in land_cols:
-                        conn.execute(text(f'ALTER TABLE land_prices ADD COLUMN {col} FLOAT'))
-
-            company_land_cols = [c['name'] for c in inspector.get_columns('company_land_prices')]
-            with db.engine.connect() as conn:
-                for col in ['created_at','price_housing','price_commercial','price_industrial','price_agricultural','price_per_sqm','price_per_meter']:
-                    if col not in company_land_cols:
-                        conn.execute(text(f'ALTER TABLE company_land_prices ADD COLUMN {col} FLOAT'))
-            # Seed default valuation purposes if table exists and empty
-            try:
-                # Check table existence
-                tables = [r[0] for r in inspector.get_table_names()]
-                if 'valuation_purposes' in tables:
-                    from models import ValuationPurpose
-                    if ValuationPurpose.query.count() == 0:
-                        defaults = [
-                            # Entity: person -> go to property inputs
-                            dict(entity='person', key='existing_property', display_name='تثمين عقار قائم', param_value='تثمين عقار قائم', next_action='property_inputs', icon_path='img/1.png', sort_order=1),
-                            dict(entity='person', key='land', display_name='تثمين أرض', param_value='تثمين أرض', next_action='property_inputs', icon_path='img/2.png', sort_order=2),
-                            dict(entity='person', key='build_property', display_name='تثمين بناء عقار', param_value='تثمين بناء عقار', next_action='property_inputs', icon_path='img/3.png', sort_order=3),
-                            # Entity: company -> go to bank selection
-                            dict(entity='company', key='sell', display_name='بيع', param_value='sell', next_action='bank', icon_path=None, sort_order=1),
-                            dict(entity='company', key='buy', display_name='شراء', param_value='buy', next_action='bank', icon_path=None, sort_order=2),
-                            dict(entity='company', key='reports', display_name='تقارير مالية', param_value='reports', next_action='bank', icon_path=None, sort_order=3),
-                            dict(entity='company', key='refinance', display_name='إعادة تمويل', param_value='refinance', next_action='bank', icon_path=None, sort_order=4),
-                        ]
-                        for d in defaults:
-                            db.session.add(ValuationPurpose(**d))
-                        db.session.commit()
-            except Exception:
-                pass
-        except Exception:
-            pass
+        # Same migrations gunicorn runs through create_app(); a no-op once applied
+        from migrations import run_migrations
+        run_migrations()
 
         # إنشاء مدير النظام إذا لم يوجد
         if User.query.filter_by(role='admin').count() == 0:
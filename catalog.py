@@ -0,0 +1,138 @@
+"""Versioned public catalogs (/api/banks, /api/companies, /api/testimonials).
+
+Each catalog has a version token stored in a small file under
+CATALOG_VERSION_DIR, shared by all worker processes. Committing a change to
+a bank, company or testimonial bumps the token (session hooks below). The
+APIs answer with a pre-serialized body cached per process and a strong ETag
+built from the token. A matching If-None-Match gets a 304 from the token
+alone, without touching the database.
+"""
+from typing import Callable, Dict, Optional, Tuple
+import logging
+import os
+import secrets
+import threading
+import time
+from flask import Response, current_app, request
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import Session
+from models import User, BankProfile, CompanyProfile, Testimonial
+
+log = logging.getLogger(__name__)
+
+CATALOG_BANKS = 'banks'
+CATALOG_COMPANIES = 'companies'
+CATALOG_TESTIMONIALS = 'testimonials'
+
+# role of a User row -> catalog listing it
+_ROLE_CATALOGS = {'bank': CATALOG_BANKS, 'company': CATALOG_COMPANIES}
+_MODEL_CATALOGS = {
+    BankProfile: CATALOG_BANKS,
+    CompanyProfile: CATALOG_COMPANIES,
+    Testimonial: CATALOG_TESTIMONIALS,
+}
+_MAX_CACHED_BODIES = 64
+
+
+class CatalogVersions:
+    """Per-catalog version tokens in files, plus the per-process body cache."""
+
+    def __init__(self):
+        self._dir = None
+        self._lock = threading.Lock()
+        self._bodies: Dict[Tuple[str, str], Tuple[str, bytes]] = {}
+
+    def init_app(self, app) -> None:
+        self._dir = app.config.get('CATALOG_VERSION_DIR')
+        os.makedirs(self._dir, exist_ok=True)
+        app.extensions['catalog_versions'] = self
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._dir, f'{name}.version')
+
+    def current(self, name: str) -> str:
+        try:
+            with open(self._path(name), 'r', encoding='ascii') as fh:
+                token = fh.read().strip()
+            if token:
+                return token
+        except FileNotFoundError:
+            pass
+        return self.bump(name)
+
+    def bump(self, name: str) -> str:
+        token = f'{time.time_ns():x}{secrets.token_hex(3)}'
+        if self._dir is None:
+            return token
+        # Write then rename so readers never see a half-written token
+        tmp = f'{self._path(name)}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='ascii') as fh:
+            fh.write(token)
+        os.replace(tmp, self._path(name))
+        return token
+
+    def body(self, name: str, variant: str, version: str, build: Callable[[], object]) -> bytes:
+        key = (name, variant)
+        with self._lock:
+            hit = self._bodies.get(key)
+        if hit and hit[0] == version:
+            return hit[1]
+        body = current_app.json.dumps(build()).encode('utf-8')
+        with self._lock:
+            if len(self._bodies) >= _MAX_CACHED_BODIES:
+                self._bodies.clear()
+            self._bodies[key] = (version, body)
+        return body
+
+
+versions = CatalogVersions()
+
+
+def catalog_response(name: str, build: Callable[[], object], variant: Optional[str] = None) -> Response:
+    """JSON response for a catalog with ETag/304 handling; `build()` runs only on a cache miss."""
+    version = versions.current(name)
+    etag = f'{name}-{version}' + (f'-{variant}' if variant else '')
+    max_age = int(current_app.config.get('CATALOG_MAX_AGE_SECONDS', 30))
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(versions.body(name, variant or '', version, build), mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = f'public, max-age={max_age}'
+    return resp
+
+
+# ---- invalidation ----
+def _catalogs_for(obj) -> set:
+    if isinstance(obj, User):
+        roles = {obj.role}
+        hist = sa_inspect(obj).attrs['role'].history
+        roles.update(hist.deleted or ())
+        return {_ROLE_CATALOGS[r] for r in roles if r in _ROLE_CATALOGS}
+    for model, name in _MODEL_CATALOGS.items():
+        if isinstance(obj, model):
+            return {name}
+    return set()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_catalog_changes(session, flush_context):
+    touched = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        touched |= _catalogs_for(obj)
+    if touched:
+        session.info.setdefault('catalog_bumps', set()).update(touched)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_catalogs(session):
+    for name in session.info.pop('catalog_bumps', ()):
+        try:
+            versions.bump(name)
+        except OSError:
+            log.exception('could not bump catalog version %s', name)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_catalog_changes(session):
+    session.info.pop('catalog_bumps', None)
@@ -0,0 +1,154 @@
+"""Denormalized company directory (company_directory).
+
+Company listings, pickers and the offers flow read one `CompanyDirectoryEntry`
+per company (name, logo, services excerpt, fee, limit, covered wilayas and
+per-bank limits) instead of loading every company `User` and lazily touching
+its profile, prices and approvals row by row.
+
+Entries are rebuilt by a session `after_flush` hook whenever a company user,
+its profile, land prices or bank approvals change, on the flushing
+connection so they commit or roll back together with the change.
+`rebuild_company_directory()` (also `flask rebuild-company-directory`)
+recomputes the whole table.
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, List, Optional, Set
+import json
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect as sa_inspect, select
+from sqlalchemy.orm import Session
+from models import (
+    db, User, CompanyProfile, CompanyLandPrice, CompanyApprovedBank, CompanyDirectoryEntry,
+)
+
+SERVICES_EXCERPT_CHARS = 120
+
+
+def _excerpt(text: Optional[str]) -> Optional[str]:
+    if not text:
+        return None
+    if len(text) <= SERVICES_EXCERPT_CHARS:
+        return text
+    return text[:SERVICES_EXCERPT_CHARS] + '...'
+
+
+def rebuild_entries(connection, user_ids: Optional[Iterable[int]] = None) -> int:
+    """Recompute directory rows for `user_ids` (all companies when None)."""
+    users, profiles = User.__table__, CompanyProfile.__table__
+    prices, approvals = CompanyLandPrice.__table__, CompanyApprovedBank.__table__
+    directory = CompanyDirectoryEntry.__table__
+    ids = None if user_ids is None else sorted({int(i) for i in user_ids if i})
+    if ids is not None and not ids:
+        return 0
+
+    base = (
+        select(users.c.id, users.c.name, profiles.c.id.label('profile_id'), profiles.c.logo_path,
+               profiles.c.services, profiles.c.valuation_fee, profiles.c.limit_value)
+        .select_from(users.outerjoin(profiles, profiles.c.user_id == users.c.id))
+        .where(users.c.role == 'company')
+    )
+    wilaya_q = (
+        select(profiles.c.user_id, prices.c.wilaya).distinct()
+        .select_from(prices.join(profiles, profiles.c.id == prices.c.company_profile_id))
+    )
+    approval_q = (
+        select(profiles.c.user_id, approvals.c.bank_user_id, approvals.c.limit_value)
+        .select_from(approvals.join(profiles, profiles.c.id == approvals.c.company_profile_id))
+    )
+    delete = directory.delete()
+    if ids is not None:
+        base = base.where(users.c.id.in_(ids))
+        wilaya_q = wilaya_q.where(profiles.c.user_id.in_(ids))
+        approval_q = approval_q.where(profiles.c.user_id.in_(ids))
+        delete = delete.where(directory.c.user_id.in_(ids))
+
+    wilayas = defaultdict(set)
+    for user_id, wilaya in connection.execute(wilaya_q):
+        wilayas[user_id].add(wilaya)
+    bank_limits = defaultdict(dict)
+    for user_id, bank_user_id, limit in connection.execute(approval_q):
+        bank_limits[user_id][str(bank_user_id)] = limit
+
+    now = datetime.utcnow()
+    rows = [{
+        'user_id': r.id,
+        'profile_id': r.profile_id,
+        'name': r.name,
+        'logo_path': r.logo_path or None,
+        'services_excerpt': _excerpt(r.services),
+        'valuation_fee': r.valuation_fee,
+        'limit_value': r.limit_value,
+        'wilayas': json.dumps(sorted(wilayas[r.id]), ensure_ascii=False),
+        'bank_limits': json.dumps(bank_limits[r.id]),
+        'updated_at': now,
+    } for r in connection.execute(base)]
+
+    connection.execute(delete)
+    if rows:
+        connection.execute(directory.insert(), rows)
+    return len(rows)
+
+
+# ---- change tracking ----
+def _attr(obj, name):
+    """Current value, or the pre-flush one for deleted objects."""
+    hist = sa_inspect(obj).attrs[name].history
+    if hist.deleted:
+        return hist.deleted[0]
+    return getattr(obj, name)
+
+
+def _touched_companies(session: Session) -> Set[int]:
+    user_ids, profile_ids = set(), set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            if obj.role == 'company' or _attr(obj, 'role') == 'company':
+                user_ids.add(obj.id)
+        elif isinstance(obj, CompanyProfile):
+            user_ids.add(_attr(obj, 'user_id'))
+        elif isinstance(obj, (CompanyLandPrice, CompanyApprovedBank)):
+            profile_ids.add(_attr(obj, 'company_profile_id'))
+    profile_ids.discard(None)
+    if profile_ids:
+        profiles = CompanyProfile.__table__
+        user_ids.update(session.connection().execute(
+            select(profiles.c.user_id).where(profiles.c.id.in_(profile_ids))
+        ).scalars())
+    user_ids.discard(None)
+    return user_ids
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_company_changes(session, flush_context):
+    user_ids = _touched_companies(session)
+    if user_ids:
+        rebuild_entries(session.connection(), user_ids)
+
+
+# ---- reads ----
+def directory_entries() -> List[CompanyDirectoryEntry]:
+    """All companies ordered by name (one scan of ix_company_directory_name)."""
+    return CompanyDirectoryEntry.query.order_by(CompanyDirectoryEntry.name.asc(), CompanyDirectoryEntry.user_id.asc()).all()
+
+
+def directory_entry(user_id: int) -> Optional[CompanyDirectoryEntry]:
+    return db.session.get(CompanyDirectoryEntry, user_id) if user_id else None
+
+
+def rebuild_company_directory() -> int:
+    count = rebuild_entries(db.session.connection())
+    db.session.commit()
+    return count
+
+
+@click.command('rebuild-company-directory')
+@with_appcontext
+def rebuild_directory_command() -> None:
+    """Recompute the denormalized company directory."""
+    click.echo(f"{rebuild_company_directory()} compan(y/ies) in directory")
+
+
+def init_app(app) -> None:
+    app.cli.add_command(rebuild_directory_command)
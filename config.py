@@ -6,6 +6,29 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'change-me-123')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', f'sqlite:///{os.path.join(basedir, "valuation.db")}')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Optional read replica (db_routing.py): read-only requests go to this bind. After a write the
+    # same browser reads from the primary for DB_STICKY_SECONDS (read-your-writes).
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    SQLALCHEMY_BINDS = {'replica': DATABASE_REPLICA_URL} if DATABASE_REPLICA_URL else {}
+    DB_STICKY_SECONDS = int(os.environ.get('DB_STICKY_SECONDS', '5'))
+    # Per-request SQL stats (sql_stats.py): Server-Timing header, debug log, and a warning when one
+    # statement shape runs more than SQL_REPEAT_THRESHOLD times in a request (N+1). Use a low
+    # threshold in development, a higher one in production.
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '1').lower() in ('1', 'true', 'yes')
+    SQL_REPEAT_THRESHOLD = int(os.environ.get('SQL_REPEAT_THRESHOLD', '10'))
+    SQL_SERVER_TIMING = os.environ.get('SQL_SERVER_TIMING', '1').lower() in ('1', 'true', 'yes')
+    # Engine tuning (db_tuning.py). SQLite: WAL journaling, lock wait before "database is locked",
+    # page cache (KiB) and memory-mapped I/O size. Pool settings apply to every backend;
+    # recycle/pre-ping only to server databases.
+    DB_SQLITE_WAL = os.environ.get('DB_SQLITE_WAL', '1').lower() in ('1', 'true', 'yes')
+    DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000'))
+    DB_SQLITE_CACHE_KB = int(os.environ.get('DB_SQLITE_CACHE_KB', '65536'))
+    DB_SQLITE_MMAP_BYTES = int(os.environ.get('DB_SQLITE_MMAP_BYTES', str(256 * 1024 * 1024)))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '30'))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes')
     # Timezone used to interpret naive datetime inputs from admin forms
     TIMEZONE = os.environ.get('TIMEZONE', 'Asia/Muscat')
     # Uploads
@@ -13,6 +36,50 @@ class Config:
     NEWS_UPLOAD_FOLDER = os.environ.get('NEWS_UPLOAD_FOLDER', os.path.join(basedir, 'static', 'uploads', 'news'))
     ADS_UPLOAD_FOLDER = os.environ.get('ADS_UPLOAD_FOLDER', os.path.join(basedir, 'static', 'uploads', 'ads'))
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 5 * 1024 * 1024))
+    # Resumable (chunked) uploads for large request documents.
+    # Each PATCH carries one chunk, so the chunk size must stay below MAX_CONTENT_LENGTH.
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+    UPLOAD_MAX_FILE_SIZE = int(os.environ.get('UPLOAD_MAX_FILE_SIZE', 50 * 1024 * 1024))
+    UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get('UPLOAD_SESSION_TTL_SECONDS', 24 * 3600))
+    # Partial files live outside 'static' so incomplete uploads are never served
+    UPLOAD_TMP_FOLDER = os.environ.get('UPLOAD_TMP_FOLDER', os.path.join(basedir, 'instance', 'upload_parts'))
+    # Ingestion stage (see ingest.py): photos larger than this are downscaled, EXIF is stripped
+    INGEST_MAX_IMAGE_DIMENSION = int(os.environ.get('INGEST_MAX_IMAGE_DIMENSION', '2560'))
+    INGEST_JPEG_QUALITY = int(os.environ.get('INGEST_JPEG_QUALITY', '82'))
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', '4'))
+    # Documents ZIP bundle: how many B2-hosted files may download ahead of the stream
+    DOCUMENTS_ZIP_PREFETCH = int(os.environ.get('DOCUMENTS_ZIP_PREFETCH', '3'))
+    # Conversation SSE stream: heartbeat interval and max lifetime before the browser reconnects
+    SSE_KEEPALIVE_SECONDS = int(os.environ.get('SSE_KEEPALIVE_SECONDS', '20'))
+    SSE_MAX_STREAM_SECONDS = int(os.environ.get('SSE_MAX_STREAM_SECONDS', '300'))
+    SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', '3000'))
+    # Realtime event bus (realtime.py): 'local' = single process,
+    # 'db' = shared change feed table so every gunicorn worker sees every event
+    EVENT_BUS = os.environ.get('EVENT_BUS', 'db')
+    EVENT_BUS_POLL_INTERVAL = float(os.environ.get('EVENT_BUS_POLL_INTERVAL', '0.25'))
+    EVENT_BUS_RETENTION_SECONDS = int(os.environ.get('EVENT_BUS_RETENTION_SECONDS', '600'))
+    # How long a poller keeps re-checking ids that committed out of order (PostgreSQL)
+    EVENT_BUS_GAP_SECONDS = float(os.environ.get('EVENT_BUS_GAP_SECONDS', '30'))
+    # Conversation history: messages per page on the detail page and the API cap for ?limit=
+    MESSAGES_PAGE_SIZE = int(os.environ.get('MESSAGES_PAGE_SIZE', '50'))
+    MESSAGES_PAGE_MAX = int(os.environ.get('MESSAGES_PAGE_MAX', '200'))
+    # Admin dashboard: seconds the aggregate counts are reused, and days shown in the trend table
+    ADMIN_STATS_TTL_SECONDS = int(os.environ.get('ADMIN_STATS_TTL_SECONDS', '30'))
+    ADMIN_TREND_DAYS = int(os.environ.get('ADMIN_TREND_DAYS', '14'))
+    # Dashboard status counters (rollups.py): seconds between drift checks per worker, 0 = only `flask verify-rollups`
+    ROLLUP_VERIFY_INTERVAL_SECONDS = int(os.environ.get('ROLLUP_VERIFY_INTERVAL_SECONDS', '3600'))
+    # Analytics (analytics.py): seconds between incremental refreshes, trailing days recomputed on each
+    # refresh, and default report window in days
+    ANALYTICS_TTL_SECONDS = int(os.environ.get('ANALYTICS_TTL_SECONDS', '300'))
+    ANALYTICS_REFRESH_DAYS = int(os.environ.get('ANALYTICS_REFRESH_DAYS', '2'))
+    ANALYTICS_DEFAULT_DAYS = int(os.environ.get('ANALYTICS_DEFAULT_DAYS', '30'))
+    # Public catalog APIs (catalog.py): shared version-token folder and browser cache lifetime
+    CATALOG_VERSION_DIR = os.environ.get('CATALOG_VERSION_DIR', os.path.join(basedir, 'instance', 'catalog_versions'))
+    CATALOG_MAX_AGE_SECONDS = int(os.environ.get('CATALOG_MAX_AGE_SECONDS', '30'))
+    # Schema migrations (migrations.py): apply pending steps when the app starts, and the
+    # lock file serializing concurrent starters (PostgreSQL uses an advisory lock instead)
+    AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', '1').lower() in ('1', 'true', 'yes')
+    MIGRATION_LOCK_FILE = os.environ.get('MIGRATION_LOCK_FILE', os.path.join(basedir, 'instance', 'migrate.lock'))
     # Mail settings (SMTP)
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', '587'))
@@ -0,0 +1,155 @@
+"""Detect attempts to share external contact details inside conversations.
+
+Messages are normalized (Arabic-Indic and full-width digits folded to ASCII,
+zero-width/bidi characters and tatweel removed, lower-cased) and scanned with
+one combined pattern compiled at import time.
+
+Python's regex engine tries every alternative at every position, which is
+slow on long Arabic text, so cheap C-level gates run first: the combined
+pattern is only evaluated when the text has enough digits, a trigger
+substring, or a domain-like suffix. Ordinary messages cost a few microseconds.
+
+Run `python contact_filter.py` to check the sample corpus and time the detector.
+"""
+import re
+
+# ---- normalization table (built once) ----
+_FOLD = {}
+for _i in range(10):
+    _FOLD[0x0660 + _i] = str(_i)  # Arabic-Indic ٠-٩
+    _FOLD[0x06F0 + _i] = str(_i)  # Extended Arabic-Indic (Persian/Urdu) ۰-۹
+    _FOLD[0xFF10 + _i] = str(_i)  # Full-width ０-９
+for _cp in (0x00AD, 0x061C, 0x180E, 0x200B, 0x200C, 0x200D, 0x200E, 0x200F,
+            0x202A, 0x202B, 0x202C, 0x202D, 0x202E, 0x2060, 0x2066, 0x2067,
+            0x2068, 0x2069, 0xFEFF, 0x0640):
+    # zero-width, soft hyphen, bidi marks and Arabic tatweel (واتـــساب)
+    _FOLD[_cp] = None
+_FOLD[0xFF20] = '@'   # full-width ＠
+_FOLD[0xFF0E] = '.'   # full-width ．
+_FOLD[0x066B] = '.'   # Arabic decimal separator
+del _i, _cp
+# Only characters that the table changes; translate() is skipped when none occur
+_NEEDS_FOLD = re.compile('[' + ''.join(re.escape(chr(cp)) for cp in sorted(_FOLD)) + ']')
+
+# ---- combined detector (compiled once) ----
+# Digits may be spaced out or separated by punctuation: "9 1 2 3-4567 8".
+# A single '.' followed by 1-3 digits that end the number is a decimal point,
+# not a separator, so "150000.00" stays an amount; "92.34.56.78" does not.
+# A bare date (2025-03-14) is not a phone number.
+_PHONE_SEP = (r"(?:[\s\-\(\)/_]"
+              r"|\.(?!\d{1,3}(?![\s\-\.\(\)/_]*\d))"
+              r"|(?:(?<=\.\d)|(?<=\.\d\d)|(?<=\.\d\d\d))\.)")
+_PHONE = (r"(?<!\d)(?!\d{4}[-/.]\d{1,2}[-/.]\d{1,2}(?![\s\-\.\(\)/_]*\d))\+?\d"
+          rf"(?:{_PHONE_SEP}*\d){{7,}}")
+_EMAIL = r"[a-z0-9_.+\-]+\s*(?:@|\(at\)|\[at\])\s*[a-z0-9\-]+(?:\s*(?:\.|\(dot\)|\[dot\])\s*[a-z0-9\-]+)+"
+_URL = r"https?://|www\.|\b(?:wa|t)\.me\b|\b[a-z0-9\-]+\.(?:com|net|org|me|ly|io|om)\b"
+_APPS = (
+    r"whats\s*(?:app)?|\bwhats\b|chat\.whatsapp|telegram|\bsms\b|\bsnap(?:chat)?\b"
+    r"|وا?تس\s*ا?ب|الواتس|واتس|تيليجرام|تلغرام|تلجرام|سناب"
+)
+_DETECTOR = re.compile("|".join(f"(?:{p})" for p in (_PHONE, _EMAIL, _URL, _APPS)))
+
+# ---- gates: a match is impossible unless one of these holds ----
+_PHONE_MIN_DIGITS = 8
+_TRIGGERS = (
+    '@', '(at)', '[at]', '://', 'www.', 'wa.me', 't.me', 'whats', 'telegram', 'sms', 'snap',
+    'واتس', 'وتس', 'تيليجرام', 'تلغرام', 'تلجرام', 'سناب',
+)
+# Literal-prefixed, so the engine jumps straight to each '.'
+_DOMAIN_SUFFIX = re.compile(r"\.(?:com|net|org|me|ly|io|om)\b")
+_DIGITS = '0123456789'
+
+
+def normalize(text: str) -> str:
+    text = (text or '').lower()
+    if _NEEDS_FOLD.search(text):
+        text = text.translate(_FOLD)
+    return text
+
+
+def _may_contain_contact(text: str) -> bool:
+    if sum(map(text.count, _DIGITS)) >= _PHONE_MIN_DIGITS:
+        return True
+    for trigger in _TRIGGERS:
+        if trigger in text:
+            return True
+    return _DOMAIN_SUFFIX.search(text) is not None
+
+
+def find_external_contact(text: str):
+    """Return the first matched fragment (normalized), or None."""
+    text = normalize(text)
+    if not _may_contain_contact(text):
+        return None
+    m = _DETECTOR.search(text)
+    return m.group(0) if m else None
+
+
+def contains_external_contact(text: str) -> bool:
+    return find_external_contact(text) is not None
+
+
+# (message, should_block) — obfuscations seen in conversations plus ordinary
+# messages that must keep passing (amounts, dates, plot numbers).
+SAMPLE_CORPUS = [
+    ("تواصل معي على 91234567", True),
+    ("رقمي ٩١٢٣٤٥٦٧", True),
+    ("رقمي ۹۱۲۳۴۵۶۷", True),
+    ("+968 9123 4567", True),
+    ("9 1 2 3 4 5 6 7", True),
+    ("9-1-2-3-4-5-6-7", True),
+    ("٩ ١ ٢ ٣ ٤ ٥ ٦ ٧", True),
+    ("9​1​2​3​4​5​6​7", True),
+    ("(968) 9123-4567", True),
+    ("ali@example.com", True),
+    ("ali (at) example (dot) com", True),
+    ("ALI＠EXAMPLE．COM", True),
+    ("https://example.com/x", True),
+    ("www.example.com", True),
+    ("wa.me/96891234567", True),
+    ("t.me/someone", True),
+    ("كلمني واتساب", True),
+    ("كلمني وتساب", True),
+    ("واتـــساب", True),
+    ("واتس اب", True),
+    ("whatsapp me", True),
+    ("WhatsApp", True),
+    ("send sms", True),
+    ("telegram please", True),
+    ("ضيفني سناب", True),
+    ("mysite.om", True),
+    ("القيمة التقديرية 150000 ريال", False),
+    ("المساحة 600 متر مربع", False),
+    ("رقم القطعة 1234/5 في الموالح", False),
+    ("الموعد 2025-03-14 الساعة 10:30", False),
+    ("الموعد ٢٠٢٥/٠٣/١٤", False),
+    ("2025-03-14 91234567", True),
+    ("تم رفض طلب التثمين #42. السبب: نقص المستندات", False),
+    ("شكراً لكم، بانتظار التقرير", False),
+    ("Thanks, see you at the site visit", False),
+    ("السعر ١٢٠٠٠٠ ريال عماني", False),
+    ("مبلغ القرض 85000 والقيمة 120000", False),
+    ("pay 150000.00 OMR", False),
+    ("القيمة 1250000.5 ريال", False),
+    ("الرسوم 1,250,000.500 ريال", False),
+    ("المبلغ ١٢٥٠٠٠٠٫٧٥ ريال عماني", False),
+    ("92.34.56.78", True),
+    ("9123.4567", True),
+]
+
+
+if __name__ == '__main__':  # pragma: no cover - manual benchmark
+    import timeit
+
+    failures = [(t, want) for t, want in SAMPLE_CORPUS if contains_external_contact(t) != want]
+    for text, want in failures:
+        print(f"MISMATCH expected={want}: {text!r} -> {find_external_contact(text)!r}")
+    print(f"corpus: {len(SAMPLE_CORPUS) - len(failures)}/{len(SAMPLE_CORPUS)} correct")
+
+    long_clean = "شكراً لكم على المتابعة، بانتظار التقرير النهائي للعقار. " * 50
+    samples = [t for t, _ in SAMPLE_CORPUS] + [long_clean]
+    runs = 2000
+    total = timeit.timeit(lambda: [contains_external_contact(t) for t in samples], number=runs)
+    print(f"avg per message: {total / (runs * len(samples)) * 1e6:.2f} µs")
+    per_long = timeit.timeit(lambda: contains_external_contact(long_clean), number=runs) / runs
+    print(f"{len(long_clean)}-char clean message: {per_long * 1e6:.2f} µs")
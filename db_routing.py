@@ -0,0 +1,168 @@
+"""Read/write routing between the primary database and an optional read replica.
+
+When DATABASE_REPLICA_URL is set it becomes the `replica` bind, and
+`RoutingSession` (the session class of `models.db`) sends reads there:
+
+- GET/HEAD/OPTIONS requests read from the replica; views marked with
+  `@read_replica` (read-only POSTs) do too.
+- Flushes, INSERT/UPDATE/DELETE statements and everything after the first
+  write in a request go to the primary, as does any work outside a request
+  (CLI, migrations, background threads).
+- Read-your-writes: a request that commits a write sets a short-lived cookie
+  (DB_STICKY_SECONDS); the same browser then reads from the primary until
+  the replica has had time to catch up.
+- Views that read and then write on GET (get-or-create) are marked
+  `@read_primary`; `use_primary()` does the same for a block of code.
+
+Without a replica every query uses the single primary engine.
+
+Local testing with two SQLite files: `flask replica-sync --interval 1`
+copies the primary into the replica file every second (a stand-in for real
+replication, with its lag).
+"""
+from contextlib import contextmanager
+from functools import wraps
+import sqlite3
+import time
+import click
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask.cli import with_appcontext
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+PRIMARY = 'primary'
+REPLICA = 'replica'
+REPLICA_BIND = 'replica'
+STICKY_COOKIE = 'db_primary'
+_READ_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+
+def _current_route() -> str:
+    if not has_app_context():
+        return PRIMARY
+    return g.get('db_route', PRIMARY)
+
+
+def _sticky() -> bool:
+    return has_request_context() and STICKY_COOKIE in request.cookies
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends reads to the replica bind when allowed."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or self._flushing:
+            return engine
+        if getattr(clause, 'is_dml', False):
+            self.info['db_wrote'] = True
+            return engine
+        if self.info.get('db_wrote') or _current_route() != REPLICA:
+            return engine
+        engines = self._db.engines
+        replica = engines.get(REPLICA_BIND)
+        # Only the default bind has a replica
+        if replica is None or engine is not engines.get(None):
+            return engine
+        return replica
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_write(session, flush_context):
+    session.info['db_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_write(session):
+    if session.info.get('db_wrote') and has_request_context():
+        g.db_wrote = True
+
+
+# ---- explicit routing ----
+@contextmanager
+def _route(target: str):
+    previous = g.get('db_route', PRIMARY)
+    g.db_route = target
+    try:
+        yield
+    finally:
+        g.db_route = previous
+
+
+def use_primary():
+    """Context manager: read from the primary inside the block."""
+    return _route(PRIMARY)
+
+
+def use_replica():
+    """Context manager: read from the replica inside the block (unless this browser just wrote)."""
+    return _route(PRIMARY if _sticky() else REPLICA)
+
+
+def read_primary(view):
+    """View decorator for GET handlers that read then write (get-or-create)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with use_primary():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def read_replica(view):
+    """View decorator for read-only handlers on non-GET methods."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+# ---- replication stand-in (local testing) ----
+def sync_sqlite_replica() -> None:
+    """Copy the primary SQLite file into the replica file (online backup)."""
+    from models import db
+    primary, replica = db.engines[None].url, db.engines[REPLICA_BIND].url
+    source = sqlite3.connect(primary.database)
+    target = sqlite3.connect(replica.database)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+@click.command('replica-sync')
+@click.option('--interval', type=float, default=0, help='Repeat every N seconds (0 = copy once).')
+@with_appcontext
+def replica_sync_command(interval: float) -> None:
+    """Copy the primary SQLite database into the replica file."""
+    from models import db
+    replica = db.engines.get(REPLICA_BIND)
+    if replica is None:
+        raise click.UsageError('DATABASE_REPLICA_URL is not set')
+    if db.engine.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        raise click.UsageError('replica-sync only copies between SQLite files')
+    while True:
+        sync_sqlite_replica()
+        click.echo(f'replica synced at {time.strftime("%H:%M:%S")}')
+        if interval <= 0:
+            return
+        time.sleep(interval)
+
+
+def init_app(app) -> None:
+    app.cli.add_command(replica_sync_command)
+    if not app.config.get('DATABASE_REPLICA_URL'):
+        return
+
+    @app.before_request
+    def _choose_route():
+        if request.method in _READ_METHODS and not _sticky():
+            g.db_route = REPLICA
+
+    @app.after_request
+    def _stick_to_primary(response):
+        if g.get('db_wrote'):
+            seconds = int(current_app.config.get('DB_STICKY_SECONDS', 5))
+            response.set_cookie(STICKY_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,172 @@
+"""Query-plan audit of the hot lookups.
+
+`hot_queries()` mirrors the statements the busiest pages run (phone login,
+role lists, request dashboards, bank approvals, appointments, analytics).
+`flask index-audit` prints the database's plan for each one (EXPLAIN QUERY
+PLAN on SQLite, EXPLAIN on PostgreSQL) and marks full table scans, which is
+how the indexes of migration 9 (`hot_lookup_indexes`) were chosen. Run it
+again after adding a query to a hot path.
+
+`python index_audit.py` builds a synthetic database and times every hot
+query without and with those indexes.
+"""
+from datetime import datetime, timedelta
+from typing import List, Tuple
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from models import db, User, ValuationRequest, VisitAppointment, CompanyApprovedBank, CompanyProfile
+
+
+def hot_queries() -> List[Tuple[str, object]]:
+    """(label, statement) for the audited lookups; parameter values are representative only."""
+    VR, VA, CAB = ValuationRequest, VisitAppointment, CompanyApprovedBank
+    since = datetime.utcnow() - timedelta(days=2)
+    return [
+        ('phone login (auth.phone_entry, verify_otp, certified_offers)',
+         select(User).where(User.phone == '+96890000042').limit(1)),
+        ('users by role (admin lists)',
+         select(User).where(User.role == 'company').order_by(User.name, User.id).limit(25)),
+        ('company dashboard: pending requests',
+         select(VR).where(VR.company_id == 30, VR.status == 'pending').order_by(VR.id.desc())),
+        ('client dashboard: requests',
+         select(VR).where(VR.client_id == 1000).order_by(VR.id.desc()).limit(20)),
+        ('bank dashboard: requests by status',
+         select(VR).where(VR.bank_id == 5, VR.status == 'completed').order_by(VR.id.desc()).limit(20)),
+        ('admin requests: by status',
+         select(VR).where(VR.status == 'rejected').order_by(VR.id.desc()).limit(25)),
+        ('bank dashboard: approved companies',
+         select(CAB, CompanyProfile, User)
+         .join(CompanyProfile, CAB.company_profile_id == CompanyProfile.id)
+         .join(User, CompanyProfile.user_id == User.id)
+         .where(CAB.bank_user_id == 5)),
+        ('request appointments by status',
+         select(VA).where(VA.valuation_request_id == 4242, VA.status == 'pending')),
+        ('company dashboard: client proposals',
+         select(VA).join(VR, VA.valuation_request_id == VR.id)
+         .where(VR.company_id == 30, VA.status == 'pending', VA.proposed_by == 'client')
+         .order_by(VA.created_at.desc())),
+        ('analytics: final visits since',
+         select(VA.id, VA.proposed_time).where(VA.status == 'final', VA.proposed_time >= since)),
+    ]
+
+
+def explain(conn, statement) -> List[str]:
+    """Plan lines for `statement` on this connection's database."""
+    compiled = statement.compile(dialect=conn.dialect)
+    params = {k: (v.isoformat(' ') if isinstance(v, datetime) else v) for k, v in compiled.params.items()}
+    if conn.dialect.name == 'sqlite':
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled),
+                                    tuple(params[k] for k in compiled.positiontup))
+        return [row[-1] for row in rows]
+    rows = conn.exec_driver_sql('EXPLAIN ' + str(compiled), params)
+    return [row[0] for row in rows]
+
+
+def is_full_scan(plan_line: str) -> bool:
+    line = plan_line.strip()
+    if line.startswith('SCAN '):  # SQLite: "SCAN users" vs "SEARCH users USING INDEX ..."
+        return 'INDEX' not in line
+    return 'Seq Scan' in line  # PostgreSQL
+
+
+def audit(conn) -> List[Tuple[str, List[str]]]:
+    return [(label, explain(conn, stmt)) for label, stmt in hot_queries()]
+
+
+@click.command('index-audit')
+@with_appcontext
+def index_audit_command() -> None:
+    """Print query plans of the hot lookups and flag full table scans."""
+    scans = 0
+    with db.engine.connect() as conn:
+        for label, plan in audit(conn):
+            click.echo(label)
+            for line in plan:
+                full = is_full_scan(line)
+                scans += full
+                click.echo(f"  {'FULL SCAN ' if full else ''}{line}")
+    click.echo(f'{scans} full scan(s)')
+
+
+def init_app(app) -> None:
+    app.cli.add_command(index_audit_command)
+
+
+if __name__ == '__main__':  # pragma: no cover - manual benchmark
+    import os
+    import random
+    import tempfile
+    import time
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update({
+        'DATABASE_URL': 'sqlite:///' + os.path.join(tmp, 'audit.db'),
+        'AUTO_MIGRATE': '0',
+        'SQL_INSTRUMENTATION': '0',
+        'CATALOG_VERSION_DIR': os.path.join(tmp, 'catalog'),
+    })
+    from app import app
+    from migrations import _hot_lookup_indexes
+
+    NEW_INDEXES = ['ix_users_phone', 'ix_valuation_requests_status', 'ix_company_approved_banks_bank',
+                   'ix_visit_appointments_request_status', 'ix_visit_appointments_final_time']
+    USERS, COMPANIES, BANKS, REQUESTS, APPOINTMENTS = 50_000, 300, 20, 200_000, 100_000
+    REPEAT = 200
+
+    def seed(conn) -> None:
+        rnd = random.Random(7)
+        now = datetime.utcnow()
+        users = [{'id': i, 'name': f'user {i}', 'email': f'u{i}@example.com', 'password_hash': 'x',
+                  'email_verified': False,
+                  'role': 'bank' if i <= BANKS + 1 else 'company' if i <= BANKS + COMPANIES + 1 else 'client',
+                  'phone': f'+968{90000000 + i}' if rnd.random() < 0.3 else None}
+                 for i in range(2, USERS + 1)]
+        conn.execute(User.__table__.insert(), users)
+        company_ids = range(BANKS + 2, BANKS + COMPANIES + 2)
+        conn.execute(CompanyProfile.__table__.insert(), [{'id': c, 'user_id': c} for c in company_ids])
+        conn.execute(CompanyApprovedBank.__table__.insert(), [
+            {'company_profile_id': c, 'bank_user_id': b}
+            for c in company_ids for b in range(2, BANKS + 2) if rnd.random() < 0.5])
+        statuses = ['pending', 'completed', 'approved', 'rejected', 'revision_requested']
+        conn.execute(ValuationRequest.__table__.insert(), [
+            {'id': i, 'title': f'r{i}', 'client_id': rnd.randrange(BANKS + COMPANIES + 2, USERS),
+             'company_id': rnd.choice(company_ids), 'bank_id': rnd.randrange(2, BANKS + 2),
+             'status': rnd.choice(statuses), 'created_at': now - timedelta(minutes=i)}
+            for i in range(1, REQUESTS + 1)])
+        conn.execute(VisitAppointment.__table__.insert(), [
+            {'valuation_request_id': rnd.randrange(1, REQUESTS), 'proposed_by': rnd.choice(['client', 'company']),
+             'status': rnd.choice(['pending', 'accepted', 'rejected', 'final']),
+             'proposed_time': now - timedelta(hours=rnd.randrange(24 * 365)), 'created_at': now, 'updated_at': now}
+            for _ in range(APPOINTMENTS)])
+
+    def timings(conn) -> dict:
+        result = {}
+        for label, stmt in hot_queries():
+            started = time.perf_counter()
+            for _ in range(REPEAT):
+                conn.execute(stmt).fetchall()
+            result[label] = (time.perf_counter() - started) / REPEAT * 1000
+        return result
+
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as conn:
+            for name in NEW_INDEXES:
+                conn.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+            # Schema before migration 9
+            conn.exec_driver_sql('CREATE INDEX ix_visit_appointments_valuation_request_id '
+                                 'ON visit_appointments (valuation_request_id)')
+            seed(conn)
+        with db.engine.connect() as conn:
+            before = timings(conn)
+            scans_before = sum(is_full_scan(l) for _, plan in audit(conn) for l in plan)
+        _hot_lookup_indexes()
+        with db.engine.connect() as conn:
+            after = timings(conn)
+            scans_after = sum(is_full_scan(l) for _, plan in audit(conn) for l in plan)
+
+    print(f'{"query":62s} {"before":>10s} {"after":>10s}')
+    for label in before:
+        print(f'{label:62s} {before[label]:8.3f}ms {after[label]:8.3f}ms  x{before[label] / max(after[label], 1e-6):.0f}')
+    print(f'full scans: {scans_before} -> {scans_after}')
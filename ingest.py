@@ -0,0 +1,234 @@
+"""Upload ingestion stage: sniff, validate and compress files before storage.
+
+Every uploaded document or image passes through `ingest_upload` before it is
+handed to `utils.store_file_and_get_url`. The stage:
+
+- detects the real type from magic bytes (the filename extension is not trusted)
+- rejects truncated/corrupt images and PDFs cheaply
+- strips EXIF and downscales oversized photos to `INGEST_MAX_IMAGE_DIMENSION`
+- linearizes PDFs (fast web view) when pikepdf is available
+
+Work runs in a small thread pool so several files from one form are processed
+concurrently; Pillow and qpdf release the GIL for the heavy parts.
+"""
+from typing import Iterable, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import threading
+from flask import current_app
+from werkzeug.datastructures import FileStorage
+
+# Optional: image processing (Pillow)
+try:
+    from PIL import Image, ImageOps  # type: ignore
+    _HAS_PIL = True
+except Exception:  # pragma: no cover - optional dependency
+    Image = None  # type: ignore
+    ImageOps = None  # type: ignore
+    _HAS_PIL = False
+
+# Optional: PDF validation/linearization (pikepdf / qpdf)
+try:
+    import pikepdf  # type: ignore
+    _HAS_PIKEPDF = True
+except Exception:  # pragma: no cover - optional dependency
+    pikepdf = None  # type: ignore
+    _HAS_PIKEPDF = False
+
+
+class UploadRejected(ValueError):
+    """Raised when an upload is not a supported, readable file. Message is user-facing."""
+
+
+# kind -> allowed sniffed types
+DOCUMENT_TYPES = {'pdf', 'jpeg', 'png', 'gif', 'webp'}
+IMAGE_TYPES = {'jpeg', 'png', 'gif', 'webp'}
+
+_EXTENSIONS = {'pdf': 'pdf', 'jpeg': 'jpg', 'png': 'png', 'gif': 'gif', 'webp': 'webp'}
+_MIMETYPES = {
+    'pdf': 'application/pdf',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+}
+_PIL_FORMATS = {'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """Return the file type from its first bytes, or None if unsupported."""
+    if head.startswith(b'%PDF-'):
+        return 'pdf'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def with_extension(filename: str, file_type: str) -> str:
+    """Replace/append the extension so it matches the sniffed type.
+
+    Handles names like `kroki_1760114476_pdf` that lost their dot to secure_filename.
+    """
+    ext = _EXTENSIONS[file_type]
+    base, current = os.path.splitext(filename or '')
+    if not base:
+        base = filename or 'file'
+    if current.lower().lstrip('.') in (ext, file_type):
+        return f"{base}{current.lower()}"
+    if base.lower().endswith('_' + ext) or base.lower().endswith('_' + file_type):
+        base = base.rsplit('_', 1)[0] or base
+    return f"{base}.{ext}"
+
+
+def _check_pdf(data: bytes) -> None:
+    # Cheap structural check first: a complete PDF ends with an %%EOF marker
+    if b'%%EOF' not in data[-2048:]:
+        raise UploadRejected('ملف PDF غير مكتمل أو تالف')
+
+
+def _process_pdf(data: bytes) -> bytes:
+    _check_pdf(data)
+    if not _HAS_PIKEPDF:
+        return data
+    try:
+        with pikepdf.open(io.BytesIO(data)) as pdf:
+            if pdf.is_encrypted:
+                # Can't rewrite without the password; keep the original bytes
+                return data
+            out = io.BytesIO()
+            pdf.save(
+                out,
+                linearize=True,
+                compress_streams=True,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+            )
+    except pikepdf.PasswordError:
+        return data
+    except Exception:
+        raise UploadRejected('ملف PDF تالف ولا يمكن قراءته')
+    result = out.getvalue()
+    # Linearization adds a hint table; only accept it when it doesn't bloat the file
+    return result if len(result) <= int(len(data) * 1.05) else data
+
+
+def _check_image_trailer(data: bytes, file_type: str) -> None:
+    if file_type == 'jpeg' and b'\xff\xd9' not in data[-1024:]:
+        raise UploadRejected('الصورة غير مكتملة أو تالفة')
+    if file_type == 'png' and b'IEND' not in data[-64:]:
+        raise UploadRejected('الصورة غير مكتملة أو تالفة')
+
+
+def _process_image(data: bytes, file_type: str, max_dim: int, quality: int) -> bytes:
+    if not _HAS_PIL:
+        _check_image_trailer(data, file_type)
+        return data
+    try:
+        # verify() walks the structure without decoding pixels
+        with Image.open(io.BytesIO(data)) as probe:
+            probe.verify()
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception:
+        raise UploadRejected('الصورة تالفة ولا يمكن قراءتها')
+
+    # Animated GIFs are passed through untouched (GIF carries no EXIF)
+    if file_type == 'gif':
+        return data
+
+    has_metadata = bool(img.info.get('exif') or img.info.get('xmp'))
+    # Apply EXIF orientation before the metadata is dropped
+    img = ImageOps.exif_transpose(img)
+    resized = False
+    if max_dim and max(img.size) > max_dim:
+        img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        resized = True
+
+    fmt = _PIL_FORMATS[file_type]
+    save_kwargs = {'optimize': True}
+    if fmt == 'JPEG':
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        save_kwargs.update(quality=quality, progressive=True)
+    elif fmt == 'WEBP':
+        save_kwargs = {'quality': quality, 'method': 4}
+    out = io.BytesIO()
+    # No exif=... argument: the re-encoded file carries no EXIF/GPS metadata
+    img.save(out, format=fmt, **save_kwargs)
+    result = out.getvalue()
+    if not resized and not has_metadata and len(result) >= len(data):
+        return data
+    return result
+
+
+def _ingest_bytes(data: bytes, *, allowed: set, max_dim: int, quality: int) -> tuple:
+    file_type = sniff_type(data[:16])
+    if file_type is None or file_type not in allowed:
+        raise UploadRejected('نوع الملف غير مدعوم. المسموح: صور أو PDF' if 'pdf' in allowed else 'نوع الصورة غير مدعوم')
+    if file_type == 'pdf':
+        return file_type, _process_pdf(data)
+    return file_type, _process_image(data, file_type, max_dim, quality)
+
+
+def _get_executor(app) -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(app.config.get('INGEST_WORKERS', 4) or 1)
+                _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='ingest')
+    return _executor
+
+
+def _read_all(file_storage) -> bytes:
+    stream = file_storage.stream if hasattr(file_storage, 'stream') else file_storage
+    try:
+        stream.seek(0)
+    except Exception:
+        pass
+    return stream.read()
+
+
+def ingest_many(file_storages: Iterable, *, kind: str = 'document') -> List[FileStorage]:
+    """Validate and compress several uploads concurrently.
+
+    Returns new FileStorage objects (same order) whose filename extension and
+    mimetype match the detected content. Raises UploadRejected on the first bad file.
+    """
+    app = current_app._get_current_object()
+    allowed = IMAGE_TYPES if kind == 'image' else DOCUMENT_TYPES
+    max_dim = int(app.config.get('INGEST_MAX_IMAGE_DIMENSION', 2560) or 0)
+    quality = int(app.config.get('INGEST_JPEG_QUALITY', 82) or 82)
+
+    items = list(file_storages)
+    payloads = [_read_all(fs) for fs in items]
+    executor = _get_executor(app)
+    futures = [
+        executor.submit(_ingest_bytes, data, allowed=allowed, max_dim=max_dim, quality=quality)
+        for data in payloads
+    ]
+
+    results = []
+    for fs, fut in zip(items, futures):
+        file_type, data = fut.result()
+        results.append(FileStorage(
+            stream=io.BytesIO(data),
+            filename=with_extension(getattr(fs, 'filename', None) or 'file', file_type),
+            content_type=_MIMETYPES[file_type],
+            content_length=len(data),
+        ))
+    return results
+
+
+def ingest_upload(file_storage, *, kind: str = 'document') -> FileStorage:
+    """Single-file convenience wrapper around `ingest_many`."""
+    return ingest_many([file_storage], kind=kind)[0]
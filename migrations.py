@@ -0,0 +1,267 @@
+"""Versioned, idempotent schema migrations.
+
+`run_migrations()` runs once per deploy: `create_app()` calls it at startup
+(gunicorn and `python app.py` alike, unless AUTO_MIGRATE is off) and
+`flask migrate` runs it by hand. Applied versions are recorded in
+`schema_migrations`, so a fully migrated database costs one SELECT and no
+schema reflection; request handlers never inspect the schema.
+
+Concurrent starters (several gunicorn workers) serialize on a lock: a
+PostgreSQL advisory lock, or an flock() on MIGRATION_LOCK_FILE elsewhere.
+The first one applies pending steps, the others find nothing left to do.
+
+Adding a step: append `(version, name, function)` to MIGRATIONS. New tables
+are created by `db.create_all()`, which runs whenever a step is pending (a
+release that only adds a table still needs a step, even an empty one); steps
+add columns, indexes and data to databases that already exist. Every step
+must be safe to re-run on a database that already has its change.
+"""
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+import logging
+import os
+import re
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from models import db, SchemaMigration, ValuationRequest
+
+# Optional: flock() is POSIX-only; without it only the advisory lock (PostgreSQL) applies
+try:  # pragma: no cover - platform dependent
+    import fcntl
+    _HAS_FCNTL = True
+except Exception:  # pragma: no cover
+    fcntl = None  # type: ignore
+    _HAS_FCNTL = False
+
+log = logging.getLogger(__name__)
+
+_PG_LOCK_KEY = 0x66756164  # any constant shared by all app processes
+
+
+# ---- helpers ----
+def _add_columns(table: str, columns: List[Tuple[str, str]]) -> None:
+    """ALTER TABLE ... ADD COLUMN for each (name, type) the table lacks."""
+    existing = {c['name'] for c in inspect(db.engine).get_columns(table)}
+    with db.engine.begin() as conn:
+        for name, ddl_type in columns:
+            if name not in existing:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl_type}'))
+
+
+def _create_indexes(statements: List[str]) -> None:
+    with db.engine.begin() as conn:
+        for stmt in statements:
+            conn.execute(text(stmt))
+
+
+# ---- steps ----
+def _legacy_columns() -> None:
+    """Columns added to tables that predate them (formerly the ALTER block in app.py)."""
+    _add_columns('company_approved_banks', [('limit_value', 'FLOAT')])
+    _add_columns('users', [
+        ('oauth_provider', 'VARCHAR(50)'),
+        ('oauth_subject', 'VARCHAR(255)'),
+        ('email_verified', 'BOOLEAN DEFAULT FALSE NOT NULL'),
+    ])
+    _add_columns('advertisements', [('stored_in_utc', 'BOOLEAN DEFAULT FALSE NOT NULL')])
+    _add_columns('valuation_requests', [
+        ('valuation_type', 'VARCHAR(50)'),
+        ('requested_amount', 'FLOAT'),
+        ('rejection_reason', 'TEXT'),
+        ('rejected_at', 'TIMESTAMP'),
+        ('created_at', 'TIMESTAMP'),
+    ])
+    prices = [(c, 'FLOAT') for c in ('price_housing', 'price_commercial', 'price_industrial',
+                                      'price_agricultural', 'price_per_sqm', 'price_per_meter')]
+    _add_columns('land_prices', [('wilaya', 'VARCHAR(100)'), ('created_at', 'TIMESTAMP')] + prices)
+    _add_columns('company_land_prices', [('created_at', 'TIMESTAMP')] + prices)
+    # Formerly added lazily by /certified/offers and the company profile page
+    _add_columns('company_profiles', [('valuation_fee', 'FLOAT')])
+
+
+def _request_workflow_columns() -> None:
+    _add_columns('valuation_requests', [
+        ('status_changed_at', 'TIMESTAMP'),
+        ('wilaya', 'VARCHAR(100)'),
+    ])
+
+
+def _list_indexes() -> None:
+    """Indexes used by keyset-paginated lists (messages API, admin lists, company/client/bank dashboards)."""
+    _create_indexes([
+        'CREATE INDEX IF NOT EXISTS ix_valuation_requests_created_at ON valuation_requests (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_messages_conv_id ON messages (conversation_id, id)',
+        'CREATE INDEX IF NOT EXISTS ix_users_role_name ON users (role, name)',
+        'CREATE INDEX IF NOT EXISTS ix_valuation_requests_company_status ON valuation_requests (company_id, status, id)',
+        'CREATE INDEX IF NOT EXISTS ix_valuation_requests_client ON valuation_requests (client_id, id)',
+        'CREATE INDEX IF NOT EXISTS ix_valuation_requests_bank_status ON valuation_requests (bank_id, status, id)',
+    ])
+
+
+def _hot_lookup_indexes() -> None:
+    """Indexes for the full scans reported by `flask index-audit` (see index_audit.py)."""
+    _create_indexes([
+        'CREATE INDEX IF NOT EXISTS ix_users_phone ON users (phone) WHERE phone IS NOT NULL',
+        'CREATE INDEX IF NOT EXISTS ix_valuation_requests_status ON valuation_requests (status, id)',
+        'CREATE INDEX IF NOT EXISTS ix_company_approved_banks_bank ON company_approved_banks (bank_user_id, company_profile_id)',
+        'CREATE INDEX IF NOT EXISTS ix_visit_appointments_request_status ON visit_appointments (valuation_request_id, status)',
+        "CREATE INDEX IF NOT EXISTS ix_visit_appointments_final_time ON visit_appointments (proposed_time) WHERE status = 'final'",
+        # Superseded by ix_visit_appointments_request_status (same leading column)
+        'DROP INDEX IF EXISTS ix_visit_appointments_valuation_request_id',
+    ])
+
+
+def _message_search_index() -> None:
+    from search import ensure_message_search_index
+    ensure_message_search_index(db.engine)
+
+
+def _backfill_request_events() -> None:
+    """Rebuild the request timeline from the chat notices that carried it before valuation_request_events."""
+    from models import ValuationRequestEvent, Message
+    if ValuationRequestEvent.query.first() is not None:
+        return
+    notice_patterns = [
+        ('missing_docs', 'notes', re.compile(r'^طلب مستندات ناقصة بخصوص طلب التثمين #(\d+):\n(.*)$', re.S)),
+        ('rejected', 'reason', re.compile(r'^تم رفض طلب التثمين #(\d+)\. السبب:\n(.*)$', re.S)),
+    ]
+    legacy = Message.query.filter(
+        Message.content.like('طلب مستندات ناقصة%') | Message.content.like('تم رفض طلب التثمين%')
+    ).order_by(Message.id).all()
+    known_ids = {r[0] for r in db.session.query(ValuationRequest.id).all()}
+    for m in legacy:
+        for event_type, field, pattern in notice_patterns:
+            found = pattern.match(m.content or '')
+            if found and int(found.group(1)) in known_ids:
+                ev = ValuationRequestEvent.record(int(found.group(1)), event_type, m.sender_id,
+                                                  **{field: found.group(2).strip()})
+                ev.created_at = m.timestamp
+                break
+    db.session.commit()
+
+
+def _seed_valuation_purposes() -> None:
+    from models import ValuationPurpose
+    if ValuationPurpose.query.first() is not None:
+        return
+    defaults = [
+        # Entity: person -> go to property inputs
+        dict(entity='person', key='existing_property', display_name='تثمين عقار قائم', param_value='تثمين عقار قائم', next_action='property_inputs', icon_path='img/1.png', sort_order=1),
+        dict(entity='person', key='land', display_name='تثمين أرض', param_value='تثمين أرض', next_action='property_inputs', icon_path='img/2.png', sort_order=2),
+        dict(entity='person', key='build_property', display_name='تثمين بناء عقار', param_value='تثمين بناء عقار', next_action='property_inputs', icon_path='img/3.png', sort_order=3),
+        # Entity: company -> go to bank selection
+        dict(entity='company', key='sell', display_name='بيع', param_value='sell', next_action='bank', icon_path=None, sort_order=1),
+        dict(entity='company', key='buy', display_name='شراء', param_value='buy', next_action='bank', icon_path=None, sort_order=2),
+        dict(entity='company', key='reports', display_name='تقارير مالية', param_value='reports', next_action='bank', icon_path=None, sort_order=3),
+        dict(entity='company', key='refinance', display_name='إعادة تمويل', param_value='refinance', next_action='bank', icon_path=None, sort_order=4),
+    ]
+    for d in defaults:
+        db.session.add(ValuationPurpose(**d))
+    db.session.commit()
+
+
+def _build_status_rollups() -> None:
+    from rollups import verify_status_rollups
+    verify_status_rollups()
+
+
+def _build_company_directory() -> None:
+    from company_directory import rebuild_company_directory
+    rebuild_company_directory()
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[], None]]] = [
+    (1, 'legacy_columns', _legacy_columns),
+    (2, 'request_workflow_columns', _request_workflow_columns),
+    (3, 'list_indexes', _list_indexes),
+    (4, 'message_search_index', _message_search_index),
+    (5, 'backfill_request_events', _backfill_request_events),
+    (6, 'seed_valuation_purposes', _seed_valuation_purposes),
+    (7, 'build_status_rollups', _build_status_rollups),
+    (8, 'build_company_directory', _build_company_directory),
+    (9, 'hot_lookup_indexes', _hot_lookup_indexes),
+]
+
+
+# ---- runner ----
+def _applied_versions() -> set:
+    try:
+        return {v for (v,) in db.session.query(SchemaMigration.version)}
+    except (OperationalError, ProgrammingError):
+        # Fresh database: schema_migrations does not exist yet
+        db.session.rollback()
+        return set()
+
+
+def pending_migrations() -> List[Tuple[int, str, Callable[[], None]]]:
+    applied = _applied_versions()
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+@contextmanager
+def _migration_lock():
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:k)'), {'k': _PG_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:k)'), {'k': _PG_LOCK_KEY})
+        return
+    path = current_app.config.get('MIGRATION_LOCK_FILE')
+    if not (_HAS_FCNTL and path):
+        yield
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def run_migrations() -> List[str]:
+    """Apply pending migrations under the lock; returns the names applied."""
+    if not pending_migrations():
+        return []
+    applied = []
+    with _migration_lock():
+        # Re-read under the lock: another process may have finished meanwhile
+        todo = pending_migrations()
+        if todo:
+            db.create_all()
+        for version, name, step in todo:
+            log.info('applying migration %d %s', version, name)
+            step()
+            db.session.add(SchemaMigration(version=version, name=name))
+            db.session.commit()
+            applied.append(name)
+    return applied
+
+
+@click.command('migrate')
+@click.option('--status', is_flag=True, help='List pending migrations without applying them.')
+@with_appcontext
+def migrate_command(status: bool) -> None:
+    """Apply pending database migrations."""
+    if status:
+        todo = pending_migrations()
+        for version, name, _ in todo:
+            click.echo(f'pending {version} {name}')
+        click.echo(f'{len(todo)} pending migration(s)')
+        return
+    names = run_migrations()
+    for name in names:
+        click.echo(f'applied {name}')
+    click.echo(f'{len(names)} migration(s) applied')
+
+
+def init_app(app) -> None:
+    app.cli.add_command(migrate_command)
+    if app.config.get('AUTO_MIGRATE'):
+        with app.app_context():
+            run_migrations()
@@ -1,10 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
+import json
 import secrets
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+# Reads may be routed to a replica bind (see db_routing.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # ================================
 # أغراض/أهداف التقييم (Dynamic purposes)
@@ -54,6 +58,14 @@ class User(db.Model, UserMixin):
     role = db.Column(db.String(50), nullable=False)  # admin, client, company, bank
     phone = db.Column(db.String(20), nullable=True)
 
+    __table_args__ = (
+        # قوائم الإدارة: المستخدمون حسب الدور مرتبين بالاسم
+        db.Index('ix_users_role_name', 'role', 'name'),
+        # تسجيل الدخول بالهاتف: جزئي لأن أغلب الحسابات بلا رقم هاتف
+        db.Index('ix_users_phone', 'phone',
+                 sqlite_where=db.text('phone IS NOT NULL'), postgresql_where=db.text('phone IS NOT NULL')),
+    )
+
     # تعيين كلمة المرور مع تشفير
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -105,9 +117,58 @@ class CompanyApprovedBank(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('company_profile_id', 'bank_user_id', name='uq_company_bank'),
+        # الشركات المعتمدة لدى بنك معيّن (لوحة البنك، العروض)
+        db.Index('ix_company_approved_banks_bank', 'bank_user_id', 'company_profile_id'),
     )
 
 
+# ================================
+# دليل الشركات (نسخة مُجمّعة للقراءة، يحدّثها company_directory.py)
+# ================================
+class CompanyDirectoryEntry(db.Model):
+    """One read-optimized row per company for listings, pickers and the offers flow."""
+    __tablename__ = 'company_directory'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True, autoincrement=False)
+    profile_id = db.Column(db.Integer, nullable=True)
+    name = db.Column(db.String(150), nullable=False)
+    logo_path = db.Column(db.String(255), nullable=True)
+    # أول 120 حرفًا من الخدمات (مع "..." عند الاقتطاع)
+    services_excerpt = db.Column(db.String(130), nullable=True)
+    valuation_fee = db.Column(db.Float, nullable=True)
+    limit_value = db.Column(db.Float, nullable=True)
+    # JSON: الولايات التي لدى الشركة أسعار فيها، و {bank_user_id: حد الشركة لدى البنك}
+    wilayas = db.Column(db.Text, nullable=False, default='[]')
+    bank_limits = db.Column(db.Text, nullable=False, default='{}')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # القوالب تستخدم c.id كما في User
+    id = db.synonym('user_id')
+
+    __table_args__ = (
+        db.Index('ix_company_directory_name', 'name', 'user_id'),
+    )
+
+    @property
+    def wilaya_list(self) -> list:
+        return json.loads(self.wilayas or '[]')
+
+    @property
+    def bank_limit_map(self) -> dict:
+        return {int(k): v for k, v in json.loads(self.bank_limits or '{}').items()}
+
+    def approved_by(self, bank_user_id: int) -> bool:
+        return bank_user_id in self.bank_limit_map
+
+    def effective_limit(self, bank_user_id=None):
+        """Per-bank limit when the bank set one, else the company-wide limit."""
+        if bank_user_id is not None:
+            limit = self.bank_limit_map.get(bank_user_id)
+            if limit is not None:
+                return limit
+        return self.limit_value
+
+
 # ================================
 # البنوك اليدوية الخاصة بكل شركة
 # ================================
@@ -145,6 +206,15 @@ class CompanyContact(db.Model):
 # ================================
 # نموذج طلب التثمين
 # ================================
+# حالات الطلب (انظر workflow.py للانتقالات المسموحة)
+STATUS_PENDING = 'pending'
+STATUS_REVISION_REQUESTED = 'revision_requested'
+STATUS_COMPLETED = 'completed'
+STATUS_APPROVED = 'approved'
+STATUS_REJECTED = 'rejected'
+REQUEST_STATUSES = (STATUS_PENDING, STATUS_REVISION_REQUESTED, STATUS_COMPLETED, STATUS_APPROVED, STATUS_REJECTED)
+
+
 class ValuationRequest(db.Model):
     __tablename__ = 'valuation_requests'
 
@@ -164,6 +234,12 @@ class ValuationRequest(db.Model):
     rejection_reason = db.Column(db.Text, nullable=True)
     # تاريخ الرفض
     rejected_at = db.Column(db.DateTime, nullable=True)
+    # تاريخ إنشاء الطلب (فارغ للطلبات القديمة قبل إضافة العمود)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=True, index=True)
+    # آخر تغيير للحالة (يُحدَّث عبر workflow.transition)
+    status_changed_at = db.Column(db.DateTime, nullable=True)
+    # ولاية العقار (للتحليلات حسب المنطقة)
+    wilaya = db.Column(db.String(100), nullable=True)
 
     # علاقات ORM (اختياري لكن مفيد)
     client = db.relationship('User', foreign_keys=[client_id], backref='client_requests')
@@ -176,6 +252,30 @@ class ValuationRequest(db.Model):
         backref='valuation_request',
         cascade='all, delete-orphan'
     )
+    # سجل أحداث الطلب (انظر ValuationRequestEvent.timeline)
+    events = db.relationship(
+        'ValuationRequestEvent',
+        backref='valuation_request',
+        cascade='all, delete-orphan',
+        lazy='dynamic',
+    )
+
+    __table_args__ = (
+        # لوحة الشركة وتبويبات حالة المعاملات: (الشركة، الحالة) بالأحدث
+        db.Index('ix_valuation_requests_company_status', 'company_id', 'status', 'id'),
+        # لوحة العميل: طلبات العميل بالأحدث
+        db.Index('ix_valuation_requests_client', 'client_id', 'id'),
+        # لوحة البنك: طلبات البنك حسب الحالة
+        db.Index('ix_valuation_requests_bank_status', 'bank_id', 'status', 'id'),
+        # قائمة الإدارة مفلترة بالحالة
+        db.Index('ix_valuation_requests_status', 'status', 'id'),
+    )
+
+    @validates('status')
+    def _validate_status(self, key, value):
+        if value not in REQUEST_STATUSES:
+            raise ValueError(f"unknown valuation request status: {value!r}")
+        return value
 
 # ================================
 # نموذج دعوة التسجيل
@@ -281,6 +381,66 @@ class BankOffer(db.Model):
 
     bank_profile = db.relationship('BankProfile', backref=db.backref('offers', cascade='all, delete-orphan'))
 
+# ================================
+# سجل انتقالات حالة الطلب (لقياس أزمنة الإنجاز SLA)
+# ================================
+class ValuationRequestTransition(db.Model):
+    """One row per status change made through workflow.transition()."""
+    __tablename__ = 'valuation_request_transitions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    valuation_request_id = db.Column(db.Integer, db.ForeignKey('valuation_requests.id', ondelete='CASCADE'), nullable=False)
+    from_status = db.Column(db.String(50), nullable=True)
+    to_status = db.Column(db.String(50), nullable=False)
+    actor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    note = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_vr_transitions_request_time', 'valuation_request_id', 'created_at'),
+        # أزمنة الإنجاز: كل الانتقالات إلى حالة معينة ضمن فترة
+        db.Index('ix_vr_transitions_to_time', 'to_status', 'created_at'),
+    )
+
+
+# ================================
+# عدّادات حالات الطلبات (لوحات التحكم)
+# ================================
+class StatusRollup(db.Model):
+    """Request count per (scope, scope_id, status); maintained by rollups.py."""
+    __tablename__ = 'valuation_status_rollups'
+
+    scope = db.Column(db.String(20), primary_key=True)  # all/company/bank/client
+    scope_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0 for 'all'
+    status = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# ================================
+# تجميعات التحليلات اليومية (analytics.py)
+# ================================
+class AnalyticsBucket(db.Model):
+    """One day of one metric for one (bank, dimension) pair; rebuilt by analytics.refresh_analytics()."""
+    __tablename__ = 'analytics_buckets'
+
+    metric = db.Column(db.String(30), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    scope_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # bank_id, 0 بدون بنك
+    dim = db.Column(db.String(100), primary_key=True)  # company_id أو الولاية حسب المقياس
+    count = db.Column(db.Integer, nullable=False, default=0)
+    sum_a = db.Column(db.Float, nullable=False, default=0)
+    sum_b = db.Column(db.Float, nullable=False, default=0)
+    max_a = db.Column(db.Float, nullable=True)
+
+
+class AnalyticsWatermark(db.Model):
+    """Last refresh per metric; buckets before it (minus the refresh window) are not recomputed."""
+    __tablename__ = 'analytics_watermarks'
+
+    metric = db.Column(db.String(30), primary_key=True)
+    refreshed_at = db.Column(db.DateTime, nullable=False)
+
+
 # ================================
 # مستندات طلب التثمين
 # ================================
@@ -295,6 +455,37 @@ class RequestDocument(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
 
+# ================================
+# جلسات الرفع المجزّأ القابل للاستئناف (Resumable uploads)
+# ================================
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # معرّف عام يُستخدم في روابط الرفع بدلاً من المعرّف الرقمي
+    token = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    valuation_request_id = db.Column(db.Integer, db.ForeignKey('valuation_requests.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    doc_type = db.Column(db.String(100), nullable=False)
+    original_filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    # الحجم الكلي المعلن للملف، وآخر إزاحة تم تأكيد استلامها
+    total_size = db.Column(db.Integer, nullable=False)
+    offset = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    # المستند الناتج بعد إتمام الرفع
+    document_id = db.Column(db.Integer, db.ForeignKey('request_documents.id'), nullable=True)
+
+    @staticmethod
+    def generate_token() -> str:
+        return secrets.token_urlsafe(24)
+
+    def is_complete(self) -> bool:
+        return self.offset >= self.total_size
+
+
 # ================================
 # مواعيد الزيارة
 # ================================
@@ -306,7 +497,6 @@ class VisitAppointment(db.Model):
         db.Integer,
         db.ForeignKey('valuation_requests.id'),
         nullable=False,
-        index=True,
     )
     # وقت الموعد المقترح/النهائي
     proposed_time = db.Column(db.DateTime, nullable=False)
@@ -318,6 +508,97 @@ class VisitAppointment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # مواعيد الطلب حسب الحالة (يغطي أيضًا البحث بالطلب وحده)
+        db.Index('ix_visit_appointments_request_status', 'valuation_request_id', 'status'),
+        # الزيارات المنجزة حسب التاريخ (analytics): جزئي على المواعيد النهائية فقط
+        db.Index('ix_visit_appointments_final_time', 'proposed_time',
+                 sqlite_where=db.text("status = 'final'"), postgresql_where=db.text("status = 'final'")),
+    )
+
+
+# ================================
+# سجل أحداث طلب التثمين (Request timeline)
+# ================================
+class ValuationRequestEvent(db.Model):
+    """Append-only history of a valuation request.
+
+    Written in the same transaction as the chat notice the route posts, so
+    pages read structured data from here instead of parsing message text.
+    """
+    __tablename__ = 'valuation_request_events'
+
+    # event_type -> payload keys it may carry
+    PAYLOAD_FIELDS = {
+        'rejected': ('reason',),
+        'missing_docs': ('notes',),
+        'valuation_submitted': ('value', 'old_value'),
+        'accepted': ('value',),
+        'declined': ('value',),
+        'transferred': ('from_company_id', 'to_company_id'),
+        'bank_status_changed': ('status', 'notes'),
+        'appointment_proposed': ('appointment_id', 'proposed_time', 'proposed_by', 'notes'),
+        'appointment_accepted': ('appointment_id', 'proposed_time'),
+        'appointment_rejected': ('appointment_id', 'proposed_time'),
+        'appointment_finalized': ('appointment_id', 'proposed_time'),
+    }
+
+    id = db.Column(db.Integer, primary_key=True)
+    valuation_request_id = db.Column(db.Integer, db.ForeignKey('valuation_requests.id'), nullable=False)
+    actor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    event_type = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.Text, nullable=True)  # JSON, keys per PAYLOAD_FIELDS
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    actor = db.relationship('User')
+
+    __table_args__ = (
+        db.Index('ix_vr_events_request_time', 'valuation_request_id', 'created_at'),
+    )
+
+    @classmethod
+    def record(cls, request_id: int, event_type: str, actor_id=None, **payload):
+        """Add an event to the current session; the caller commits."""
+        allowed = cls.PAYLOAD_FIELDS.get(event_type)
+        if allowed is None:
+            raise ValueError(f"unknown request event type: {event_type}")
+        unknown = set(payload) - set(allowed)
+        if unknown:
+            raise ValueError(f"unexpected payload for {event_type}: {sorted(unknown)}")
+        data = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in payload.items()}
+        event = cls(
+            valuation_request_id=request_id,
+            actor_id=actor_id,
+            event_type=event_type,
+            payload=json.dumps(data, ensure_ascii=False) if data else None,
+        )
+        db.session.add(event)
+        return event
+
+    @classmethod
+    def timeline(cls, request_id: int, event_type=None, limit=None):
+        """Newest first, read with one range scan of ix_vr_events_request_time."""
+        q = cls.query.filter(cls.valuation_request_id == request_id)
+        if event_type:
+            q = q.filter(cls.event_type == event_type)
+        q = q.order_by(cls.created_at.desc(), cls.id.desc())
+        if limit:
+            q = q.limit(limit)
+        return q.all()
+
+    @classmethod
+    def latest(cls, request_id: int, event_type: str):
+        found = cls.timeline(request_id, event_type=event_type, limit=1)
+        return found[0] if found else None
+
+    @property
+    def data(self) -> dict:
+        try:
+            return json.loads(self.payload) if self.payload else {}
+        except (TypeError, ValueError):
+            return {}
+
+
 # ================================
 # نموذج الأخبار
 # ================================
@@ -402,6 +683,23 @@ class Message(db.Model):
 
     __table_args__ = (
         db.Index('ix_messages_conv_time', 'conversation_id', 'timestamp'),
+        # Keyset pagination of a conversation's history (before_id / after_id)
+        db.Index('ix_messages_conv_id', 'conversation_id', 'id'),
+    )
+
+
+class ConversationRead(db.Model):
+    """Per-participant read cursor: the last message id the user has seen."""
+    __tablename__ = 'conversation_reads'
+
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('conversation_id', 'user_id', name='uq_conversation_read_user'),
     )
 
 
@@ -419,6 +717,22 @@ class ActivityLog(db.Model):
     actor = db.relationship('User')
 
 
+# ================================
+# سجل الأحداث اللحظية بين العمليات (Realtime event feed)
+# ================================
+class RealtimeEvent(db.Model):
+    """Cross-process change feed read by realtime.EventBus pollers; rows are short-lived."""
+    __tablename__ = 'realtime_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(100), nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    event_id = db.Column(db.Integer, nullable=True)  # SSE id (e.g. message id)
+    origin = db.Column(db.String(40), nullable=False)  # publishing process
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
 # ================================
 # الإعلانات (Advertisements)
 # ================================
@@ -531,3 +845,14 @@ class CompanyLandPrice(db.Model):
 
     def __repr__(self):
         return f"<CompanyLandPrice {self.company_profile_id}:{self.wilaya}/{self.region}>"
+
+
+# ================================
+# سجل ترحيلات قاعدة البيانات المطبّقة (migrations.py)
+# ================================
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
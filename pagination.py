@@ -0,0 +1,142 @@
+"""Keyset (cursor) pagination for list pages.
+
+A page is fetched with `WHERE (sort, id) > (last_sort, last_id) ORDER BY
+sort, id LIMIT n + 1`, so page 500 costs the same index range scan as page
+1 and no OFFSET rows are skipped. Cursors are opaque URL-safe strings that
+carry the sort value and id of the boundary row.
+
+Sort expressions must be non-NULL (wrap nullable columns in coalesce()).
+"""
+from typing import Any, List, Optional
+import base64
+import json
+from datetime import date, datetime
+from flask import request, url_for
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(value: Any, row_id: int) -> str:
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str], sort_expr) -> Optional[tuple]:
+    """Return (value, id) or None when the cursor is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        value, row_id = json.loads(raw)
+        row_id = int(row_id)
+        python_type = sort_expr.type.python_type
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+    if value is not None:
+        try:
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif python_type is date:
+                value = date.fromisoformat(value)
+            else:
+                value = python_type(value)
+        except (ValueError, TypeError):
+            return None
+    return value, row_id
+
+
+class KeysetPage:
+    """One page of rows plus the cursors needed to move forward and back."""
+
+    def __init__(self, items: List[Any], next_cursor: Optional[str], prev_cursor: Optional[str]):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+    def url(self, **changes) -> str:
+        """URL of the current list with `changes` applied to its query string."""
+        args = request.args.to_dict()
+        args.pop('after', None)
+        args.pop('before', None)
+        for key, value in changes.items():
+            if value in (None, ''):
+                args.pop(key, None)
+            else:
+                args[key] = value
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    @property
+    def next_url(self) -> Optional[str]:
+        return self.url(after=self.next_cursor) if self.next_cursor else None
+
+    @property
+    def prev_url(self) -> Optional[str]:
+        return self.url(before=self.prev_cursor) if self.prev_cursor else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+def keyset_paginate(query, sort_expr, id_col, descending: bool = True,
+                    after: Optional[str] = None, before: Optional[str] = None,
+                    per_page: int = 25, key=None, ident=None) -> KeysetPage:
+    """Fetch one page of `query` ordered by (sort_expr, id_col).
+
+    `key(row)` and `ident(row)` return the row's sort value and id when rows
+    are not plain model instances exposing them under the columns' names.
+    """
+    per_page = max(1, per_page)
+    boundary = decode_cursor(before, sort_expr)
+    backwards = boundary is not None
+    if not backwards:
+        boundary = decode_cursor(after, sort_expr)
+
+    # Walking backwards reads the opposite direction, then flips the rows
+    reading_desc = descending != backwards
+    if boundary is not None:
+        value, row_id = boundary
+        if reading_desc:
+            query = query.filter(or_(sort_expr < value, and_(sort_expr == value, id_col < row_id)))
+        else:
+            query = query.filter(or_(sort_expr > value, and_(sort_expr == value, id_col > row_id)))
+    if reading_desc:
+        query = query.order_by(sort_expr.desc(), id_col.desc())
+    else:
+        query = query.order_by(sort_expr.asc(), id_col.asc())
+
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    if key is None:
+        name = getattr(sort_expr, 'key', None) or getattr(sort_expr, 'name', None)
+        key = lambda row: getattr(row, name)  # noqa: E731
+    if ident is None:
+        id_name = id_col.key
+        ident = lambda row: getattr(row, id_name)  # noqa: E731
+
+    def cursor_for(row):
+        return encode_cursor(key(row), ident(row))
+
+    next_cursor = prev_cursor = None
+    if rows:
+        # Forward: more rows after this page, or we came back from a later page
+        if (more and not backwards) or backwards:
+            next_cursor = cursor_for(rows[-1])
+        if (more and backwards) or (not backwards and boundary is not None):
+            prev_cursor = cursor_for(rows[0])
+    return KeysetPage(rows, next_cursor, prev_cursor)
@@ -0,0 +1,336 @@
+"""Real-time events: typed pub/sub shared by all worker processes.
+
+Routes publish typed events after they commit; SSE endpoints subscribe to a
+channel ("conversation:<id>", "user:<id>") and block on their own queue, so
+an idle tab costs no queries.
+
+- `NotificationHub` fans events out to subscriber queues inside one process.
+- `EventBus` is what blueprints use. With EVENT_BUS='local' it only feeds the
+  hub. With EVENT_BUS='db' it also appends every event to the
+  `realtime_events` table; each worker that has live streams runs one poller
+  thread that tails the table and replays other workers' events into its own
+  hub. No broker process or external service is involved. Rows are tailed
+  by id; on backends with concurrent writers (PostgreSQL) a lower id can
+  commit after a higher one, so ids skipped by the tail are re-checked for
+  EVENT_BUS_GAP_SECONDS before being given up as rolled back.
+
+Long-lived streams need a threaded worker (e.g. gunicorn -k gthread).
+"""
+from typing import Iterable, Optional
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import func, select
+from models import db, RealtimeEvent
+
+log = logging.getLogger(__name__)
+
+# Typed events
+EVENT_MESSAGE_SENT = 'message_sent'
+EVENT_CONVERSATION_STATUS_CHANGED = 'conversation_status_changed'
+EVENT_REQUEST_STATUS_CHANGED = 'request_status_changed'
+EVENT_APPOINTMENT_PROPOSED = 'appointment_proposed'
+
+_MAX_GAPS = 1000  # skipped ids tracked at once by a poller
+
+
+class NotificationHub:
+    """Fan out events to per-channel subscriber queues."""
+
+    def __init__(self, max_queue: int = 100):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._max_queue = max_queue
+
+    def subscribe(self, channel: str) -> queue.Queue:
+        q = queue.Queue(maxsize=self._max_queue)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(q)
+        return q
+
+    def unsubscribe(self, channel: str, q: queue.Queue) -> None:
+        with self._lock:
+            subs = self._subscribers.get(channel)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    self._subscribers.pop(channel, None)
+
+    def publish(self, channel: str, event: str, data: dict, event_id: Optional[int] = None) -> int:
+        """Queue an event for every subscriber of `channel`. Returns the number reached."""
+        with self._lock:
+            subs = list(self._subscribers.get(channel, ()))
+        for q in subs:
+            try:
+                q.put_nowait((event, data, event_id))
+            except queue.Full:
+                # A stalled client must not block publishers; it will catch up
+                # through Last-Event-ID when it reconnects.
+                pass
+        return len(subs)
+
+    def subscriber_count(self, channel: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+
+class EventBus:
+    """Publish/subscribe facade over the hub, optionally spanning processes."""
+
+    def __init__(self, hub: NotificationHub):
+        self.hub = hub
+        self._app = None
+        self._backend = 'local'
+        self._poll_interval = 0.25
+        self._retention = 600
+        self._gap_seconds = 30.0
+        self._lock = threading.Lock()
+        self._poller_pid = None
+        self._origin_pid = None
+        self._origin = None
+
+    def init_app(self, app) -> None:
+        self._app = app
+        self._backend = (app.config.get('EVENT_BUS') or 'local').lower()
+        self._poll_interval = float(app.config.get('EVENT_BUS_POLL_INTERVAL', 0.25))
+        self._retention = int(app.config.get('EVENT_BUS_RETENTION_SECONDS', 600))
+        self._gap_seconds = float(app.config.get('EVENT_BUS_GAP_SECONDS', 30))
+        app.extensions['event_bus'] = self
+
+    @property
+    def cross_process(self) -> bool:
+        return self._backend == 'db'
+
+    @property
+    def origin(self) -> str:
+        # Recomputed after fork so every worker has its own identity
+        pid = os.getpid()
+        if self._origin_pid != pid:
+            self._origin_pid = pid
+            self._origin = f"{pid}-{secrets.token_hex(4)}"
+        return self._origin
+
+    def publish(self, channel: str, event: str, data: dict, event_id: Optional[int] = None) -> None:
+        """Deliver to this process right away and, if cross-process, append to the feed.
+
+        Best-effort: failures are logged, never raised into the request.
+        """
+        try:
+            self.hub.publish(channel, event, data, event_id)
+            if self.cross_process:
+                with db.engine.begin() as conn:
+                    conn.execute(RealtimeEvent.__table__.insert().values(
+                        channel=channel,
+                        event_type=event,
+                        payload=json.dumps(data, ensure_ascii=False),
+                        event_id=event_id,
+                        origin=self.origin,
+                        created_at=datetime.utcnow(),
+                    ))
+        except Exception:
+            log.exception('realtime publish failed (%s on %s)', event, channel)
+
+    def subscribe(self, channel: str) -> queue.Queue:
+        if self.cross_process:
+            self._ensure_poller()
+        return self.hub.subscribe(channel)
+
+    def unsubscribe(self, channel: str, q: queue.Queue) -> None:
+        self.hub.unsubscribe(channel, q)
+
+    # ---- cross-process feed ----
+    def _ensure_poller(self) -> None:
+        pid = os.getpid()
+        if self._poller_pid == pid:
+            return
+        with self._lock:
+            if self._poller_pid == pid:
+                return
+            app = self._app or current_app._get_current_object()
+            # Start from "now" before returning, so an event published right after
+            # this subscription is never counted as history
+            table = RealtimeEvent.__table__
+            with app.app_context(), db.engine.connect() as conn:
+                start_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+            thread = threading.Thread(target=self._poll_loop, args=(app, start_id),
+                                      name='event-bus-poller', daemon=True)
+            thread.start()
+            self._poller_pid = pid
+
+    def _poll_loop(self, app, last_id: int) -> None:
+        table = RealtimeEvent.__table__
+        columns = (table.c.id, table.c.channel, table.c.event_type,
+                   table.c.payload, table.c.event_id, table.c.origin)
+        batch = 500
+        with app.app_context():
+            engine = db.engine
+        gaps = {}  # id skipped by the tail -> monotonic time it was noticed
+        next_prune = 0.0
+        while True:
+            try:
+                with engine.connect() as conn:
+                    rows = conn.execute(
+                        select(*columns).where(table.c.id > last_id).order_by(table.c.id).limit(batch)
+                    ).all()
+                    late = []
+                    if gaps:
+                        late = conn.execute(
+                            select(*columns).where(table.c.id.in_(list(gaps))).order_by(table.c.id)
+                        ).all()
+                now = time.monotonic()
+                for row in rows:
+                    if row.id > last_id + 1 and len(gaps) < _MAX_GAPS:
+                        for missing in range(last_id + 1, min(row.id, last_id + 1 + _MAX_GAPS - len(gaps))):
+                            gaps[missing] = now
+                    last_id = row.id
+                origin = self.origin
+                for row in (*late, *rows):
+                    gaps.pop(row.id, None)
+                    if row.origin == origin:
+                        continue  # already delivered locally when published
+                    self.hub.publish(row.channel, row.event_type, json.loads(row.payload), row.event_id)
+                for missing, noticed in list(gaps.items()):
+                    if now - noticed > self._gap_seconds:
+                        del gaps[missing]  # rolled back, or never committed
+                if now >= next_prune:
+                    next_prune = now + max(30, self._retention // 4)
+                    cutoff = datetime.utcnow() - timedelta(seconds=self._retention)
+                    with engine.begin() as conn:
+                        # Keep the newest row: SQLite reuses ids of an emptied table
+                        newest = select(func.max(table.c.id)).scalar_subquery()
+                        conn.execute(table.delete().where(table.c.created_at < cutoff, table.c.id < newest))
+            except Exception:
+                log.exception('realtime event poller error')
+                rows = ()
+                time.sleep(1.0)
+            if len(rows) < batch:
+                time.sleep(self._poll_interval)
+
+
+hub = NotificationHub()
+bus = EventBus(hub)
+
+
+def conversation_channel(conversation_id: int) -> str:
+    return f"conversation:{conversation_id}"
+
+
+def user_channel(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def message_payload(msg, sender_name: Optional[str] = None) -> dict:
+    """JSON shape shared by the messages API, send_message and the SSE stream."""
+    if sender_name is None:
+        sender_name = msg.sender.name if getattr(msg, 'sender', None) else 'مستخدم'
+    return {
+        'id': msg.id,
+        'sender_id': msg.sender_id,
+        'sender_name': sender_name,
+        'content': msg.content,
+        'timestamp': msg.timestamp.isoformat(),
+    }
+
+
+def publish_message(msg, sender_name: Optional[str] = None) -> None:
+    """Push a committed Message to everyone watching its conversation."""
+    bus.publish(
+        conversation_channel(msg.conversation_id),
+        EVENT_MESSAGE_SENT,
+        message_payload(msg, sender_name),
+        event_id=msg.id,
+    )
+
+
+def publish_conversation_status(conv) -> None:
+    bus.publish(conversation_channel(conv.id), EVENT_CONVERSATION_STATUS_CHANGED, {'status': conv.status})
+
+
+def publish_request_status(vr, old_status: Optional[str] = None, extra_user_ids: Iterable[int] = ()) -> None:
+    """Tell every party of a valuation request that its status changed."""
+    data = {'request_id': vr.id, 'status': vr.status, 'old_status': old_status}
+    for uid in {vr.client_id, vr.company_id, vr.bank_id, *extra_user_ids}:
+        if uid:
+            bus.publish(user_channel(uid), EVENT_REQUEST_STATUS_CHANGED, data)
+
+
+def publish_appointment_proposed(appt, vr) -> None:
+    data = {
+        'request_id': vr.id,
+        'appointment_id': appt.id,
+        'proposed_by': appt.proposed_by,
+        'proposed_time': appt.proposed_time.isoformat() if appt.proposed_time else None,
+    }
+    for uid in {vr.client_id, vr.company_id}:
+        if uid:
+            bus.publish(user_channel(uid), EVENT_APPOINTMENT_PROPOSED, data)
+
+
+def format_sse(data: dict, event: Optional[str] = None, event_id: Optional[int] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def sse_response(channel: str, backlog: Iterable[tuple] = (), last_id: Optional[int] = None,
+                 subscription: Optional[queue.Queue] = None) -> Response:
+    """Stream `channel` as Server-Sent Events.
+
+    `backlog` is (event, data, event_id) tuples sent first; pass a
+    `subscription` taken before querying the backlog so nothing falls in
+    between. Events with an id at or below the last one sent are dropped.
+    """
+    if subscription is None:
+        subscription = bus.subscribe(channel)
+    backlog = list(backlog)
+    # The stream only waits on its queue; give the DB connection back to the pool
+    db.session.close()
+
+    keepalive = max(1, int(current_app.config.get('SSE_KEEPALIVE_SECONDS', 20)))
+    max_lifetime = int(current_app.config.get('SSE_MAX_STREAM_SECONDS', 300))
+    retry_ms = int(current_app.config.get('SSE_RETRY_MS', 3000))
+
+    def generate():
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            sent_up_to = last_id or 0
+            for event, data, event_id in backlog:
+                if event_id is not None:
+                    sent_up_to = max(sent_up_to, event_id)
+                yield format_sse(data, event=event, event_id=event_id)
+            deadline = time.monotonic() + max_lifetime if max_lifetime > 0 else None
+            while True:
+                timeout = keepalive
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    timeout = min(keepalive, remaining)
+                try:
+                    event, data, event_id = subscription.get(timeout=timeout)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                if event_id is not None:
+                    if event_id <= sent_up_to:
+                        continue
+                    sent_up_to = event_id
+                yield format_sse(data, event=event, event_id=event_id)
+        finally:
+            bus.unsubscribe(channel, subscription)
+
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
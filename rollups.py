@@ -0,0 +1,258 @@
+"""Per-scope request status counters (valuation_status_rollups).
+
+Dashboards read badge counts from `StatusRollup` rows keyed by
+(scope, scope_id, status) instead of running GROUP BY over
+valuation_requests. Scopes: 'all' (scope_id 0, admin), 'company', 'bank'
+and 'client'.
+
+Counters are maintained by a session `after_flush` hook: any insert, delete,
+status change or re-assignment of a ValuationRequest turns into +1/-1
+deltas written on the flushing connection, so they commit or roll back with
+the change itself whichever route made it. Bulk `Query.update()`/`delete()`
+bypass the hook; `verify_status_rollups()` recomputes everything and repairs
+drift, and runs periodically (ROLLUP_VERIFY_INTERVAL_SECONDS) or via
+`flask verify-rollups`. The repair recounts and rewrites the table inside one
+write transaction that holds the rollup lock (BEGIN IMMEDIATE on SQLite,
+LOCK TABLE on PostgreSQL), so a request committing meanwhile either is
+counted or applies its delta after the rewrite.
+"""
+from collections import Counter
+from typing import Dict, List, Tuple
+import logging
+import os
+import threading
+import time
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, inspect as sa_inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import db, ValuationRequest, StatusRollup
+
+log = logging.getLogger(__name__)
+
+SCOPE_ALL = 'all'
+# scope name -> ValuationRequest attribute holding the scope id
+SCOPE_COLUMNS = {
+    'company': 'company_id',
+    'bank': 'bank_id',
+    'client': 'client_id',
+}
+_TRACKED = ('status',) + tuple(SCOPE_COLUMNS.values())
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    pass
+
+
+# active_history: an assignment to an expired/unloaded attribute loads the
+# committed value first, so _old_values() knows which counter to decrement
+for _attr in _TRACKED:
+    event.listen(getattr(ValuationRequest, _attr), 'set', _load_old_value, active_history=True)
+
+
+def _keys_for(values: dict) -> List[Tuple[str, int, str]]:
+    status = values.get('status') or 'unknown'
+    keys = [(SCOPE_ALL, 0, status)]
+    for scope, attr in SCOPE_COLUMNS.items():
+        if values.get(attr):
+            keys.append((scope, values[attr], status))
+    return keys
+
+
+def _old_values(obj) -> dict:
+    state = sa_inspect(obj)
+    out = {}
+    for attr in _TRACKED:
+        hist = state.attrs[attr].history
+        if hist.deleted:
+            out[attr] = hist.deleted[0]
+        elif hist.unchanged:
+            out[attr] = hist.unchanged[0]
+        else:
+            out[attr] = None
+    return out
+
+
+def _new_values(obj) -> dict:
+    return {attr: getattr(obj, attr) for attr in _TRACKED}
+
+
+def _collect_deltas(session: Session) -> Dict[Tuple[str, int, str], int]:
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, ValuationRequest):
+            for key in _keys_for(_new_values(obj)):
+                deltas[key] += 1
+    for obj in session.deleted:
+        if isinstance(obj, ValuationRequest):
+            for key in _keys_for(_old_values(obj)):
+                deltas[key] -= 1
+    for obj in session.dirty:
+        if not isinstance(obj, ValuationRequest) or obj in session.deleted:
+            continue
+        state = sa_inspect(obj)
+        if not any(state.attrs[attr].history.has_changes() for attr in _TRACKED):
+            continue
+        for key in _keys_for(_old_values(obj)):
+            deltas[key] -= 1
+        for key in _keys_for(_new_values(obj)):
+            deltas[key] += 1
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+_UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def apply_deltas(connection, deltas: Dict[Tuple[str, int, str], int]) -> None:
+    table = StatusRollup.__table__
+    c = table.c
+    upsert = _UPSERT_INSERTS.get(connection.dialect.name)
+    for (scope, scope_id, status), delta in deltas.items():
+        if not delta:
+            continue
+        if upsert is not None:
+            # One atomic statement: concurrent first increments of a key cannot collide
+            connection.execute(
+                upsert(table)
+                .values(scope=scope, scope_id=scope_id, status=status, count=max(delta, 0))
+                .on_conflict_do_update(index_elements=[c.scope, c.scope_id, c.status],
+                                       set_={'count': c.count + delta})
+            )
+            continue
+        updated = connection.execute(
+            table.update()
+            .where(c.scope == scope, c.scope_id == scope_id, c.status == status)
+            .values(count=c.count + delta)
+        ).rowcount
+        if not updated:
+            connection.execute(table.insert().values(
+                scope=scope, scope_id=scope_id, status=status, count=max(delta, 0),
+            ))
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_request_changes(session, flush_context):
+    deltas = _collect_deltas(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+# ---- reads ----
+def rollup_counts(scope: str, scope_id: int = 0) -> Dict[str, int]:
+    """{status: count} for one scope; a primary-key range read."""
+    rows = (
+        db.session.query(StatusRollup.status, StatusRollup.count)
+        .filter(StatusRollup.scope == scope, StatusRollup.scope_id == scope_id)
+        .all()
+    )
+    return {status: count for status, count in rows if count}
+
+
+# ---- verification ----
+def _actual_counts(connection) -> Counter:
+    vr = ValuationRequest.__table__
+    status = func.coalesce(vr.c.status, 'unknown')
+    actual = Counter()
+    for st, cnt in connection.execute(select(status, func.count()).group_by(status)):
+        actual[(SCOPE_ALL, 0, st)] = cnt
+    for scope, attr in SCOPE_COLUMNS.items():
+        col = vr.c[attr]
+        rows = connection.execute(
+            select(col, status, func.count()).where(col.isnot(None)).group_by(col, status)
+        )
+        for scope_id, st, cnt in rows:
+            actual[(scope, scope_id, st)] = cnt
+    return actual
+
+
+def _lock_rollups(connection) -> None:
+    """Take the write lock before reading, so no request commits between recount and rewrite."""
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+    elif connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql(f'LOCK TABLE {StatusRollup.__tablename__} IN EXCLUSIVE MODE')
+
+
+def verify_status_rollups(repair: bool = True) -> List[tuple]:
+    """Compare counters with a full recount; returns [(key, stored, actual)] that differed."""
+    table = StatusRollup.__table__
+    with db.engine.connect() as conn:
+        if repair:
+            _lock_rollups(conn)
+        actual = _actual_counts(conn)
+        stored = {
+            (r.scope, r.scope_id, r.status): r.count
+            for r in conn.execute(select(table.c.scope, table.c.scope_id, table.c.status, table.c.count))
+        }
+        drift = [
+            (key, stored.get(key, 0), actual.get(key, 0))
+            for key in set(stored) | set(actual)
+            if stored.get(key, 0) != actual.get(key, 0)
+        ]
+        if drift and repair:
+            # Absolute counts, set-based: no read-modify-write against concurrent deltas
+            conn.execute(table.delete())
+            conn.execute(table.insert(), [
+                {'scope': scope, 'scope_id': scope_id, 'status': status, 'count': count}
+                for (scope, scope_id, status), count in actual.items()
+            ])
+            conn.commit()
+        else:
+            conn.rollback()
+    return drift
+
+
+class RollupVerifier:
+    """Runs verify_status_rollups() in a daemon thread, once per worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def init_app(self, app) -> None:
+        interval = int(app.config.get('ROLLUP_VERIFY_INTERVAL_SECONDS', 0) or 0)
+        app.cli.add_command(verify_rollups_command)
+        if interval <= 0:
+            return
+
+        @app.before_request
+        def _start_rollup_verifier():
+            self._ensure_thread(app, interval)
+
+    def _ensure_thread(self, app, interval: int) -> None:
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            threading.Thread(target=self._loop, args=(app, interval),
+                             name='rollup-verifier', daemon=True).start()
+            self._pid = pid
+
+    def _loop(self, app, interval: int) -> None:
+        while True:
+            try:
+                with app.app_context():
+                    drift = verify_status_rollups()
+                    if drift:
+                        log.warning('repaired %d drifted status rollups', len(drift))
+            except Exception:
+                log.exception('status rollup verification failed')
+            time.sleep(interval)
+
+
+verifier = RollupVerifier()
+
+
+@click.command('verify-rollups')
+@click.option('--dry-run', is_flag=True, help='Report drift without repairing it.')
+@with_appcontext
+def verify_rollups_command(dry_run: bool) -> None:
+    """Recount request statuses and repair the dashboard counters."""
+    drift = verify_status_rollups(repair=not dry_run)
+    for key, stored, actual in sorted(drift):
+        click.echo(f"{key}: stored={stored} actual={actual}")
+    click.echo(f"{len(drift)} counter(s) {'differ' if dry_run else 'repaired'}")
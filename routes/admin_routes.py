@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from models import db, User, InviteToken, News, Advertisement, LandPrice, BankProfile
 from flask_login import login_required, current_user
 from urllib.parse import urljoin
@@ -8,6 +8,12 @@ import os
 import time
 from werkzeug.utils import secure_filename
 from utils import store_file_and_get_url
+from ingest import ingest_upload, UploadRejected
+from pagination import keyset_paginate
+from rollups import rollup_counts, SCOPE_ALL
+from analytics import refresh_analytics, analytics_report, period_from_args
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 
 admin_bp = Blueprint('admin', __name__, template_folder='../templates/admin', static_folder='../static')
 # --- Logo upload helpers (admin) ---
@@ -20,6 +26,70 @@ def _allowed_logo_file(filename: str) -> bool:
 
 # --- Dashboard (محمي ويعرض البنوك والشركات) ---
 from models import ValuationRequest
+from datetime import datetime, timedelta
+import threading
+
+# Aggregates shared by every admin page view for ADMIN_STATS_TTL_SECONDS
+_stats_cache = {}
+_stats_lock = threading.Lock()
+
+
+def _trend_period(granularity: str):
+    """SQL expression bucketing ValuationRequest.created_at by day or ISO-ish week."""
+    col = ValuationRequest.created_at
+    if granularity == 'week':
+        if db.engine.dialect.name == 'sqlite':
+            return db.func.strftime('%Y-W%W', col)
+        return db.func.to_char(col, 'IYYY-"W"IW')
+    return db.func.date(col)
+
+
+def _compute_dashboard_stats(granularity: str, days: int) -> dict:
+    role_counts = dict(
+        db.session.query(User.role, db.func.count(User.id)).group_by(User.role).all()
+    )
+    status_counts = rollup_counts(SCOPE_ALL)
+
+    period = _trend_period(granularity).label('period')
+    since = datetime.utcnow() - timedelta(days=days)
+    rows = (
+        db.session.query(period, ValuationRequest.status, db.func.count(ValuationRequest.id))
+        .filter(ValuationRequest.created_at >= since)
+        .group_by(period, ValuationRequest.status)
+        .order_by(period.desc())
+        .all()
+    )
+    trend = {}
+    for bucket, status, cnt in rows:
+        entry = trend.setdefault(str(bucket), {'period': str(bucket), 'total': 0, 'by_status': {}})
+        entry['by_status'][status or 'unknown'] = cnt
+        entry['total'] += cnt
+    return {
+        'banks': role_counts.get('bank', 0),
+        'companies': role_counts.get('company', 0),
+        'clients': role_counts.get('client', 0),
+        'requests': sum(status_counts.values()),
+        'status_counts': status_counts,
+        'trend': list(trend.values()),
+        'trend_statuses': sorted({s for e in trend.values() for s in e['by_status']}),
+        'generated_at': datetime.utcnow(),
+    }
+
+
+def dashboard_stats(granularity: str = 'day') -> dict:
+    """Grouped counts for the admin dashboard, cached for a few seconds per process."""
+    ttl = current_app.config.get('ADMIN_STATS_TTL_SECONDS', 30)
+    days = current_app.config.get('ADMIN_TREND_DAYS', 14) * (7 if granularity == 'week' else 1)
+    now = time.monotonic()
+    with _stats_lock:
+        hit = _stats_cache.get(granularity)
+        if hit and hit[0] > now:
+            return hit[1]
+    stats = _compute_dashboard_stats(granularity, days)
+    with _stats_lock:
+        _stats_cache[granularity] = (now + ttl, stats)
+    return stats
+
 
 @admin_bp.route('/dashboard')
 @login_required
@@ -27,30 +97,142 @@ def dashboard():
     if current_user.role != 'admin':
         return "غير مصرح لك بالوصول", 403
 
-    banks = User.query.filter_by(role='bank').all()
-    companies = User.query.filter_by(role='company').all()
-    clients = User.query.filter_by(role='client').all()
-    requests = ValuationRequest.query.all()
-
+    granularity = 'week' if request.args.get('trend') == 'week' else 'day'
+    stats = dashboard_stats(granularity)
     latest_news = News.query.order_by(News.created_at.desc()).limit(3).all()
 
     return render_template(
         'dashboard.html',
-        banks=banks,
-        companies=companies,
-        clients=clients,
-        requests=requests,
+        stats=stats,
+        granularity=granularity,
         latest_news=latest_news
     )
 
+
+# --- تحليلات الأداء (مدة الانتظار، القيمة مقابل المطلوب، الحجم حسب الولاية) ---
+@admin_bp.route('/api/analytics')
+@login_required
+def analytics_api():
+    if current_user.role != 'admin':
+        return "غير مصرح لك بالوصول", 403
+    refresh_analytics()
+    start, end = period_from_args(request.args)
+    return jsonify(analytics_report(start, end))
+
+# --- أدوات مشتركة لقوائم الإدارة (ترقيم بالمؤشر + فرز + تصفية) ---
+ADMIN_PER_PAGE = 25
+
+
+def _sort_args(sortable: dict, default: str, default_desc: bool):
+    """Validated (key, sort expression, descending) from ?sort=&dir=."""
+    key = request.args.get('sort')
+    if key not in sortable:
+        key = default
+    direction = request.args.get('dir')
+    descending = default_desc if direction not in ('asc', 'desc') else direction == 'desc'
+    return key, sortable[key], descending
+
+
+def _date_arg(name: str, end_of_day: bool = False):
+    raw = (request.args.get(name) or '').strip()
+    if not raw:
+        return None
+    try:
+        value = datetime.strptime(raw, '%Y-%m-%d')
+    except ValueError:
+        return None
+    return value + timedelta(days=1) if end_of_day else value
+
+
+def _paginate(query, sort_expr, id_col, descending, key=None):
+    return keyset_paginate(
+        query, sort_expr, id_col, descending=descending,
+        after=request.args.get('after'), before=request.args.get('before'),
+        per_page=ADMIN_PER_PAGE, key=key,
+    )
+
+
+def _list_context(page, sort_key, descending, **extra):
+    return dict(page=page, sort=sort_key, descending=descending, filters=request.args, **extra)
+
+
+# --- قوائم المستخدمين حسب الدور (عملاء / بنوك / شركات) ---
+USER_SORTS = {
+    'name': User.name,
+    'email': User.email,
+    'id': User.id,
+}
+
+
+def _user_page(role: str):
+    """Paged users of `role`, filtered by ?q= on name, email or phone."""
+    sort_key, sort_expr, descending = _sort_args(USER_SORTS, 'name', False)
+    q = User.query.filter(User.role == role)
+    text_q = (request.args.get('q') or '').strip()
+    if text_q:
+        like = f'%{text_q}%'
+        q = q.filter(or_(User.name.ilike(like), User.email.ilike(like), User.phone.ilike(like)))
+    page = _paginate(q, sort_expr, User.id, descending)
+    return page, _list_context(page, sort_key, descending)
+
+
 # --- صفحة عرض طلبات التثمين ---
+REQUEST_SORTS = {
+    'id': ValuationRequest.id,
+    'status': db.func.coalesce(ValuationRequest.status, ''),
+    'value': db.func.coalesce(ValuationRequest.value, -1.0),
+    'created_at': db.func.coalesce(ValuationRequest.created_at, datetime(1970, 1, 1)),
+}
+
+
 @admin_bp.route('/requests')
 @login_required
 def requests_list():
     if current_user.role != 'admin':
         return "غير مصرح لك بالوصول", 403
-    requests = ValuationRequest.query.order_by(ValuationRequest.id.desc()).all()
-    return render_template('requests.html', requests=requests)
+
+    sort_key, sort_expr, descending = _sort_args(REQUEST_SORTS, 'id', True)
+    # client/company/bank are rendered on every row: load them in the same query
+    q = ValuationRequest.query.options(
+        joinedload(ValuationRequest.client),
+        joinedload(ValuationRequest.company),
+        joinedload(ValuationRequest.bank),
+    )
+    status = (request.args.get('status') or '').strip()
+    if status:
+        q = q.filter(ValuationRequest.status == status)
+    valuation_type = (request.args.get('type') or '').strip()
+    if valuation_type:
+        q = q.filter(ValuationRequest.valuation_type == valuation_type)
+    date_from, date_to = _date_arg('from'), _date_arg('to', end_of_day=True)
+    if date_from:
+        q = q.filter(ValuationRequest.created_at >= date_from)
+    if date_to:
+        q = q.filter(ValuationRequest.created_at < date_to)
+    text_q = (request.args.get('q') or '').strip()
+    if text_q:
+        like = f'%{text_q}%'
+        conds = [
+            ValuationRequest.title.ilike(like),
+            ValuationRequest.client.has(User.name.ilike(like)),
+            ValuationRequest.company.has(User.name.ilike(like)),
+        ]
+        if text_q.lstrip('#').isdigit():
+            conds.append(ValuationRequest.id == int(text_q.lstrip('#')))
+        q = q.filter(or_(*conds))
+
+    def sort_value(r):
+        if sort_key == 'id':
+            return r.id
+        if sort_key == 'status':
+            return r.status or ''
+        if sort_key == 'value':
+            return r.value if r.value is not None else -1.0
+        return r.created_at or datetime(1970, 1, 1)
+
+    page = _paginate(q, sort_expr, ValuationRequest.id, descending, key=sort_value)
+    return render_template('requests.html', requests=page.items,
+                           **_list_context(page, sort_key, descending))
 
 # --- إضافة بنك ---
 @admin_bp.route('/add_bank', methods=['POST'])
@@ -94,8 +276,8 @@ def add_company():
 def banks():
     if current_user.role != 'admin':
         return "غير مصرح لك بالوصول", 403
-    banks = User.query.filter_by(role='bank').all()
-    return render_template('banks.html', banks=banks)
+    page, ctx = _user_page('bank')
+    return render_template('banks.html', banks=page.items, **ctx)
 
 # --- صفحة عرض شركات التثمين ---
 @admin_bp.route('/companies')
@@ -103,8 +285,8 @@ def banks():
 def companies():
     if current_user.role != 'admin':
         return "غير مصرح لك بالوصول", 403
-    companies = User.query.filter_by(role='company').all()
-    return render_template('companies.html', companies=companies)
+    page, ctx = _user_page('company')
+    return render_template('admin/companies.html', companies=page.items, **ctx)
 
 
 # --- رفع أسعار الأراضي (إكسل) ---
@@ -216,15 +398,6 @@ def upload_land_prices():
     updated = 0
     skipped = 0
 
-    # تحقق من وجود عمود price_per_meter في الجداول لملائمة الإصدارات القديمة
-    try:
-        from sqlalchemy import inspect as sa_inspect
-        inspector = sa_inspect(db.engine)
-        land_cols = [c['name'] for c in inspector.get_columns('land_prices')]
-        has_price_per_meter = 'price_per_meter' in land_cols
-    except Exception:
-        has_price_per_meter = False
-
     for row in rows_iter:
         if row is None:
             skipped += 1
@@ -326,8 +499,8 @@ def upload_land_prices():
             if fallback_price is not None and (existing.price_per_sqm is None or existing.price_per_sqm != fallback_price):
                 existing.price_per_sqm = fallback_price
                 changed = True
-            # حافظ على التوافق مع قواعد البيانات التي لديها عمود price_per_meter
-            if has_price_per_meter and fallback_price is not None:
+            # حافظ على التوافق مع التسمية القديمة price_per_meter
+            if fallback_price is not None:
                 current_val = getattr(existing, 'price_per_meter', None)
                 if current_val is None or current_val != fallback_price:
                     existing.price_per_meter = fallback_price
@@ -345,8 +518,7 @@ def upload_land_prices():
                 price_agricultural=price_agricultural,
                 price_per_sqm=fallback_price,
             )
-            if has_price_per_meter:
-                new_obj.price_per_meter = fallback_price
+            new_obj.price_per_meter = fallback_price
             db.session.add(new_obj)
             inserted += 1
 
@@ -360,8 +532,9 @@ def upload_land_prices():
 def clients():
     if current_user.role != 'admin':
         return "غير مصرح لك بالوصول", 403
-    clients = User.query.filter_by(role='client').all()
-    return render_template('clients.html', clients=clients)
+    page, ctx = _user_page('client')
+    total = User.query.filter_by(role='client').count()
+    return render_template('clients.html', clients=page.items, total=total, **ctx)
 
 # --- صفحة عرض الدعوات ---
 @admin_bp.route('/invites')
@@ -370,7 +543,33 @@ def invites():
     if current_user.role != 'admin':
         return "غير مصرح لك بالوصول", 403
 
-    invites_qs = InviteToken.query.order_by(InviteToken.created_at.desc()).all()
+    sort_key, sort_expr, descending = _sort_args(
+        {'created_at': InviteToken.created_at, 'expires_at': InviteToken.expires_at, 'email': InviteToken.email},
+        'created_at', True,
+    )
+    q = InviteToken.query
+    role = (request.args.get('role') or '').strip()
+    if role:
+        q = q.filter(InviteToken.role == role)
+    state = (request.args.get('state') or '').strip()
+    now_utc = datetime.utcnow()
+    if state == 'used':
+        q = q.filter(InviteToken.used_at.isnot(None))
+    elif state == 'expired':
+        q = q.filter(InviteToken.used_at.is_(None), InviteToken.expires_at < now_utc)
+    elif state == 'active':
+        q = q.filter(InviteToken.used_at.is_(None), InviteToken.expires_at >= now_utc)
+    date_from, date_to = _date_arg('from'), _date_arg('to', end_of_day=True)
+    if date_from:
+        q = q.filter(InviteToken.created_at >= date_from)
+    if date_to:
+        q = q.filter(InviteToken.created_at < date_to)
+    text_q = (request.args.get('q') or '').strip()
+    if text_q:
+        like = f'%{text_q}%'
+        q = q.filter(or_(InviteToken.name.ilike(like), InviteToken.email.ilike(like)))
+    page = _paginate(q, sort_expr, InviteToken.id, descending)
+    invites_qs = page.items
 
     base_url = (f"http://{current_app.config['SERVER_NAME']}/" if current_app.config.get('SERVER_NAME') else request.host_url)
     invites_data = []
@@ -385,7 +584,8 @@ def invites():
             'expires_at': inv.expires_at,
         })
 
-    return render_template('invites.html', invites=invites_data)
+    return render_template('invites.html', invites=invites_data, now=datetime.utcnow,
+                           **_list_context(page, sort_key, descending))
 
 
 # --- إعداد رفع صور الأخبار ---
@@ -406,8 +606,22 @@ def _ensure_news_upload_dir(app):
 def news_list():
     if current_user.role != 'admin':
         return "غير مصرح لك بالوصول", 403
-    items = News.query.order_by(News.created_at.desc()).all()
-    return render_template('news_list.html', news_list=items)
+    sort_key, sort_expr, descending = _sort_args(
+        {'created_at': News.created_at, 'title': News.title}, 'created_at', True,
+    )
+    q = News.query
+    date_from, date_to = _date_arg('from'), _date_arg('to', end_of_day=True)
+    if date_from:
+        q = q.filter(News.created_at >= date_from)
+    if date_to:
+        q = q.filter(News.created_at < date_to)
+    text_q = (request.args.get('q') or '').strip()
+    if text_q:
+        like = f'%{text_q}%'
+        q = q.filter(or_(News.title.ilike(like), News.body.ilike(like)))
+    page = _paginate(q, sort_expr, News.id, descending)
+    return render_template('news_list.html', news_list=page.items,
+                           **_list_context(page, sort_key, descending))
 
 
 # --- إنشاء خبر جديد ---
@@ -427,6 +641,11 @@ def news_new():
         image_path_rel = None
         file = request.files.get('image')
         if file and file.filename:
+            try:
+                file = ingest_upload(file, kind='image')
+            except UploadRejected as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('admin.news_new'))
             filename = secure_filename(file.filename)
             upload_dir = _ensure_news_upload_dir(current_app)
             # ensure unique name if exists (for local fallback)
@@ -505,6 +724,11 @@ def ads_new():
         image_path_rel = None
         file = request.files.get('image')
         if file and file.filename:
+            try:
+                file = ingest_upload(file, kind='image')
+            except UploadRejected as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('admin.ads_new'))
             filename = secure_filename(file.filename)
             upload_dir = _ensure_ads_upload_dir(current_app)
             base, ext = os.path.splitext(filename)
@@ -624,6 +848,11 @@ def update_bank(bank_id: int):
         if not _allowed_logo_file(file.filename):
             flash('صيغة الشعار غير مدعومة', 'danger')
             return redirect(url_for('admin.banks'))
+        try:
+            file = ingest_upload(file, kind='image')
+        except UploadRejected as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('admin.banks'))
 
         upload_dir = current_app.config.get('UPLOAD_FOLDER')
         os.makedirs(upload_dir, exist_ok=True)
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from authlib.integrations.flask_client import OAuth
 import secrets
 from utils import format_phone_e164
+from db_routing import read_primary
 from sqlalchemy import and_
 from flask import current_app, redirect, url_for
 from models import User
@@ -159,6 +160,7 @@ def login_google():
 
 
 @auth.route('/auth/google/callback')
+@read_primary
 def google_callback():
     token = current_app.google.authorize_access_token()
     userinfo = token.get('userinfo') or current_app.google.parse_id_token(token)
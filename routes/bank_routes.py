@@ -1,9 +1,17 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
-from models import db, User, ValuationRequest, BankProfile, BankOffer, BankLoanPolicy, CompanyApprovedBank, CompanyProfile
+from models import db, User, ValuationRequest, ValuationRequestEvent, BankProfile, BankOffer, BankLoanPolicy, CompanyApprovedBank, CompanyProfile
 from utils import calculate_max_loan
 from werkzeug.utils import secure_filename
 from utils import store_file_and_get_url
+from ingest import ingest_upload, UploadRejected
+from realtime import publish_request_status
+from pagination import keyset_paginate
+from rollups import rollup_counts
+from analytics import refresh_analytics, analytics_report, period_from_args
+from workflow import transition, InvalidTransition
+from db_routing import read_primary
+from sqlalchemy.orm import joinedload
 import os
 import time
 
@@ -16,9 +24,31 @@ ALLOWED_LOGO_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
 def _allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_LOGO_EXTENSIONS
 
+
+BANK_REQUESTS_PER_PAGE = 20
+COMPANY_PICKER_PER_PAGE = 20
+
+
+def _unapproved_companies_query(bank_user_id: int):
+    """Company users with a profile that this bank has not approved yet (anti-join)."""
+    approved = (
+        db.select(CompanyApprovedBank.id)
+        .where(
+            CompanyApprovedBank.company_profile_id == CompanyProfile.id,
+            CompanyApprovedBank.bank_user_id == bank_user_id,
+        )
+        .exists()
+    )
+    return (
+        db.session.query(User.id, User.name, CompanyProfile.limit_value)
+        .join(CompanyProfile, CompanyProfile.user_id == User.id)
+        .filter(User.role == 'company', ~approved)
+    )
+
 # --- Dashboard للبنك ---
 @bank_bp.route('/dashboard')
 @login_required
+@read_primary
 def dashboard():
     if current_user.role != 'bank':
         return "غير مصرح لك بالوصول", 403
@@ -34,8 +64,21 @@ def dashboard():
         db.session.add(bank_profile)
         db.session.commit()
 
-    # جلب الطلبات المخصصة للبنك الحالي
-    requests = ValuationRequest.query.filter_by(bank_id=current_user.id).all()
+    # جلب الطلبات المخصصة للبنك الحالي: عدد لكل حالة + صفحة واحدة من الحالة المختارة
+    status_counts = rollup_counts('bank', current_user.id)
+    status_filter = (request.args.get('status') or '').strip()
+    requests_query = (
+        ValuationRequest.query
+        .options(joinedload(ValuationRequest.client), joinedload(ValuationRequest.company))
+        .filter(ValuationRequest.bank_id == current_user.id)
+    )
+    if status_filter:
+        requests_query = requests_query.filter(ValuationRequest.status == status_filter)
+    requests_page = keyset_paginate(
+        requests_query, ValuationRequest.id, ValuationRequest.id, descending=True,
+        after=request.args.get('after'), before=request.args.get('before'),
+        per_page=BANK_REQUESTS_PER_PAGE,
+    )
 
     # جلب عروض البنك
     offers = bank_profile.offers if bank_profile else []
@@ -62,35 +105,54 @@ def dashboard():
         for cab, profile, user in approved_rows
     ]
 
-    # جميع شركات التثمين غير المعتمدة بعد من هذا البنك
-    approved_user_ids = {item['company_user_id'] for item in approved_companies}
-    companies_all = (
-        db.session.query(User, CompanyProfile)
-        .join(CompanyProfile, CompanyProfile.user_id == User.id)
-        .filter(User.role == 'company')
-        .all()
-    )
-    companies_to_add = [
-        {
-            'user_id': user.id,
-            'name': user.name,
-            'limit_value': profile.limit_value,
-        }
-        for user, profile in companies_all
-        if user.id not in approved_user_ids
-    ]
-
     return render_template(
         'bank/dashboard.html',
-        requests=requests,
+        requests=requests_page.items,
+        requests_page=requests_page,
+        status_counts=status_counts,
+        status_filter=status_filter,
         offers=offers,
         policies=policies,
         approved_companies=approved_companies,
-        companies_to_add=companies_to_add,
         bank_profile=bank_profile,
     )
 
 
+# --- قائمة الشركات المتاحة للاعتماد (بحث + ترقيم) ---
+@bank_bp.route('/api/companies/available')
+@login_required
+def available_companies():
+    if current_user.role != 'bank':
+        return "غير مصرح لك بالوصول", 403
+
+    query = _unapproved_companies_query(current_user.id)
+    text_q = (request.args.get('q') or '').strip()
+    if text_q:
+        query = query.filter(User.name.ilike(f'%{text_q}%'))
+    page = keyset_paginate(
+        query, User.name, User.id, descending=False,
+        after=request.args.get('after'), per_page=COMPANY_PICKER_PER_PAGE,
+    )
+    return jsonify({
+        'items': [
+            {'user_id': row.id, 'name': row.name, 'limit_value': row.limit_value}
+            for row in page.items
+        ],
+        'next_cursor': page.next_cursor,
+    })
+
+
+# --- تحليلات طلبات البنك ---
+@bank_bp.route('/api/analytics')
+@login_required
+def analytics_api():
+    if current_user.role != 'bank':
+        return "غير مصرح لك بالوصول", 403
+    refresh_analytics()
+    start, end = period_from_args(request.args)
+    return jsonify(analytics_report(start, end, bank_id=current_user.id))
+
+
 # --- إدارة الشركات المعتمدة للبنك ---
 @bank_bp.route('/approved_companies/add', methods=['POST'])
 @login_required
@@ -188,6 +250,11 @@ def update_logo():
     if not _allowed_file(file.filename):
         flash('صيغة الشعار غير مدعومة', 'danger')
         return redirect(url_for('bank.dashboard'))
+    try:
+        file = ingest_upload(file, kind='image')
+    except UploadRejected as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('bank.dashboard'))
 
     upload_folder = current_app.config.get('UPLOAD_FOLDER')
     os.makedirs(upload_folder, exist_ok=True)
@@ -216,9 +283,24 @@ def update_request(request_id):
     if req.bank_id != current_user.id:
         return "غير مصرح لك بالوصول", 403
 
-    new_status = request.form.get('status')
-    req.status = new_status
+    new_status = (request.form.get('status') or '').strip().lower()
+    note = (request.form.get('note') or '').strip() or None
+    old_status = req.status
+    try:
+        transition(req, new_status, current_user, note=note)
+    except InvalidTransition:
+        flash('لا يمكن نقل الطلب إلى هذه الحالة', 'danger')
+        return redirect(url_for('bank.dashboard'))
+    # سجل المعاملة: نفس أنواع الأحداث التي تسجلها الشركة للرفض وطلب المستندات
+    if new_status == 'rejected':
+        ValuationRequestEvent.record(req.id, 'rejected', current_user.id, reason=note)
+    elif new_status == 'revision_requested':
+        ValuationRequestEvent.record(req.id, 'missing_docs', current_user.id, notes=note)
+    else:
+        ValuationRequestEvent.record(req.id, 'bank_status_changed', current_user.id,
+                                     status=new_status, notes=note)
     db.session.commit()
+    publish_request_status(req, old_status)
     flash('تم تحديث حالة الطلب', 'success')
     return redirect(url_for('bank.dashboard'))
 
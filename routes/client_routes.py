@@ -1,15 +1,26 @@
 """Blueprint for client portal routes and templates."""
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_user, logout_user, login_required, current_user
-from models import db, User, ValuationRequest, BankProfile, BankLoanPolicy, RequestDocument, VisitAppointment, Conversation, Message, ActivityLog
+from models import db, User, ValuationRequest, BankProfile, BankLoanPolicy, RequestDocument, VisitAppointment, Conversation, Message, ActivityLog, UploadSession, ValuationRequestEvent
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import FileStorage
 import os
 import time
 from utils import calculate_max_loan, format_phone_e164, store_file_and_get_url
-from datetime import datetime
+from ingest import ingest_many, ingest_upload, UploadRejected
+from realtime import publish_message, publish_request_status, publish_appointment_proposed
+from datetime import datetime, timedelta
+from pagination import keyset_paginate
+from rollups import rollup_counts
+from company_directory import directory_entries
+from workflow import transition, InvalidTransition
+from db_routing import read_replica
+from sqlalchemy.orm import joinedload
 
 client_bp = Blueprint('client', __name__, template_folder='../templates/client', static_folder='../static')
 
+DASHBOARD_PER_PAGE = 20
+
 @client_bp.route('/login', methods=['GET', 'POST'])
 def login():
     # Simple login form for demo (no hashing). In production, validate and hash passwords.
@@ -95,10 +106,47 @@ def edit_profile():
 @client_bp.route('/dashboard')
 @login_required
 def dashboard():
-    # show client's requests
-    reqs = ValuationRequest.query.filter_by(client_id=current_user.id).all()
-    banks = BankProfile.query.order_by(BankProfile.id.asc()).all()
-    return render_template('client/dashboard.html', requests=reqs, banks=banks)
+    # show client's requests: one page, company joined, appointment state from SQL
+    appt = VisitAppointment
+    for_request = appt.valuation_request_id == ValuationRequest.id
+    has_final = db.exists().where(for_request, appt.status == 'final')
+    next_time = (
+        db.select(db.func.min(appt.proposed_time))
+        .where(for_request, appt.status.in_(('pending', 'accepted', 'final')), appt.proposed_time >= datetime.utcnow())
+        .scalar_subquery()
+    )
+    pending_count = (
+        db.select(db.func.count(appt.id))
+        .where(for_request, appt.status == 'pending')
+        .scalar_subquery()
+    )
+    query = (
+        db.session.query(
+            ValuationRequest,
+            has_final.label('has_final'),
+            next_time.label('next_appointment'),
+            pending_count.label('pending_appointments'),
+        )
+        .options(joinedload(ValuationRequest.company))
+        .filter(ValuationRequest.client_id == current_user.id)
+    )
+    page = keyset_paginate(
+        query, ValuationRequest.id, ValuationRequest.id, descending=True,
+        after=request.args.get('after'), before=request.args.get('before'),
+        per_page=DASHBOARD_PER_PAGE,
+        key=lambda row: row[0].id, ident=lambda row: row[0].id,
+    )
+    summaries = {
+        vr.id: {'has_final': bool(final), 'next_appointment': upcoming, 'pending_appointments': pending or 0}
+        for vr, final, upcoming, pending in page.items
+    }
+    return render_template(
+        'client/dashboard.html',
+        requests=[row[0] for row in page.items],
+        summaries=summaries,
+        page=page,
+        status_counts=rollup_counts('client', current_user.id),
+    )
 
 
 # -------------------------------
@@ -114,51 +162,24 @@ def request_detail(request_id: int):
     if vr.client_id != current_user.id:
         return "غير مصرح لك بالوصول", 403
 
-    # استخراج آخر ملاحظة من شركة التثمين عن "مستندات ناقصة" لهذا الطلب (إن وُجدت)
+    # آخر ملاحظة من شركة التثمين عن "مستندات ناقصة" لهذا الطلب (إن وُجدت)
+    events = ValuationRequestEvent.timeline(vr.id)
     missing_docs_note = None
     missing_docs_time = None
-    try:
-        if (vr.status or '').lower() == 'revision_requested' and vr.company_id:
-            conv = Conversation.query.filter_by(client_id=current_user.id, company_id=vr.company_id).first()
-            if conv:
-                # ابحث عن آخر رسالة تخص هذا الطلب تشير إلى مستندات ناقصة
-                pattern_part = f"#{vr.id}"
-                q = (
-                    Message.query
-                    .filter(
-                        Message.conversation_id == conv.id,
-                        Message.content.like('%طلب مستندات ناقصة%'),
-                        Message.content.like(f'%{pattern_part}%'),
-                    )
-                    .order_by(Message.timestamp.desc())
-                )
-                last_msg = q.first()
-                if last_msg:
-                    content = last_msg.content or ''
-                    # استخرج الملاحظات بعد أول سطر أو بعد النقطتين إن وُجدتا
-                    if '\n' in content:
-                        missing_docs_note = content.split('\n', 1)[1].strip() or None
-                    else:
-                        # محاولة إزالة المقدمة الثابتة والإبقاء على الملاحظة فقط
-                        split_marker = 'طلب مستندات ناقصة'
-                        if split_marker in content:
-                            possible = content.split(':', 1)
-                            missing_docs_note = (possible[1] if len(possible) > 1 else '').strip() or None
-                        else:
-                            missing_docs_note = content.strip() or None
-                    missing_docs_time = last_msg.timestamp
-    except Exception:
-        # لا نفشل صفحة التفاصيل إن تعذّر استخراج الرسالة
-        missing_docs_note = None
-        missing_docs_time = None
+    if (vr.status or '').lower() == 'revision_requested':
+        last_missing = next((e for e in events if e.event_type == 'missing_docs'), None)
+        if last_missing:
+            missing_docs_note = last_missing.data.get('notes') or None
+            missing_docs_time = last_missing.created_at
 
-    companies = User.query.filter_by(role='company').all()
+    companies = directory_entries()
     return render_template(
         'client/request_detail.html',
         request_obj=vr,
         companies=companies,
         missing_docs_note=missing_docs_note,
         missing_docs_time=missing_docs_time,
+        events=events,
     )
 
 
@@ -193,12 +214,20 @@ def transfer_request(request_id: int):
         return redirect(url_for('client.request_detail', request_id=vr.id))
 
     # Apply transfer
+    old_company_id, old_status = vr.company_id, vr.status
+    try:
+        transition(vr, 'pending', current_user, note='transfer')
+    except InvalidTransition:
+        flash('لا يمكن تحويل المعاملة في حالتها الحالية', 'warning')
+        return redirect(url_for('client.request_detail', request_id=vr.id))
     vr.company_id = new_company.id
-    vr.status = 'pending'
+    ValuationRequestEvent.record(vr.id, 'transferred', current_user.id,
+                                 from_company_id=old_company_id, to_company_id=new_company.id)
     # Remove any scheduled/proposed appointments tied to the old company context
     VisitAppointment.query.filter_by(valuation_request_id=vr.id).delete()
 
     db.session.commit()
+    publish_request_status(vr, old_status, extra_user_ids=[old_company_id])
     flash('تم تحويل المعاملة إلى الشركة الجديدة', 'success')
     return redirect(url_for('client.request_detail', request_id=vr.id))
 
@@ -221,7 +250,14 @@ def accept_valuation(request_id: int):
         flash('لا يمكن قبول التثمين قبل إكماله من الشركة', 'warning')
         return redirect(url_for('client.request_detail', request_id=vr.id))
 
-    vr.status = 'approved'
+    old_status = vr.status
+    try:
+        transition(vr, 'approved', current_user)
+    except InvalidTransition:
+        flash('لا يمكن قبول التثمين في حالة الطلب الحالية', 'warning')
+        return redirect(url_for('client.request_detail', request_id=vr.id))
+    ValuationRequestEvent.record(vr.id, 'accepted', current_user.id, value=vr.value)
+    notice = None
     try:
         # Notify company via conversation (optional but helpful)
         if vr.company_id:
@@ -233,10 +269,14 @@ def accept_valuation(request_id: int):
                 db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='conversation_created'))
             value_text = (str(vr.value) if vr.value is not None else '-')
             content = f"قبِل العميل التثمين الخاص بالطلب #{vr.id}. القيمة: {value_text}"
-            db.session.add(Message(conversation_id=conv.id, sender_id=current_user.id, content=content))
+            notice = Message(conversation_id=conv.id, sender_id=current_user.id, content=content)
+            db.session.add(notice)
             db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='message_sent'))
 
         db.session.commit()
+        if notice is not None:
+            publish_message(notice, current_user.name)
+        publish_request_status(vr, old_status)
         flash('تم قبول التثمين. يمكنك الآن تحديد موعد الزيارة.', 'success')
     except Exception:
         db.session.rollback()
@@ -261,7 +301,14 @@ def decline_valuation(request_id: int):
         return redirect(url_for('client.request_detail', request_id=vr.id))
 
     # Reopen the request with the same company for potential revisions
-    vr.status = 'pending'
+    old_status = vr.status
+    try:
+        transition(vr, 'pending', current_user)
+    except InvalidTransition:
+        flash('لا يمكن رفض التثمين في حالة الطلب الحالية', 'warning')
+        return redirect(url_for('client.request_detail', request_id=vr.id))
+    ValuationRequestEvent.record(vr.id, 'declined', current_user.id, value=vr.value)
+    notice = None
     try:
         if vr.company_id:
             conv = Conversation.query.filter_by(client_id=vr.client_id, company_id=vr.company_id).first()
@@ -272,10 +319,14 @@ def decline_valuation(request_id: int):
                 db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='conversation_created'))
             value_text = (str(vr.value) if vr.value is not None else '-')
             content = f"رفض العميل التثمين الخاص بالطلب #{vr.id}. القيمة المقترحة: {value_text}"
-            db.session.add(Message(conversation_id=conv.id, sender_id=current_user.id, content=content))
+            notice = Message(conversation_id=conv.id, sender_id=current_user.id, content=content)
+            db.session.add(notice)
             db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='message_sent'))
 
         db.session.commit()
+        if notice is not None:
+            publish_message(notice, current_user.name)
+        publish_request_status(vr, old_status)
         flash('تم رفض التثمين وإعادة المعاملة للمراجعة.', 'info')
     except Exception:
         db.session.rollback()
@@ -287,7 +338,7 @@ def decline_valuation(request_id: int):
 @login_required
 def submit_request():
     # Bring list of companies for selection
-    companies = User.query.filter_by(role='company').all()
+    companies = directory_entries()
     # Preserve company preselection (if arriving from company details page)
     preselected_company_id = request.args.get('company_id', type=int)
 
@@ -394,9 +445,19 @@ def upload_docs(request_id: int):
             except Exception:
                 flash('تنسيق مبلغ غير صالح', 'danger')
                 return render_template('client/upload_docs.html', request_obj=vr, required_docs=required_docs, max_bytes=current_app.config.get('MAX_CONTENT_LENGTH', 5*1024*1024))
-        # Ensure each required doc has at least one file
+        # Ensure each required doc has at least one file (in this form or already
+        # uploaded through the resumable chunked endpoints)
+        uploaded_types = {
+            row[0] for row in
+            db.session.query(RequestDocument.doc_type)
+            .filter(RequestDocument.valuation_request_id == vr.id)
+            .distinct()
+            .all()
+        }
         for key, _, _ in required_docs:
             files = request.files.getlist(f'{key}[]')
+            if key in uploaded_types:
+                continue
             if not files or all((not f or not f.filename) for f in files):
                 flash(f'يرجى رفع مستند: {dict((k,l) for k,l,_ in required_docs)[key]}', 'danger')
                 return render_template('client/upload_docs.html', request_obj=vr, required_docs=required_docs, max_bytes=current_app.config.get('MAX_CONTENT_LENGTH', 5*1024*1024))
@@ -406,34 +467,39 @@ def upload_docs(request_id: int):
         requests_root = os.path.join(static_root, 'uploads', 'requests', f'req_{vr.id}')
         os.makedirs(requests_root, exist_ok=True)
 
+        # Type is sniffed from content (not the extension); photos are shrunk and
+        # PDFs linearized in the ingestion worker pool before anything is stored
+        pending = []
         for key, _, _ in required_docs:
-            files = request.files.getlist(f'{key}[]')
-            for fs in files:
-                if not fs or not fs.filename:
-                    continue
-                if not _allowed_doc(fs.filename):
-                    flash('نوع الملف غير مدعوم. المسموح: صور أو PDF', 'danger')
-                    return render_template('client/upload_docs.html', request_obj=vr, required_docs=required_docs, max_bytes=current_app.config.get('MAX_CONTENT_LENGTH', 5*1024*1024))
-
-                safe_name = secure_filename(fs.filename)
-                ts = int(time.time())
-                filename = f"{key}_{ts}_{safe_name}"
-                # object key in B2 bucket
-                object_key = f"uploads/requests/req_{vr.id}/{filename}"
-                stored = store_file_and_get_url(
-                    fs,
-                    key=object_key,
-                    local_abs_dir=requests_root,
-                    filename=filename,
-                )
-
-                rd = RequestDocument(
-                    valuation_request_id=vr.id,
-                    doc_type=key,
-                    file_path=stored,
-                    original_filename=safe_name,
-                )
-                db.session.add(rd)
+            for fs in request.files.getlist(f'{key}[]'):
+                if fs and fs.filename:
+                    pending.append((key, fs))
+        try:
+            processed = ingest_many([fs for _, fs in pending], kind='document')
+        except UploadRejected as e:
+            flash(str(e), 'danger')
+            return render_template('client/upload_docs.html', request_obj=vr, required_docs=required_docs, max_bytes=current_app.config.get('MAX_CONTENT_LENGTH', 5*1024*1024))
+
+        for (key, _), fs in zip(pending, processed):
+            safe_name = secure_filename(fs.filename)
+            ts = int(time.time())
+            filename = f"{key}_{ts}_{safe_name}"
+            # object key in B2 bucket
+            object_key = f"uploads/requests/req_{vr.id}/{filename}"
+            stored = store_file_and_get_url(
+                fs,
+                key=object_key,
+                local_abs_dir=requests_root,
+                filename=filename,
+            )
+
+            rd = RequestDocument(
+                valuation_request_id=vr.id,
+                doc_type=key,
+                file_path=stored,
+                original_filename=safe_name,
+            )
+            db.session.add(rd)
 
         db.session.commit()
         flash('تم رفع المستندات بنجاح', 'success')
@@ -442,6 +508,248 @@ def upload_docs(request_id: int):
     return render_template('client/upload_docs.html', request_obj=vr, required_docs=required_docs, max_bytes=current_app.config.get('MAX_CONTENT_LENGTH', 5*1024*1024))
 
 
+# -------------------------------
+# Resumable chunked uploads (tus-style: create -> PATCH chunks -> finalize)
+# -------------------------------
+
+def _upload_part_path(session: UploadSession) -> str:
+    tmp_root = current_app.config.get('UPLOAD_TMP_FOLDER')
+    os.makedirs(tmp_root, exist_ok=True)
+    return os.path.join(tmp_root, f"{session.token}.part")
+
+
+def _upload_session_payload(session: UploadSession) -> dict:
+    return {
+        'upload_id': session.token,
+        'doc_type': session.doc_type,
+        'filename': session.original_filename,
+        'size': session.total_size,
+        'offset': session.offset,
+        'chunk_size': current_app.config.get('UPLOAD_CHUNK_SIZE', 1024 * 1024),
+        'completed': session.completed_at is not None,
+        'document_id': session.document_id,
+    }
+
+
+def _get_own_upload_session(upload_id: str) -> UploadSession:
+    session = UploadSession.query.filter_by(token=upload_id).first_or_404()
+    if session.user_id != current_user.id:
+        return None
+    return session
+
+
+# Sessions purged per call; the oldest go first, the rest on later calls
+_PURGE_BATCH = 100
+
+
+def _purge_expired_upload_sessions() -> None:
+    """Drop abandoned sessions of any user and their partial files, a bounded batch at a time."""
+    ttl = current_app.config.get('UPLOAD_SESSION_TTL_SECONDS', 24 * 3600)
+    cutoff = datetime.utcnow() - timedelta(seconds=ttl)
+    stale = (
+        db.session.query(UploadSession.id, UploadSession.token)
+        .filter(UploadSession.completed_at.is_(None), UploadSession.updated_at < cutoff)
+        .order_by(UploadSession.updated_at.asc())
+        .limit(_PURGE_BATCH)
+        .all()
+    )
+    if not stale:
+        return
+    tmp_root = current_app.config.get('UPLOAD_TMP_FOLDER')
+    for _, token in stale:
+        try:
+            os.remove(os.path.join(tmp_root, f"{token}.part"))
+        except OSError:
+            pass
+    UploadSession.query.filter(UploadSession.id.in_([sid for sid, _ in stale])).delete(synchronize_session=False)
+
+
+@client_bp.route('/requests/<int:request_id>/uploads', methods=['POST'])
+@login_required
+def create_upload(request_id: int):
+    """Open a resumable upload for one request document."""
+    vr = ValuationRequest.query.get_or_404(request_id)
+    if vr.client_id != current_user.id:
+        return jsonify({'error': 'غير مصرح لك بالوصول'}), 403
+
+    payload = request.get_json(silent=True) or request.form
+    doc_type = (payload.get('doc_type') or '').strip()
+    filename = secure_filename(payload.get('filename') or '')
+    content_type = (payload.get('content_type') or '').strip() or None
+    try:
+        total_size = int(payload.get('size'))
+    except Exception:
+        return jsonify({'error': 'size is required'}), 400
+
+    allowed_types = {key for key, _, _ in _required_docs_for_type(vr.valuation_type or "")}
+    if doc_type not in allowed_types:
+        return jsonify({'error': 'نوع مستند غير صالح'}), 400
+    if not filename or not _allowed_doc(filename):
+        return jsonify({'error': 'نوع الملف غير مدعوم. المسموح: صور أو PDF'}), 400
+    max_size = current_app.config.get('UPLOAD_MAX_FILE_SIZE', 50 * 1024 * 1024)
+    if total_size <= 0 or total_size > max_size:
+        return jsonify({'error': f'حجم الملف غير مسموح. الحد الأقصى {max_size // (1024 * 1024)}MB'}), 413
+
+    _purge_expired_upload_sessions()
+
+    session = UploadSession(
+        token=UploadSession.generate_token(),
+        valuation_request_id=vr.id,
+        user_id=current_user.id,
+        doc_type=doc_type,
+        original_filename=filename,
+        content_type=content_type,
+        total_size=total_size,
+        offset=0,
+    )
+    db.session.add(session)
+    db.session.commit()
+    # Create the empty part file so offsets are always backed by disk
+    open(_upload_part_path(session), 'wb').close()
+
+    resp = jsonify(_upload_session_payload(session))
+    resp.status_code = 201
+    resp.headers['Location'] = url_for('client.upload_status', upload_id=session.token)
+    resp.headers['Upload-Offset'] = '0'
+    resp.headers['Upload-Length'] = str(total_size)
+    return resp
+
+
+@client_bp.route('/uploads/<string:upload_id>', methods=['GET', 'HEAD'])
+@login_required
+def upload_status(upload_id: str):
+    """Report the last acknowledged offset so a client can resume."""
+    session = _get_own_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'غير مصرح لك بالوصول'}), 403
+    resp = jsonify(_upload_session_payload(session))
+    resp.headers['Upload-Offset'] = str(session.offset)
+    resp.headers['Upload-Length'] = str(session.total_size)
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
+@client_bp.route('/uploads/<string:upload_id>', methods=['PATCH'])
+@login_required
+def upload_chunk(upload_id: str):
+    """Append one chunk at the offset given in the Upload-Offset header."""
+    session = _get_own_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'غير مصرح لك بالوصول'}), 403
+    if session.completed_at is not None:
+        return jsonify({'error': 'upload already finalized', 'offset': session.offset}), 409
+
+    try:
+        client_offset = int(request.headers.get('Upload-Offset', ''))
+    except Exception:
+        return jsonify({'error': 'Upload-Offset header is required'}), 400
+
+    part_path = _upload_part_path(session)
+    # The part file is the source of truth; heal the row if a previous commit was lost
+    disk_offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if disk_offset != session.offset:
+        if disk_offset > session.offset:
+            with open(part_path, 'r+b') as fh:
+                fh.truncate(session.offset)
+        else:
+            session.offset = disk_offset
+            db.session.commit()
+
+    if client_offset != session.offset:
+        resp = jsonify({'error': 'offset mismatch', 'offset': session.offset})
+        resp.status_code = 409
+        resp.headers['Upload-Offset'] = str(session.offset)
+        return resp
+
+    chunk = request.get_data(cache=False)
+    chunk_limit = current_app.config.get('UPLOAD_CHUNK_SIZE', 1024 * 1024)
+    if not chunk:
+        return jsonify({'error': 'empty chunk'}), 400
+    if len(chunk) > chunk_limit or session.offset + len(chunk) > session.total_size:
+        return jsonify({'error': 'chunk too large', 'offset': session.offset}), 413
+
+    with open(part_path, 'ab') as fh:
+        fh.write(chunk)
+        fh.flush()
+        os.fsync(fh.fileno())
+    session.offset += len(chunk)
+    db.session.commit()
+
+    resp = jsonify({'offset': session.offset, 'size': session.total_size})
+    resp.headers['Upload-Offset'] = str(session.offset)
+    resp.headers['Upload-Length'] = str(session.total_size)
+    return resp
+
+
+@client_bp.route('/uploads/<string:upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(upload_id: str):
+    """Hand the assembled file to storage and attach it to the request."""
+    session = _get_own_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'غير مصرح لك بالوصول'}), 403
+    if session.completed_at is not None:
+        # Idempotent: a retried finalize returns the same document
+        return jsonify(_upload_session_payload(session))
+    if not session.is_complete():
+        resp = jsonify({'error': 'upload incomplete', 'offset': session.offset})
+        resp.status_code = 409
+        resp.headers['Upload-Offset'] = str(session.offset)
+        return resp
+
+    part_path = _upload_part_path(session)
+    if not os.path.exists(part_path) or os.path.getsize(part_path) != session.total_size:
+        return jsonify({'error': 'upload data missing', 'offset': 0}), 409
+
+    with open(part_path, 'rb') as fh:
+        try:
+            fs = ingest_upload(FileStorage(
+                stream=fh,
+                filename=session.original_filename,
+                content_type=session.content_type or 'application/octet-stream',
+            ), kind='document')
+        except UploadRejected as e:
+            # Bad content will not improve on retry: drop the session so the client starts over
+            db.session.delete(session)
+            db.session.commit()
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            return jsonify({'error': str(e)}), 422
+
+    static_root = os.path.join(current_app.root_path, 'static')
+    requests_root = os.path.join(static_root, 'uploads', 'requests', f'req_{session.valuation_request_id}')
+    filename = f"{session.doc_type}_{int(time.time())}_{secure_filename(fs.filename)}"
+    object_key = f"uploads/requests/req_{session.valuation_request_id}/{filename}"
+    stored = store_file_and_get_url(
+        fs,
+        key=object_key,
+        local_abs_dir=requests_root,
+        filename=filename,
+    )
+    if not stored:
+        return jsonify({'error': 'تعذّر حفظ الملف. حاول مرة أخرى.'}), 500
+
+    rd = RequestDocument(
+        valuation_request_id=session.valuation_request_id,
+        doc_type=session.doc_type,
+        file_path=stored,
+        original_filename=secure_filename(fs.filename),
+    )
+    db.session.add(rd)
+    db.session.flush()
+    session.document_id = rd.id
+    session.completed_at = datetime.utcnow()
+    db.session.commit()
+    try:
+        os.remove(part_path)
+    except OSError:
+        pass
+
+    return jsonify(_upload_session_payload(session))
+
+
 # -------------------------------
 # Client proposes visit appointment after valuation completed
 # -------------------------------
@@ -481,7 +789,12 @@ def propose_appointment(request_id: int):
             notes=notes,
         )
         db.session.add(appt)
+        db.session.flush()
+        ValuationRequestEvent.record(vr.id, 'appointment_proposed', current_user.id,
+                                     appointment_id=appt.id, proposed_time=proposed_dt,
+                                     proposed_by='client', notes=notes)
         db.session.commit()
+        publish_appointment_proposed(appt, vr)
         flash('تم إرسال اقتراح موعد الزيارة إلى الشركة', 'success')
         return redirect(url_for('client.dashboard'))
 
@@ -517,6 +830,7 @@ def get_loan_policies():
 
 @client_bp.route('/compute_max_loan', methods=['POST'])
 @login_required
+@read_replica
 def compute_max_loan():
     data = request.get_json(silent=True) or request.form
     bank_slug = data.get('bank_slug')
@@ -1,15 +1,36 @@
 """Blueprint for valuation company portal routes and templates."""
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, Response, stream_with_context
 from sqlalchemy import or_
 from flask_login import login_required, current_user
-from models import db, ValuationRequest, CompanyProfile, CompanyContact, VisitAppointment, Conversation, Message, ActivityLog, CompanyLandPrice
+from models import db, ValuationRequest, CompanyProfile, CompanyContact, VisitAppointment, Conversation, Message, ActivityLog, CompanyLandPrice, RequestDocument, ValuationRequestEvent
 from werkzeug.utils import secure_filename
-from utils import store_file_and_get_url
+from utils import store_file_and_get_url, iter_zip_stream, doc_label_ar
+from urllib.parse import quote
+from ingest import ingest_upload, UploadRejected
+from realtime import publish_message, publish_request_status, publish_appointment_proposed
+from pagination import keyset_paginate
+from rollups import rollup_counts
+from workflow import transition, InvalidTransition
+from db_routing import read_primary
+from sqlalchemy.orm import joinedload
 import os
 import time
 
 company_bp = Blueprint('company', __name__, template_folder='templates/company')
 
+TRANSACTIONS_PER_PAGE = 25
+# تبويبات صفحة حالة المعاملات -> حالة الطلب
+STATUS_TABS = {
+    'rejected': 'rejected',
+    'missing_docs': 'revision_requested',
+    'completed': 'completed',
+}
+
+
+def _status_counts(company_id: int) -> dict:
+    """Request counts per status for one company, read from the status rollups."""
+    return rollup_counts('company', company_id)
+
 @company_bp.route('/dashboard')
 @login_required
 def dashboard():
@@ -27,13 +48,7 @@ def dashboard():
         .all()
     )
     # إحصاءات سريعة لحالات معاملات الشركة
-    counts_rows = (
-        db.session.query(ValuationRequest.status, db.func.count(ValuationRequest.id))
-        .filter(ValuationRequest.company_id == current_user.id)
-        .group_by(ValuationRequest.status)
-        .all()
-    )
-    counts_map = {status or 'unknown': cnt for status, cnt in counts_rows}
+    counts_map = _status_counts(current_user.id)
     status_counts = {
         'pending': counts_map.get('pending', 0),
         'revision_requested': counts_map.get('revision_requested', 0),
@@ -74,42 +89,58 @@ def transactions_status():
     if active_tab not in {'rejected', 'missing_docs', 'completed'}:
         active_tab = 'rejected'
 
-    base = ValuationRequest.query.filter(ValuationRequest.company_id == current_user.id)
-
-    # القوائم حسب الحالة
-    rejected_list = base.filter(ValuationRequest.status == 'rejected').order_by(ValuationRequest.id.desc()).all()
-    missing_docs_list = base.filter(ValuationRequest.status == 'revision_requested').order_by(ValuationRequest.id.desc()).all()
-    completed_list = base.filter(ValuationRequest.status == 'completed').order_by(ValuationRequest.id.desc()).all()
+    counts_map = _status_counts(current_user.id)
+    counts = {tab: counts_map.get(status, 0) for tab, status in STATUS_TABS.items()}
 
-    counts = {
-        'rejected': len(rejected_list),
-        'missing_docs': len(missing_docs_list),
-        'completed': len(completed_list),
-    }
-
-    # اختر القائمة حسب التبويب
-    if active_tab == 'rejected':
-        active_list = rejected_list
-    elif active_tab == 'missing_docs':
-        active_list = missing_docs_list
-    else:
-        active_list = completed_list
+    # التبويب النشط فقط: صفحة واحدة مرتبة بالأحدث مع بيانات العميل
+    query = (
+        ValuationRequest.query
+        .options(joinedload(ValuationRequest.client))
+        .filter(
+            ValuationRequest.company_id == current_user.id,
+            ValuationRequest.status == STATUS_TABS[active_tab],
+        )
+    )
+    page = keyset_paginate(
+        query, ValuationRequest.id, ValuationRequest.id, descending=True,
+        after=request.args.get('after'), before=request.args.get('before'),
+        per_page=TRANSACTIONS_PER_PAGE,
+    )
 
     return render_template(
         'company/transactions_status.html',
         active_tab=active_tab,
-        items=active_list,
+        items=page.items,
+        page=page,
         counts=counts,
     )
 
 @company_bp.route('/submit/<int:request_id>', methods=['GET', 'POST'])
 @login_required
 def submit_valuation(request_id):
-    vr = ValuationRequest.query.get(request_id)
+    if current_user.role != 'company':
+        return "غير مصرح لك بالوصول", 403
+    vr = ValuationRequest.query.get_or_404(request_id)
+    if vr.company_id != current_user.id:
+        return "غير مصرح لك بالوصول", 403
     if request.method == 'POST':
-        vr.value = float(request.form.get('value') or 0)
-        vr.status = 'completed'
+        # تحقق من القيمة قبل تغيير حالة الطلب
+        value = _parse_float_field(request.form.get('value'))
+        if value is None or value <= 0:
+            flash('يرجى إدخال قيمة تثمين صحيحة', 'danger')
+            return render_template('company/submit.html', request_obj=vr)
+        old_value = vr.value
+        old_status = vr.status
+        try:
+            transition(vr, 'completed', current_user)
+        except InvalidTransition:
+            flash('لا يمكن تقديم التثمين في حالة الطلب الحالية', 'danger')
+            return redirect(url_for('company.request_detail', request_id=vr.id))
+        vr.value = value
+        ValuationRequestEvent.record(vr.id, 'valuation_submitted', current_user.id,
+                                     value=vr.value, old_value=old_value)
         db.session.commit()
+        publish_request_status(vr, old_status)
         flash('Valuation submitted', 'success')
         return redirect(url_for('company.dashboard'))
     return render_template('company/submit.html', request_obj=vr)
@@ -126,7 +157,54 @@ def request_detail(request_id: int):
         return "غير مصرح لك بالوصول", 403
     # احضار المواعيد المرتبطة بأحدث ترتيب
     appts = VisitAppointment.query.filter_by(valuation_request_id=req.id).order_by(VisitAppointment.created_at.desc()).all()
-    return render_template('company/request_detail.html', request_obj=req, appointments=appts)
+    events = ValuationRequestEvent.timeline(req.id)
+    return render_template('company/request_detail.html', request_obj=req, appointments=appts, events=events)
+
+
+@company_bp.route('/requests/<int:request_id>/documents.zip')
+@login_required
+def request_documents_zip(request_id: int):
+    """تنزيل جميع مستندات المعاملة كملف ZIP يُبنى أثناء الإرسال."""
+    if current_user.role != 'company':
+        return "غير مصرح لك بالوصول", 403
+    req = ValuationRequest.query.get_or_404(request_id)
+    if req.company_id != current_user.id:
+        return "غير مصرح لك بالوصول", 403
+
+    docs = (
+        RequestDocument.query
+        .filter_by(valuation_request_id=req.id)
+        .order_by(RequestDocument.doc_type.asc(), RequestDocument.id.asc())
+        .all()
+    )
+    if not docs:
+        flash('لا توجد مستندات لهذه المعاملة', 'info')
+        return redirect(url_for('company.request_detail', request_id=req.id))
+
+    # أسماء الملفات داخل الأرشيف حسب نوع المستند بالعربية، مع ترقيم عند التكرار
+    entries = []
+    used = {}
+    for d in docs:
+        label = doc_label_ar(d.doc_type)
+        ext = os.path.splitext(d.original_filename or d.file_path or '')[1].lower()
+        used[label] = used.get(label, 0) + 1
+        name = label if used[label] == 1 else f"{label} ({used[label]})"
+        entries.append((f"{name}{ext}", d.file_path))
+
+    static_root = os.path.join(current_app.root_path, 'static')
+    stream = iter_zip_stream(
+        entries,
+        static_root=static_root,
+        prefetch=current_app.config.get('DOCUMENTS_ZIP_PREFETCH', 3),
+    )
+    archive_name = f"طلب_{req.id}_المستندات.zip"
+    headers = {
+        'Content-Disposition': f"attachment; filename=\"request_{req.id}_documents.zip\"; filename*=UTF-8''{quote(archive_name)}",
+        # Don't let a reverse proxy buffer the whole archive before sending
+        'X-Accel-Buffering': 'no',
+        'Cache-Control': 'private, no-store',
+    }
+    return Response(stream_with_context(stream), mimetype='application/zip', headers=headers)
 
 
 @company_bp.route('/requests/<int:request_id>/reject', methods=['POST'])
@@ -144,10 +222,13 @@ def reject_request(request_id: int):
         flash('يرجى كتابة سبب الرفض', 'danger')
         return redirect(url_for('company.request_detail', request_id=req.id))
 
-    from datetime import datetime
-    req.status = 'rejected'
+    old_status = req.status
+    try:
+        transition(req, 'rejected', current_user, note=reason)
+    except InvalidTransition:
+        flash('لا يمكن رفض الطلب في حالته الحالية', 'danger')
+        return redirect(url_for('company.request_detail', request_id=req.id))
     req.rejection_reason = reason
-    req.rejected_at = datetime.utcnow()
     # After rejection, remove appointments and unassign from this company
     VisitAppointment.query.filter_by(valuation_request_id=req.id).delete()
     req.company_id = None
@@ -161,10 +242,15 @@ def reject_request(request_id: int):
         db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='conversation_created'))
 
     content = f"تم رفض طلب التثمين #{req.id}. السبب:\n{reason}"
-    db.session.add(Message(conversation_id=conv.id, sender_id=current_user.id, content=content))
+    ValuationRequestEvent.record(req.id, 'rejected', current_user.id, reason=reason)
+    notice = Message(conversation_id=conv.id, sender_id=current_user.id, content=content)
+    db.session.add(notice)
     db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='message_sent'))
 
     db.session.commit()
+    publish_message(notice, current_user.name)
+    # company_id was cleared above; the rejecting company still gets the event
+    publish_request_status(req, old_status, extra_user_ids=[current_user.id])
     flash('تم رفض المعاملة مع توضيح السبب للعميل', 'success')
     return redirect(url_for('company.dashboard'))
 
@@ -185,7 +271,12 @@ def mark_missing_documents(request_id: int):
         return redirect(url_for('company.request_detail', request_id=req.id) + '#missing-docs')
 
     # تحديث حالة الطلب
-    req.status = 'revision_requested'
+    old_status = req.status
+    try:
+        transition(req, 'revision_requested', current_user, note=notes)
+    except InvalidTransition:
+        flash('لا يمكن طلب مستندات ناقصة في حالة الطلب الحالية', 'danger')
+        return redirect(url_for('company.request_detail', request_id=req.id))
 
     # إرسال رسالة عبر نظام المحادثات إلى العميل
     conv = Conversation.query.filter_by(client_id=req.client_id, company_id=current_user.id).first()
@@ -196,10 +287,14 @@ def mark_missing_documents(request_id: int):
         db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='conversation_created'))
 
     content = f"طلب مستندات ناقصة بخصوص طلب التثمين #{req.id}:\n{notes}"
-    db.session.add(Message(conversation_id=conv.id, sender_id=current_user.id, content=content))
+    ValuationRequestEvent.record(req.id, 'missing_docs', current_user.id, notes=notes)
+    notice = Message(conversation_id=conv.id, sender_id=current_user.id, content=content)
+    db.session.add(notice)
     db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='message_sent'))
 
     db.session.commit()
+    publish_message(notice, current_user.name)
+    publish_request_status(req, old_status)
     flash('تم إرسال طلب المستندات الناقصة إلى العميل مع الملاحظات', 'success')
     return redirect(url_for('company.request_detail', request_id=req.id))
 
@@ -215,6 +310,8 @@ def accept_appointment(appointment_id: int):
         return "غير مصرح لك بالوصول", 403
 
     appt.status = 'accepted'
+    ValuationRequestEvent.record(vr.id, 'appointment_accepted', current_user.id,
+                                 appointment_id=appt.id, proposed_time=appt.proposed_time)
     db.session.commit()
     flash('تمت الموافقة على الموعد. يمكنك تأكيده كموعد نهائي لاحقاً.', 'success')
     return redirect(url_for('company.request_detail', request_id=vr.id))
@@ -252,6 +349,8 @@ def reject_appointment(appointment_id: int):
         return "غير مصرح لك بالوصول", 403
 
     appt.status = 'rejected'
+    ValuationRequestEvent.record(vr.id, 'appointment_rejected', current_user.id,
+                                 appointment_id=appt.id, proposed_time=appt.proposed_time)
     db.session.commit()
     flash('تم رفض الموعد. يرجى اقتراح موعد بديل.', 'info')
     return redirect(url_for('company.request_detail', request_id=vr.id))
@@ -277,6 +376,8 @@ def finalize_appointment(appointment_id: int):
             o.status = 'rejected'
 
     appt.status = 'final'
+    ValuationRequestEvent.record(vr.id, 'appointment_finalized', current_user.id,
+                                 appointment_id=appt.id, proposed_time=appt.proposed_time)
     db.session.commit()
     flash('تم تحديد موعد الزيارة النهائي', 'success')
     return redirect(url_for('company.request_detail', request_id=vr.id))
@@ -322,7 +423,15 @@ def propose_company_appointment(request_id: int):
             original_appt = None
         if original_appt and original_appt.valuation_request_id == vr.id:
             original_appt.status = 'rejected'
+            ValuationRequestEvent.record(vr.id, 'appointment_rejected', current_user.id,
+                                         appointment_id=original_appt.id,
+                                         proposed_time=original_appt.proposed_time)
+    db.session.flush()
+    ValuationRequestEvent.record(vr.id, 'appointment_proposed', current_user.id,
+                                 appointment_id=appt.id, proposed_time=proposed_dt,
+                                 proposed_by='company', notes=notes)
     db.session.commit()
+    publish_appointment_proposed(appt, vr)
     flash('تم اقتراح موعد بديل للعميل', 'success')
     return redirect(url_for('company.request_detail', request_id=vr.id))
 
@@ -332,6 +441,7 @@ def propose_company_appointment(request_id: int):
 # ================================
 @company_bp.route('/land_prices', methods=['GET'])
 @login_required
+@read_primary
 def land_prices():
     """عرض قائمة أسعار الأراضي التي رفعتها الشركة مع البحث والتعديل."""
     if current_user.role != 'company':
@@ -512,21 +622,11 @@ def _allowed_file(filename: str) -> bool:
 
 @company_bp.route('/profile', methods=['GET', 'POST'])
 @login_required
+@read_primary
 def edit_profile():
     if current_user.role != 'company':
         return "غير مصرح لك بالوصول", 403
 
-    # تأكد من وجود عمود رسوم التثمين بشكل كسول بدون ترحيل كامل
-    try:
-        from sqlalchemy import inspect as sa_inspect, text
-        inspector = sa_inspect(db.engine)
-        cols = [c['name'] for c in inspector.get_columns('company_profiles')]
-        if 'valuation_fee' not in cols:
-            with db.engine.begin() as conn:
-                conn.execute(text('ALTER TABLE company_profiles ADD COLUMN valuation_fee FLOAT'))
-    except Exception:
-        pass
-
     profile = CompanyProfile.query.filter_by(user_id=current_user.id).first()
     if not profile:
         profile = CompanyProfile(user_id=current_user.id)
@@ -549,6 +649,11 @@ def edit_profile():
             if not _allowed_file(file.filename):
                 flash('صيغة الشعار غير مدعومة', 'danger')
                 return render_template('company/profile_edit.html', profile=profile, contacts=contacts_list)
+            try:
+                file = ingest_upload(file, kind='image')
+            except UploadRejected as e:
+                flash(str(e), 'danger')
+                return render_template('company/profile_edit.html', profile=profile, contacts=contacts_list)
             upload_folder = current_app.config.get('UPLOAD_FOLDER')
             os.makedirs(upload_folder, exist_ok=True)
             filename = f"company_{current_user.id}_{int(time.time())}_" + secure_filename(file.filename)
@@ -709,15 +814,6 @@ def upload_company_land_prices():
     updated = 0
     skipped = 0
 
-    # تحقق من وجود عمود price_per_meter في قاعدة البيانات لملائمة الإصدارات القديمة
-    try:
-        from sqlalchemy import inspect as sa_inspect
-        inspector = sa_inspect(db.engine)
-        company_land_cols = [c['name'] for c in inspector.get_columns('company_land_prices')]
-        has_price_per_meter = 'price_per_meter' in company_land_cols
-    except Exception:
-        has_price_per_meter = False
-
     for row in rows_iter:
         if row is None:
             skipped += 1
@@ -812,8 +908,8 @@ def upload_company_land_prices():
             if fallback_price is not None and (existing.price_per_sqm is None or existing.price_per_sqm != fallback_price):
                 existing.price_per_sqm = fallback_price
                 changed = True
-            # حافظ على التوافق مع قواعد البيانات التي لديها عمود price_per_meter
-            if has_price_per_meter and fallback_price is not None:
+            # حافظ على التوافق مع التسمية القديمة price_per_meter
+            if fallback_price is not None:
                 current_val = getattr(existing, 'price_per_meter', None)
                 if current_val is None or current_val != fallback_price:
                     existing.price_per_meter = fallback_price
@@ -832,8 +928,7 @@ def upload_company_land_prices():
                 price_agricultural=price_agricultural,
                 price_per_sqm=fallback_price,
             )
-            if has_price_per_meter:
-                new_obj.price_per_meter = fallback_price
+            new_obj.price_per_meter = fallback_price
             db.session.add(new_obj)
             inserted += 1
 
@@ -1,12 +1,21 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, abort
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, abort, current_app
 from flask_login import login_required, current_user
-from sqlalchemy import or_
-from models import db, User, Conversation, Message, ActivityLog
+from sqlalchemy import or_, and_, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, aliased
+from models import db, User, Conversation, Message, ActivityLog, ConversationRead
+from contact_filter import contains_external_contact
+from search import search_messages
+from db_routing import read_primary
+from realtime import (bus, conversation_channel, message_payload, publish_message,
+                      publish_conversation_status, sse_response, EVENT_MESSAGE_SENT)
 from datetime import datetime
-import re
 
 conversations_bp = Blueprint('conversations', __name__)
 
+INBOX_PER_PAGE = 20
+SNIPPET_CHARS = 120
+
 
 def _ensure_participant(conv: Conversation) -> None:
     if current_user.role not in ('client', 'company'):
@@ -17,51 +26,158 @@ def _ensure_participant(conv: Conversation) -> None:
         abort(403)
 
 
-def _detect_external_contact(content: str) -> bool:
-    text = (content or '').lower()
-    # crude patterns for emails, URLs, and phone numbers/WhatsApp
-    email_re = re.compile(r"[a-z0-9_.+-]+@[a-z0-9-]+\.[a-z0-9-.]+")
-    url_re = re.compile(r"https?://|www\\.")
-    phone_re = re.compile(r"(\+?\d[\d\s\-]{7,}\d)")
-    whatsapp_re = re.compile(r"whats(app)?|wa\.me|chat\.whatsapp\.com")
-    sms_re = re.compile(r"\bsms\b")
-    return bool(email_re.search(text) or url_re.search(text) or phone_re.search(text) or whatsapp_re.search(text) or sms_re.search(text))
+def _page_limit(raw) -> int:
+    default = int(current_app.config.get('MESSAGES_PAGE_SIZE', 50))
+    cap = int(current_app.config.get('MESSAGES_PAGE_MAX', 200))
+    try:
+        limit = int(raw) if raw not in (None, '') else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, cap))
+
+
+def _message_page(conversation_id: int, *, before_id=None, after_id=None, limit: int = 50):
+    """Keyset page over (conversation_id, id); returns (messages oldest-first, has_more).
+
+    - after_id: the next `limit` messages after that id (catch-up / polling)
+    - before_id: the `limit` messages just before that id (older history)
+    - neither: the latest `limit` messages
+    `has_more` tells whether another page exists in the direction being read.
+    """
+    q = (Message.query
+         .options(joinedload(Message.sender))
+         .filter(Message.conversation_id == conversation_id))
+    if after_id is not None:
+        rows = q.filter(Message.id > after_id).order_by(Message.id.asc()).limit(limit + 1).all()
+        return rows[:limit], len(rows) > limit
+    if before_id is not None:
+        q = q.filter(Message.id < before_id)
+    rows = q.order_by(Message.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, has_more
+
+
+def _mark_read(conversation_id: int, user_id: int, message_id) -> None:
+    """Move the user's read cursor forward to `message_id` (never backwards)."""
+    if not message_id:
+        return
+    cursor = ConversationRead.query.filter_by(conversation_id=conversation_id, user_id=user_id).first()
+    if cursor is None:
+        try:
+            db.session.add(ConversationRead(conversation_id=conversation_id, user_id=user_id,
+                                            last_read_message_id=message_id))
+            db.session.commit()
+            return
+        except IntegrityError:
+            # Another tab created the cursor first; fall through to the update
+            db.session.rollback()
+            cursor = ConversationRead.query.filter_by(conversation_id=conversation_id, user_id=user_id).first()
+            if cursor is None:
+                return
+    if (cursor.last_read_message_id or 0) < message_id:
+        cursor.last_read_message_id = message_id
+        db.session.commit()
+
+
+def _inbox_query(user):
+    """One statement for the inbox: each row is
+    (conversation, other party name, last message snippet, last message time,
+    last message sender id, unread count), ordered by last activity.
+    """
+    if user.role == 'client':
+        mine_col, other_col = Conversation.client_id, Conversation.company_id
+    else:
+        mine_col, other_col = Conversation.company_id, Conversation.client_id
+
+    other = aliased(User)
+    last_msg = aliased(Message)
+    last_id = (select(func.max(Message.id))
+               .where(Message.conversation_id == Conversation.id)
+               .correlate(Conversation)
+               .scalar_subquery())
+    unread = (select(func.count(Message.id))
+              .where(Message.conversation_id == Conversation.id,
+                     Message.id > func.coalesce(ConversationRead.last_read_message_id, 0),
+                     Message.sender_id != user.id)
+              .correlate(Conversation, ConversationRead)
+              .scalar_subquery())
+    last_activity = func.coalesce(last_msg.timestamp, Conversation.created_at)
+
+    return (db.session.query(
+                Conversation,
+                other.name,
+                func.substr(last_msg.content, 1, SNIPPET_CHARS),
+                last_msg.timestamp,
+                last_msg.sender_id,
+                unread,
+            )
+            .join(other, other.id == other_col)
+            .outerjoin(ConversationRead, and_(ConversationRead.conversation_id == Conversation.id,
+                                              ConversationRead.user_id == user.id))
+            .outerjoin(last_msg, last_msg.id == last_id)
+            .filter(mine_col == user.id)
+            .order_by(last_activity.desc(), Conversation.id.desc()))
 
 
 @conversations_bp.route('/conversations')
 @login_required
 def list_conversations():
-    if current_user.role == 'client':
-        convs = (Conversation.query
-                 .filter_by(client_id=current_user.id)
-                 .order_by(Conversation.created_at.desc())
-                 .all())
-    elif current_user.role == 'company':
-        convs = (Conversation.query
-                 .filter_by(company_id=current_user.id)
-                 .order_by(Conversation.created_at.desc())
-                 .all())
-    else:
+    if current_user.role not in ('client', 'company'):
         abort(403)
 
-    # Eager fetch the other party names
-    other_parties = {}
-    for c in convs:
-        other_user_id = c.company_id if current_user.role == 'client' else c.client_id
-        if other_user_id not in other_parties:
-            other_parties[other_user_id] = User.query.get(other_user_id)
+    page = max(1, request.args.get('page', 1, type=int) or 1)
+    # Fetch one extra row to know whether a next page exists without a COUNT query
+    rows = (_inbox_query(current_user)
+            .limit(INBOX_PER_PAGE + 1)
+            .offset((page - 1) * INBOX_PER_PAGE)
+            .all())
+    has_next = len(rows) > INBOX_PER_PAGE
+    inbox = [
+        {
+            'conversation': conv,
+            'other_name': other_name,
+            'snippet': snippet,
+            'last_message_at': last_at,
+            'last_sender_id': last_sender_id,
+            'unread': unread or 0,
+        }
+        for conv, other_name, snippet, last_at, last_sender_id, unread in rows[:INBOX_PER_PAGE]
+    ]
+    return render_template('conversations/list.html', inbox=inbox, page=page, has_next=has_next)
+
 
-    return render_template('conversations/list.html', conversations=convs, other_parties=other_parties)
+@conversations_bp.route('/api/conversations/search')
+@login_required
+def api_search_messages():
+    """Ranked full-text search across the current user's conversations."""
+    if current_user.role not in ('client', 'company'):
+        abort(403)
+    query = (request.args.get('q') or '').strip()
+    if len(query) > 200:
+        return jsonify({'error': 'نص البحث طويل جداً'}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int) or 20, 50))
+    results = search_messages(current_user, query, limit=limit)
+    for r in results:
+        r['url'] = url_for('conversations.conversation_detail', conversation_id=r['conversation_id'])
+    return jsonify({'query': query, 'results': results})
 
 
 @conversations_bp.route('/conversations/<int:conversation_id>')
 @login_required
+@read_primary
 def conversation_detail(conversation_id: int):
     conv = Conversation.query.get_or_404(conversation_id)
     _ensure_participant(conv)
     other_user = User.query.get(conv.company_id if current_user.role == 'client' else conv.client_id)
-    messages = Message.query.filter_by(conversation_id=conv.id).order_by(Message.timestamp.asc()).all()
-    return render_template('conversations/detail.html', conversation=conv, other_user=other_user, messages=messages)
+    messages, has_older = _message_page(conv.id, limit=_page_limit(None))
+    html = render_template('conversations/detail.html', conversation=conv, other_user=other_user,
+                           messages=messages, has_older=has_older)
+    # Advance the read cursor only after rendering: its commit expires the eager-loaded messages
+    if messages:
+        _mark_read(conv.id, current_user.id, messages[-1].id)
+    return html
 
 
 @conversations_bp.route('/api/conversations/<int:conversation_id>/messages')
@@ -70,25 +186,91 @@ def api_conversation_messages(conversation_id: int):
     conv = Conversation.query.get_or_404(conversation_id)
     _ensure_participant(conv)
 
+    def _id_arg(name):
+        raw = request.args.get(name)
+        if raw in (None, ''):
+            return None
+        try:
+            return int(raw)
+        except (TypeError, ValueError):
+            abort(400)
+
+    before_id = _id_arg('before_id')
+    after_id = _id_arg('after_id')
+    if before_id is not None and after_id is not None:
+        return jsonify({'error': 'use before_id or after_id, not both'}), 400
+    limit = _page_limit(request.args.get('limit'))
+
     since_raw = request.args.get('since')
-    q = Message.query.filter_by(conversation_id=conv.id)
-    if since_raw:
+    if since_raw and before_id is None and after_id is None:
+        # Legacy timestamp cursor, kept for older pages still polling with ?since=
+        q = Message.query.options(joinedload(Message.sender)).filter_by(conversation_id=conv.id)
         try:
-            since_dt = datetime.fromisoformat(since_raw)
-            q = q.filter(Message.timestamp > since_dt)
+            q = q.filter(Message.timestamp > datetime.fromisoformat(since_raw))
         except Exception:
             pass
-    q = q.order_by(Message.timestamp.asc())
-    items = q.all()
-    def serialize(m: Message):
-        return {
-            'id': m.id,
-            'sender_id': m.sender_id,
-            'sender_name': (m.sender.name if m.sender else 'مستخدم'),
-            'content': m.content,
-            'timestamp': m.timestamp.isoformat()
-        }
-    return jsonify({'messages': [serialize(m) for m in items]})
+        items = q.order_by(Message.id.asc()).limit(limit).all()
+        return jsonify({'messages': [message_payload(m) for m in items]})
+
+    items, has_more = _message_page(conv.id, before_id=before_id, after_id=after_id, limit=limit)
+    return jsonify({
+        'messages': [message_payload(m) for m in items],
+        'has_more': has_more,
+        'oldest_id': items[0].id if items else None,
+        'newest_id': items[-1].id if items else None,
+    })
+
+
+@conversations_bp.route('/api/conversations/<int:conversation_id>/read', methods=['POST'])
+@login_required
+def mark_conversation_read(conversation_id: int):
+    conv = Conversation.query.get_or_404(conversation_id)
+    _ensure_participant(conv)
+    payload = request.get_json(silent=True) or request.form
+    try:
+        last_id = int(payload.get('last_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'last_id is required'}), 400
+    # Never move the cursor past messages that actually exist
+    newest = db.session.query(func.max(Message.id)).filter(Message.conversation_id == conv.id).scalar() or 0
+    _mark_read(conv.id, current_user.id, min(last_id, newest))
+    return jsonify({'ok': True})
+
+
+@conversations_bp.route('/api/conversations/<int:conversation_id>/stream')
+@login_required
+@read_primary
+def conversation_stream(conversation_id: int):
+    """Server-Sent Events feed of new messages for one conversation.
+
+    Missed messages are replayed from the Last-Event-ID header (or `last_id`
+    query param) before switching to live events from the event bus. The
+    replay reads the primary: a lagging replica would skip messages the
+    client then never asks for again.
+    """
+    conv = Conversation.query.get_or_404(conversation_id)
+    _ensure_participant(conv)
+
+    last_id_raw = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    try:
+        last_id = int(last_id_raw) if last_id_raw else None
+    except (TypeError, ValueError):
+        last_id = None
+
+    channel = conversation_channel(conv.id)
+    # Subscribe before the catch-up query so nothing committed in between is lost
+    subscription = bus.subscribe(channel)
+    backlog = []
+    if last_id is not None:
+        backlog = [
+            (EVENT_MESSAGE_SENT, message_payload(m), m.id)
+            for m in (Message.query
+                      .options(joinedload(Message.sender))
+                      .filter(Message.conversation_id == conv.id, Message.id > last_id)
+                      .order_by(Message.id.asc())
+                      .all())
+        ]
+    return sse_response(channel, backlog, last_id=last_id, subscription=subscription)
 
 
 @conversations_bp.route('/send_message', methods=['POST'])
@@ -107,7 +289,7 @@ def send_message():
         return jsonify({'error': 'لا يمكن إرسال رسالة فارغة'}), 400
     if len(content) > 3000:
         return jsonify({'error': 'النص طويل جداً'}), 400
-    if _detect_external_contact(content):
+    if contains_external_contact(content):
         return jsonify({'error': 'مشاركة وسائل تواصل خارجية غير مسموح بها داخل النظام'}), 400
 
     conv = Conversation.query.get_or_404(conversation_id)
@@ -120,14 +302,9 @@ def send_message():
     db.session.add(msg)
     db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='message_sent'))
     db.session.commit()
+    publish_message(msg, current_user.name)
 
-    return jsonify({'ok': True, 'message': {
-        'id': msg.id,
-        'sender_id': msg.sender_id,
-        'sender_name': current_user.name,
-        'content': msg.content,
-        'timestamp': msg.timestamp.isoformat(),
-    }})
+    return jsonify({'ok': True, 'message': message_payload(msg, current_user.name)})
 
 
 @conversations_bp.route('/conversations/<int:conversation_id>/status', methods=['POST'])
@@ -146,12 +323,14 @@ def update_conversation_status(conversation_id: int):
     conv.status = new_status
     db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='status_changed', meta=new_status))
     db.session.commit()
+    publish_conversation_status(conv)
 
     return jsonify({'ok': True, 'status': conv.status})
 
 
 @conversations_bp.route('/conversations/start/<int:company_id>', methods=['POST', 'GET'])
 @login_required
+@read_primary
 def start_conversation(company_id: int):
     # Only clients can initiate
     if current_user.role != 'client':
@@ -174,12 +353,13 @@ def start_conversation(company_id: int):
         # optionally accept an initial message
         content = (request.form.get('content') or (request.get_json(silent=True) or {}).get('content') or '').strip()
         if content:
-            if _detect_external_contact(content):
+            if contains_external_contact(content):
                 return jsonify({'error': 'مشاركة وسائل تواصل خارجية غير مسموح بها داخل النظام'}), 400
             msg = Message(conversation_id=conv.id, sender_id=current_user.id, content=content)
             db.session.add(msg)
             db.session.add(ActivityLog(conversation_id=conv.id, actor_id=current_user.id, action='message_sent'))
             db.session.commit()
+            publish_message(msg, current_user.name)
             return jsonify({'ok': True, 'conversation_id': conv.id})
 
     # GET: redirect to detail page
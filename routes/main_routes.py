@@ -1,6 +1,11 @@
 from flask import Blueprint, render_template, abort, request, jsonify, url_for, redirect
-from flask_login import login_user, current_user
+from flask_login import login_user, current_user, login_required
 from utils import format_phone_e164
+from realtime import sse_response, user_channel
+from company_directory import directory_entries
+from catalog import catalog_response, CATALOG_BANKS, CATALOG_COMPANIES, CATALOG_TESTIMONIALS
+from db_routing import read_primary
+from sqlalchemy.orm import joinedload
 import secrets
 from models import (
     db,
@@ -19,19 +24,6 @@ from models import (
 
 main = Blueprint('main', __name__)
 
-# Ensure DB has optional columns used in views without requiring a full migration
-def _ensure_company_fee_column():
-    try:
-        from sqlalchemy import inspect as sa_inspect, text
-        inspector = sa_inspect(db.engine)
-        cols = [c['name'] for c in inspector.get_columns('company_profiles')]
-        if 'valuation_fee' not in cols:
-            # Best-effort add; ignore if fails
-            with db.engine.begin() as conn:
-                conn.execute(text('ALTER TABLE company_profiles ADD COLUMN valuation_fee FLOAT'))
-    except Exception:
-        # Silently continue; UI will just show '—' if not available
-        pass
 
 @main.route('/')
 def landing():
@@ -130,17 +122,16 @@ def quick_step_summary():
     DEFAULT_LAND_AREA = 300.0
     estimate = None
     # قائمة الشركات لعرضها في التقييم الفوري
-    companies = User.query.filter_by(role='company').order_by(User.name.asc()).all()
+    companies = directory_entries()
     # اختيار مُسبق عبر الاستعلام (اختياري) + التحقق من وجود الشركة
     selected_company_id = None
     try:
         selected_company_id = int(request.args.get('company_id')) if request.args.get('company_id') else None
     except Exception:
         selected_company_id = None
-    if selected_company_id is not None:
-        exists = User.query.filter_by(id=selected_company_id, role='company').first()
-        if not exists:
-            selected_company_id = None
+    selected = next((c for c in companies if c.user_id == selected_company_id), None)
+    if selected is None:
+        selected_company_id = None
 
     # استخرج سعر أرض مبدئي (سكني) من أسعار الشركة أولاً ثم العامة
     def pick_first_price(obj):
@@ -163,16 +154,14 @@ def quick_step_summary():
         return None
 
     land_price = None
-    if selected_company_id is not None:
-        company_profile = CompanyProfile.query.filter_by(user_id=selected_company_id).first()
-        if company_profile:
-            clp = (
-                CompanyLandPrice.query
-                .filter_by(company_profile_id=company_profile.id)
-                .order_by(CompanyLandPrice.wilaya.asc(), CompanyLandPrice.region.asc())
-                .first()
-            )
-            land_price = pick_first_price(clp)
+    if selected is not None and selected.profile_id:
+        clp = (
+            CompanyLandPrice.query
+            .filter_by(company_profile_id=selected.profile_id)
+            .order_by(CompanyLandPrice.wilaya.asc(), CompanyLandPrice.region.asc())
+            .first()
+        )
+        land_price = pick_first_price(clp)
 
     if land_price is None:
         lp = (
@@ -405,6 +394,7 @@ def certified_property_inputs():
 
 
 @main.route('/certified/offers')
+@read_primary
 def certified_offers():
     """Display valuation offers from companies based on entered inputs.
 
@@ -414,7 +404,6 @@ def certified_offers():
       - use (Arabic category), wilaya, region
       - land_area, build_area, age
     """
-    _ensure_company_fee_column()
     entity = request.args.get('entity', 'person')
     purpose = request.args.get('purpose', 'تثمين عقار قائم')
     bank_slug = request.args.get('bank')
@@ -475,21 +464,20 @@ def certified_offers():
 
     normalized_use = normalize_use(use_raw)
 
+    # Location prices are loaded once for every company (company rows keyed by profile id)
+    lp = None
+    company_rows = {}
+    if wilaya and region:
+        lp = LandPrice.query.filter_by(wilaya=wilaya, region=region).first()
+        company_rows = {
+            row.company_profile_id: row
+            for row in CompanyLandPrice.query.filter_by(wilaya=wilaya, region=region).all()
+        }
+
     # Helper to compute a basic valuation estimate per company using public/company prices
-    def compute_estimate(company_id: int) -> float | None:
-        # Fetch location pricing from existing API helpers logic (inline replicated)
-        # Try company-specific row first
-        company_profile = CompanyProfile.query.filter_by(user_id=company_id).first()
-        clp = None
-        lp = None
-        if company_profile and wilaya and region:
-            clp = CompanyLandPrice.query.filter_by(
-                company_profile_id=company_profile.id,
-                wilaya=wilaya,
-                region=region,
-            ).first()
-        if wilaya and region:
-            lp = LandPrice.query.filter_by(wilaya=wilaya, region=region).first()
+    def compute_estimate(profile_id) -> float | None:
+        # Company-specific row first, then the public price
+        clp = company_rows.get(profile_id)
 
         def prices_map_from(obj):
             if not obj:
@@ -549,64 +537,30 @@ def certified_offers():
     # - If a bank is selected: only approved companies for that bank
     # - Exclude companies whose effective limit is below the estimated value
     companies = []
-    if bank:
-        q = (
-            db.session.query(CompanyApprovedBank, CompanyProfile, User)
-            .join(CompanyProfile, CompanyApprovedBank.company_profile_id == CompanyProfile.id)
-            .join(User, CompanyProfile.user_id == User.id)
-            .filter(CompanyApprovedBank.bank_user_id == bank.user_id)
-        )
-
-        for cab, profile, user in q.all():
-            estimate = compute_estimate(user.id)
-            # Effective limit: per-bank limit overrides company-wide limit when available
-            effective_limit = cab.limit_value if cab.limit_value is not None else profile.limit_value
-            try:
-                effective_limit_val = float(effective_limit) if effective_limit is not None else None
-            except Exception:
-                effective_limit_val = None
-
-            # Enforce: hide company if estimate exceeds its effective limit
-            if effective_limit_val is not None and estimate is not None:
-                try:
-                    if float(estimate) > effective_limit_val:
-                        continue
-                except Exception:
-                    pass
-
-            companies.append({
-                'id': user.id,
-                'name': user.name,
-                'logo_path': profile.logo_path if profile.logo_path else None,
-                'estimate': estimate,
-                'limit_value': effective_limit_val,
-                'valuation_fee': (float(profile.valuation_fee) if getattr(profile, 'valuation_fee', None) is not None else None),
-            })
-    else:
-        base_q = db.session.query(CompanyProfile, User).join(User, CompanyProfile.user_id == User.id)
-        for profile, user in base_q.all():
-            estimate = compute_estimate(user.id)
-            effective_limit = profile.limit_value
-            try:
-                effective_limit_val = float(effective_limit) if effective_limit is not None else None
-            except Exception:
-                effective_limit_val = None
+    bank_user_id = bank.user_id if bank else None
+    for entry in directory_entries():
+        if bank_user_id is not None and not entry.approved_by(bank_user_id):
+            continue
+        estimate = compute_estimate(entry.profile_id)
+        # Effective limit: per-bank limit overrides company-wide limit when available
+        effective_limit = entry.effective_limit(bank_user_id)
+        try:
+            effective_limit_val = float(effective_limit) if effective_limit is not None else None
+        except Exception:
+            effective_limit_val = None
 
-            if effective_limit_val is not None and estimate is not None:
-                try:
-                    if float(estimate) > effective_limit_val:
-                        continue
-                except Exception:
-                    pass
+        # Enforce: hide company if estimate exceeds its effective limit
+        if effective_limit_val is not None and estimate is not None and estimate > effective_limit_val:
+            continue
 
-            companies.append({
-                'id': user.id,
-                'name': user.name,
-                'logo_path': profile.logo_path if profile.logo_path else None,
-                'estimate': estimate,
-                'limit_value': effective_limit_val,
-                'valuation_fee': (float(profile.valuation_fee) if getattr(profile, 'valuation_fee', None) is not None else None),
-            })
+        companies.append({
+            'id': entry.user_id,
+            'name': entry.name,
+            'logo_path': entry.logo_path,
+            'estimate': estimate,
+            'limit_value': effective_limit_val,
+            'valuation_fee': entry.valuation_fee,
+        })
 
     # Sort: those with estimate first (desc), then by name
     companies.sort(key=lambda x: (0 if x['estimate'] is None else -x['estimate'], x['name']))
@@ -628,7 +582,7 @@ def certified_offers():
 
 @main.route('/companies')
 def companies_list():
-    companies = User.query.filter_by(role='company').all()
+    companies = directory_entries()
     return render_template('companies/list.html', companies=companies)
 
 
@@ -679,14 +633,16 @@ def calculator():
 # -------------------------------
 @main.route('/api/banks', methods=['GET'])
 def api_list_banks():
-    banks = BankProfile.query.order_by(BankProfile.id.asc()).all()
-    return jsonify([
-        {
-            'slug': b.slug,
-            'name': b.user.name if b.user else b.slug,
-            'logo_path': (b.logo_path if b.logo_path else None)
-        } for b in banks
-    ])
+    def build():
+        banks = BankProfile.query.options(joinedload(BankProfile.user)).order_by(BankProfile.id.asc()).all()
+        return [
+            {
+                'slug': b.slug,
+                'name': b.user.name if b.user else b.slug,
+                'logo_path': (b.logo_path if b.logo_path else None)
+            } for b in banks
+        ]
+    return catalog_response(CATALOG_BANKS, build)
 
 
 @main.route('/api/certified_companies', methods=['GET'])
@@ -746,12 +702,6 @@ def api_testimonials_list():
     except Exception:
         limit = 10
 
-    qs = (
-        Testimonial.query
-        .order_by(Testimonial.created_at.desc())
-        .limit(limit)
-        .all()
-    )
     def serialize(t: Testimonial):
         return {
             'id': t.id,
@@ -761,7 +711,16 @@ def api_testimonials_list():
             'body': t.body,
             'created_at': t.created_at.isoformat() if t.created_at else None,
         }
-    return jsonify([serialize(t) for t in qs])
+
+    def build():
+        qs = (
+            Testimonial.query
+            .order_by(Testimonial.created_at.desc())
+            .limit(limit)
+            .all()
+        )
+        return [serialize(t) for t in qs]
+    return catalog_response(CATALOG_TESTIMONIALS, build, variant=str(limit))
 
 
 @main.route('/api/testimonials', methods=['POST'])
@@ -803,18 +762,28 @@ def api_testimonials_create():
     }), 201
 
 
+# -------------------------------
+# Live dashboard updates (request status changes, proposed appointments)
+# -------------------------------
+@main.route('/api/events/stream', methods=['GET'])
+@login_required
+@read_primary
+def user_events_stream():
+    """Server-Sent Events addressed to the current user (see realtime.py)."""
+    return sse_response(user_channel(current_user.id))
+
+
 # -------------------------------
 # APIs for quick valuation company selections
 # -------------------------------
 @main.route('/api/companies', methods=['GET'])
 def api_companies():
-    companies = User.query.filter_by(role='company').order_by(User.name.asc()).all()
-    return jsonify([
+    return catalog_response(CATALOG_COMPANIES, lambda: [
         {
-            'id': c.id,
+            'id': c.user_id,
             'name': c.name,
-            'logo_path': (c.company_profile.logo_path if getattr(c, 'company_profile', None) and c.company_profile.logo_path else None),
-        } for c in companies
+            'logo_path': c.logo_path,
+        } for c in directory_entries()
     ])
 
 
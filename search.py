@@ -0,0 +1,252 @@
+"""Full-text search over conversation messages (SQLite FTS5).
+
+`messages_fts` holds an Arabic-normalized copy of every message and is kept
+in sync by triggers on `messages`, so no route has to remember to index.
+Normalization (diacritics/tatweel removed, alef/yaa/taa-marbuta unified,
+Arabic-Indic digits folded, leading "ال" dropped) is plain nested replace()
+calls inside the triggers; the same mapping is applied to queries in Python.
+
+Each row also carries a `participants` column ("u<client_id> u<company_id>"),
+so scoping a search to one user is an FTS posting-list intersection rather
+than a post-filter over every match.
+"""
+from datetime import datetime
+from typing import List
+import re
+from markupsafe import escape
+from sqlalchemy import case, text
+from sqlalchemy.orm import aliased
+from models import db, Message, Conversation, User
+
+FTS_TABLE = 'messages_fts'
+
+# (source, replacement) applied in order, both in SQL triggers and in Python
+_AR_FOLD = (
+    [(chr(cp), '') for cp in range(0x064B, 0x0653)]          # harakat (fathatan .. sukun)
+    + [('ٰ', ''), ('ـ', '')]                       # superscript alef, tatweel
+    + [('أ', 'ا'), ('إ', 'ا'), ('آ', 'ا'), ('ٱ', 'ا'), ('ى', 'ي'), ('ة', 'ه')]
+    + [(chr(0x0660 + i), str(i)) for i in range(10)]         # Arabic-Indic digits
+    + [(chr(0x06F0 + i), str(i)) for i in range(10)]         # Persian digits
+    + [('\r', ' '), ('\n', ' '), ('\t', ' ')]
+)
+
+_TOKEN_SPLIT = re.compile(r'[\W_]+', re.UNICODE)
+_MAX_QUERY_TOKENS = 8
+_CHUNK = re.compile(r'\S+')
+# Words shown around the first hit, and how many of them precede it
+_SNIPPET_WORDS = 12
+_SNIPPET_LEAD = 4
+
+_SQL_FOLD_GROUP = 12
+# Newest matches considered for ranking, and the length the score is normalized to
+_RANK_CANDIDATES = 500
+_TYPICAL_MESSAGE_WORDS = 20
+
+_ready = {}
+
+
+def normalize_text(value: str) -> str:
+    out = value or ''
+    for src, dst in _AR_FOLD:
+        out = out.replace(src, dst)
+    # Drop the definite article so "الموالح" and "موالح" index the same token
+    return (' ' + out).replace(' ال', ' ')
+
+
+def _sql_normalize(expr: str) -> str:
+    """Derived table `(SELECT ... AS s)` holding `expr` normalized.
+
+    SQLite's parser rejects ~40 nested calls, so the replace() chain is split
+    into groups stacked as nested derived tables.
+    """
+    source = f"(SELECT {expr} AS s)"
+    for start in range(0, len(_AR_FOLD), _SQL_FOLD_GROUP):
+        out = 'n.s'
+        for src, dst in _AR_FOLD[start:start + _SQL_FOLD_GROUP]:
+            out = f"replace({out}, {_sql_literal(src)}, {_sql_literal(dst)})"
+        source = f"(SELECT {out} AS s FROM {source} n)"
+    return f"(SELECT replace(' ' || n.s, ' ال', ' ') AS s FROM {source} n)"
+
+
+def _sql_literal(value: str) -> str:
+    if value in ('\r', '\n', '\t'):
+        return f"char({ord(value)})"
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _participants_sql(alias: str) -> str:
+    return f"'u' || {alias}.client_id || ' u' || {alias}.company_id"
+
+
+def ensure_message_search_index(engine) -> bool:
+    """Create the FTS table and triggers if missing and backfill existing messages.
+
+    Returns False when the database is not SQLite or lacks FTS5.
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    insert_new = (
+        f"INSERT INTO {FTS_TABLE}(rowid, content, participants, conversation_id) "
+        f"SELECT new.id, norm.s, {_participants_sql('c')}, new.conversation_id "
+        f"FROM conversations c, {_sql_normalize('new.content')} norm WHERE c.id = new.conversation_id;"
+    )
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"content, participants, conversation_id UNINDEXED, "
+        f"tokenize = 'unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END",
+        f"CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content, conversation_id ON messages BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; {insert_new} END",
+    ]
+    try:
+        with engine.begin() as conn:
+            for stmt in statements:
+                conn.execute(text(stmt))
+            indexed = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar() or 0
+            if indexed == 0:
+                conn.execute(text(
+                    f"INSERT INTO {FTS_TABLE}(rowid, content, participants, conversation_id) "
+                    f"SELECT m.id, (SELECT norm.s FROM {_sql_normalize('m.content')} norm), "
+                    f"{_participants_sql('c')}, m.conversation_id "
+                    f"FROM messages m JOIN conversations c ON c.id = m.conversation_id"
+                ))
+    except Exception:
+        return False
+    _ready[str(engine.url)] = True
+    return True
+
+
+def _fts_available(engine) -> bool:
+    key = str(engine.url)
+    if key not in _ready:
+        if engine.dialect.name != 'sqlite':
+            _ready[key] = False
+        else:
+            with engine.connect() as conn:
+                found = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :n"), {'n': FTS_TABLE}
+                ).first()
+            _ready[key] = bool(found)
+    return _ready[key]
+
+
+def query_tokens(query: str) -> List[str]:
+    tokens = [t for t in _TOKEN_SPLIT.split(normalize_text(query).lower()) if t]
+    return tokens[:_MAX_QUERY_TOKENS]
+
+
+def snippet_html(content: str, tokens: List[str]) -> str:
+    """Excerpt of the original message with the words matching `tokens` in <mark>.
+
+    `messages_fts` only holds the normalized text, so hits are found by
+    normalizing each word of the original content the same way.
+    """
+    content = content or ''
+    wanted = set(tokens)
+    chunks = list(_CHUNK.finditer(content))
+    hit = [bool(wanted.intersection(query_tokens(c.group()))) for c in chunks]
+    if not chunks:
+        return ''
+    first = hit.index(True) if any(hit) else 0
+    start = max(0, first - _SNIPPET_LEAD)
+    end = min(len(chunks), start + _SNIPPET_WORDS)
+    parts = ['…'] if start > 0 else []
+    pos = chunks[start].start()
+    for i in range(start, end):
+        chunk = chunks[i]
+        parts.append(str(escape(content[pos:chunk.start()])))
+        word = str(escape(chunk.group()))
+        parts.append(f'<mark>{word}</mark>' if hit[i] else word)
+        pos = chunk.end()
+    if end < len(chunks):
+        parts.append('…')
+    return ''.join(parts)
+
+
+def _iso(value) -> str:
+    """ISO-8601 like message_payload; raw SQL returns SQLite timestamps as text."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.isoformat()
+
+
+def search_messages(user, query: str, limit: int = 20) -> List[dict]:
+    """Ranked message hits from conversations `user` takes part in."""
+    tokens = query_tokens(query)
+    if not tokens:
+        return []
+    if not _fts_available(db.engine):
+        return _search_like(user, tokens, limit)
+
+    # Tokens are [\w]+ only, so quoting them is enough to neutralize FTS syntax.
+    # Whole tokens only: a prefix query ("x"*) merges every matching term's
+    # doclist and costs tens of ms at a million messages, exact terms < 1 ms.
+    terms = ' '.join(f'"{t}"' for t in tokens)
+    match = f'participants : "u{int(user.id)}" AND content : ({terms})'
+
+    # FTS5's bm25() counts every row matching each phrase across the whole
+    # index (the "u<id>" scope token included), which costs tens of ms at a
+    # million messages. Instead take the newest matching candidates straight
+    # from the doclists and score them here by term frequency and length.
+    candidates = db.session.execute(text(
+        f"SELECT rowid, content FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match "
+        f"ORDER BY rowid DESC LIMIT :cap"
+    ), {'match': match, 'cap': _RANK_CANDIDATES}).all()
+    if not candidates:
+        return []
+    wanted = set(tokens)
+    scored = []
+    for rowid, content in candidates:
+        words = [w for w in _TOKEN_SPLIT.split((content or '').lower()) if w]
+        hits = sum(1 for w in words if w in wanted)
+        # BM25-style saturation (k1=1.2, b=0.75) against a typical message length
+        norm = 1.2 * (0.25 + 0.75 * len(words) / _TYPICAL_MESSAGE_WORDS)
+        scored.append((hits * 2.2 / (hits + norm), rowid))
+    # Best score first, newer message wins ties
+    scored.sort(reverse=True)
+    top = scored[:limit]
+    scores = {rowid: score for score, rowid in top}
+
+    rows = db.session.execute(text(
+        f"SELECT m.id, m.conversation_id, m.sender_id, m.timestamp, m.content, o.name AS other_name "
+        f"FROM messages m "
+        f"JOIN conversations c ON c.id = m.conversation_id "
+        f"LEFT JOIN users o ON o.id = CASE WHEN c.client_id = :uid THEN c.company_id ELSE c.client_id END "
+        f"WHERE m.id IN ({', '.join(str(int(r)) for r in scores)}) "
+        f"AND (c.client_id = :uid OR c.company_id = :uid)"
+    ), {'uid': user.id}).all()
+
+    results = [{
+        'message_id': r.id,
+        'conversation_id': r.conversation_id,
+        'sender_id': r.sender_id,
+        'other_name': r.other_name,
+        'timestamp': _iso(r.timestamp),
+        'snippet_html': snippet_html(r.content, tokens),
+        'score': round(scores[r.id], 4),
+    } for r in rows]
+    results.sort(key=lambda item: (item['score'], item['message_id']), reverse=True)
+    return results
+
+
+def _search_like(user, tokens: List[str], limit: int) -> List[dict]:
+    """Fallback for databases without FTS5: unranked substring scan."""
+    other = aliased(User)
+    other_id = case((Conversation.client_id == user.id, Conversation.company_id), else_=Conversation.client_id)
+    q = (db.session.query(Message, other.name)
+         .join(Conversation, Conversation.id == Message.conversation_id)
+         .outerjoin(other, other.id == other_id)
+         .filter((Conversation.client_id == user.id) | (Conversation.company_id == user.id)))
+    for t in tokens:
+        q = q.filter(Message.content.ilike(f'%{t}%'))
+    return [{
+        'message_id': m.id,
+        'conversation_id': m.conversation_id,
+        'sender_id': m.sender_id,
+        'other_name': other_name,
+        'timestamp': m.timestamp.isoformat(),
+        'snippet_html': snippet_html(m.content, tokens),
+        'score': None,
+    } for m, other_name in q.order_by(Message.id.desc()).limit(limit).all()]
@@ -0,0 +1,123 @@
+"""Per-request SQL instrumentation.
+
+Engine `before/after_cursor_execute` events count every statement executed
+while a request is being handled, its time, and how often each statement
+*shape* ran (literals, bind markers and IN-lists collapsed, so the same
+query for different ids counts as one shape).
+
+At the end of the request:
+
+- `Server-Timing: db;dur=<ms>;desc="<n> queries"` is added (visible in the
+  browser dev tools), plus `db-repeat` when a shape crossed the threshold;
+- a DEBUG log line summarizes the request;
+- a WARNING names the endpoint and statement when one shape ran more than
+  SQL_REPEAT_THRESHOLD times, which is what an N+1 loop looks like.
+
+SQL_INSTRUMENTATION turns it off entirely; thresholds come from Config so
+development can flag small loops while production only reports large ones.
+"""
+from collections import Counter
+from typing import Optional
+import logging
+import re
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+_settings = {'enabled': False}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_BIND = re.compile(r'%\(\w+\)s|%s|:\w+|\$\d+|\?')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize_statement(statement: str) -> str:
+    """Statement shape: literals and bind markers become ?, IN-lists collapse to (?)."""
+    shape = _STRING.sub('?', statement)
+    shape = _BIND.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    shape = _IN_LIST.sub('(?)', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+class RequestSqlStats:
+    __slots__ = ('count', 'seconds', 'shapes')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[normalize_statement(statement)] += 1
+
+    def most_repeated(self):
+        """(shape, times) of the statement that ran most often, or (None, 0)."""
+        if not self.shapes:
+            return None, 0
+        return self.shapes.most_common(1)[0]
+
+
+def request_sql_stats() -> Optional[RequestSqlStats]:
+    """Stats of the current request (None outside a request or when disabled)."""
+    if not has_request_context():
+        return None
+    return g.get('sql_stats')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _settings['enabled'] and has_request_context():
+        conn.info.setdefault('sql_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('sql_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats = request_sql_stats()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+def _server_timing(stats: RequestSqlStats, repeated: int, threshold: int) -> str:
+    entries = [f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"']
+    if repeated > threshold:
+        entries.append(f'db-repeat;desc="one statement ran {repeated} times"')
+    return ', '.join(entries)
+
+
+def init_app(app) -> None:
+    _settings['enabled'] = bool(app.config.get('SQL_INSTRUMENTATION'))
+    if not _settings['enabled']:
+        return
+    threshold = int(app.config.get('SQL_REPEAT_THRESHOLD', 10))
+    send_header = bool(app.config.get('SQL_SERVER_TIMING', True))
+
+    @app.before_request
+    def _start_sql_stats():
+        g.sql_stats = RequestSqlStats()
+
+    @app.after_request
+    def _report_sql_stats(response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        shape, repeated = stats.most_repeated()
+        if send_header:
+            response.headers.add('Server-Timing', _server_timing(stats, repeated, threshold))
+        log.debug('%s %s: %d queries in %.1f ms', request.method, request.path,
+                  stats.count, stats.seconds * 1000)
+        if repeated > threshold:
+            log.warning('possible N+1 in %s (%s): statement ran %d times: %s',
+                        request.endpoint, request.path, repeated, shape)
+        return response
@@ -0,0 +1,100 @@
+"""Cross-process event bus: a message posted in one worker reaches an SSE
+stream served by another worker sharing the same SQLite database.
+
+The test starts two real processes (this file run as a script):
+- `subscriber` seeds a client, a company and a conversation, opens the
+  conversation stream as the client, prints READY and waits for the event;
+- `publisher` posts a message to the conversation as the company.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MESSAGE = 'cross-process hello'
+
+
+def _env(tmp: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': 'sqlite:///' + os.path.join(tmp, 'bus.db'),
+        'EVENT_BUS': 'db',
+        'EVENT_BUS_POLL_INTERVAL': '0.05',
+        'CATALOG_VERSION_DIR': os.path.join(tmp, 'catalog'),
+        'MIGRATION_LOCK_FILE': os.path.join(tmp, 'migrate.lock'),
+        'UPLOAD_TMP_FOLDER': os.path.join(tmp, 'parts'),
+        'B2_KEY_ID': '', 'B2_APP_KEY': '', 'B2_BUCKET_NAME': '',
+        'PYTHONPATH': ROOT,
+    })
+    return env
+
+
+def _login(client, user_id: int) -> None:
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def run_subscriber() -> None:
+    from app import app
+    from models import db, User, Conversation
+    with app.app_context():
+        users = []
+        for role in ('client', 'company'):
+            user = User(name=role, email=f'{role}@example.com', role=role)
+            user.set_password('secret')
+            db.session.add(user)
+            users.append(user)
+        db.session.flush()
+        conv = Conversation(client_id=users[0].id, company_id=users[1].id, status='open')
+        db.session.add(conv)
+        db.session.commit()
+        client_id, company_id, conv_id = users[0].id, users[1].id, conv.id
+
+    client = app.test_client()
+    _login(client, client_id)
+    resp = client.get(f'/api/conversations/{conv_id}/stream', buffered=False)
+    assert resp.status_code == 200
+    chunks = iter(resp.response)
+    next(chunks)  # "retry:" preamble: the subscription and poller are live
+    print(json.dumps({'conversation_id': conv_id, 'company_id': company_id}), flush=True)
+    for chunk in chunks:
+        text = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        if 'event: message_sent' in text:
+            print('EVENT ' + text.split('data: ', 1)[1].strip(), flush=True)
+            return
+
+
+def run_publisher(conversation_id: int, company_id: int) -> None:
+    from app import app
+    client = app.test_client()
+    _login(client, company_id)
+    resp = client.post('/send_message', json={'conversation_id': conversation_id, 'content': MESSAGE})
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+
+
+def test_event_reaches_stream_in_other_process():
+    with tempfile.TemporaryDirectory() as tmp:
+        env = _env(tmp)
+        subscriber = subprocess.Popen([sys.executable, __file__, 'subscriber'], cwd=ROOT, env=env,
+                                      stdout=subprocess.PIPE, text=True)
+        try:
+            ready = json.loads(subscriber.stdout.readline())
+            subprocess.run([sys.executable, __file__, 'publisher',
+                            str(ready['conversation_id']), str(ready['company_id'])],
+                           cwd=ROOT, env=env, check=True, timeout=60)
+            out, _ = subscriber.communicate(timeout=30)
+        finally:
+            subscriber.kill()
+        assert subscriber.returncode == 0
+        event = json.loads(out.split('EVENT ', 1)[1])
+        assert event['content'] == MESSAGE
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'subscriber':
+        run_subscriber()
+    else:
+        run_publisher(int(sys.argv[2]), int(sys.argv[3]))
@@ -1,9 +1,15 @@
-from typing import Optional
+from typing import Iterable, Iterator, Optional, Tuple
+import mimetypes
 import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
+from urllib.request import urlopen
 from random import randint
 from datetime import datetime, timedelta
 from flask import current_app
+from ingest import sniff_type, with_extension
 try:
     from twilio.rest import Client  # type: ignore
 except Exception:  # pragma: no cover - optional dependency during local dev
@@ -244,3 +250,179 @@ def store_file_and_get_url(file_storage, *, key: str, local_abs_dir: str, filena
         # As a last resort, return an empty string so callers can handle error messages
         return ''
 
+
+# -------------------------------
+# Request documents: labels + streaming ZIP bundles
+# -------------------------------
+
+DOC_TYPE_LABELS_AR = {
+    "ids": "بطاقات هوية",
+    "kroki": "كروكي",
+    "deed": "صك الملكية",
+    "completion_certificate": "شهادة إتمام البناء",
+    "maps": "خرائط",
+    "contractor_agreement": "اتفاقية المقاول",
+}
+
+
+def doc_label_ar(doc_type: str) -> str:
+    key = str(doc_type or "").strip()
+    return DOC_TYPE_LABELS_AR.get(key, key)
+
+
+REQUEST_STATUS_LABELS_AR = {
+    "pending": "بانتظار",
+    "revision_requested": "مستندات ناقصة",
+    "completed": "تم التثمين",
+    "approved": "مقبول من العميل",
+    "rejected": "مرفوض",
+}
+
+
+def status_label_ar(status: str) -> str:
+    key = str(status or "").strip()
+    return REQUEST_STATUS_LABELS_AR.get(key, key or "-")
+
+
+class _ZipSink:
+    """Write-only, non-seekable sink; zipfile then emits data descriptors.
+
+    Bytes written by ZipFile are collected and drained by the generator below,
+    so the archive is produced on the fly without a temp file.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out = b''.join(self._chunks)
+        self._chunks = []
+        return out
+
+
+def _read_remote(url: str, timeout: float) -> Tuple[bytes, Optional[str]]:
+    with urlopen(url, timeout=timeout) as resp:  # nosec - our own B2/public URLs
+        return resp.read(), resp.headers.get_content_type()
+
+
+def _arcname_with_extension(arcname: str, head: bytes, content_type: Optional[str] = None) -> str:
+    """Give extensionless (legacy) entries an extension, sniffed like ingest does.
+
+    Falls back to the stored content type (B2 response header) for types
+    the sniffer doesn't know.
+    """
+    if os.path.splitext(arcname)[1]:
+        return arcname
+    file_type = sniff_type(head[:16])
+    if file_type:
+        return with_extension(arcname, file_type)
+    if content_type and content_type != 'application/octet-stream':
+        ext = mimetypes.guess_extension(content_type)
+        if ext:
+            return f"{arcname}{ext}"
+    return arcname
+
+
+def iter_zip_stream(
+    entries: Iterable[Tuple[str, str]],
+    *,
+    static_root: str,
+    prefetch: int = 3,
+    chunk_size: int = 64 * 1024,
+    timeout: float = 30.0,
+) -> Iterator[bytes]:
+    """Yield a ZIP archive of `entries` as it is being built.
+
+    Args:
+        entries: (arcname, file_path) pairs; file_path is an external URL (B2)
+            or a path relative to the static folder, as stored on RequestDocument.
+        static_root: absolute path of the Flask static folder.
+        prefetch: how many remote files may be downloading ahead of the writer.
+
+    Remote files are fetched concurrently (at most `prefetch` in flight) while
+    earlier entries are already being sent; local files are read directly.
+    A source that can't be read is skipped rather than aborting the download.
+    An arcname without an extension gets one from the file's content.
+    """
+    entries = list(entries)
+    sink = _ZipSink()
+    executor = ThreadPoolExecutor(max_workers=max(1, prefetch), thread_name_prefix='zip-prefetch')
+    pending = deque()
+    next_idx = 0
+
+    def schedule():
+        nonlocal next_idx
+        in_flight = sum(1 for _, _, fut in pending if fut is not None)
+        while next_idx < len(entries) and in_flight < prefetch:
+            arcname, path = entries[next_idx]
+            fut = executor.submit(_read_remote, path, timeout) if _is_external_url(path) else None
+            pending.append((arcname, path, fut))
+            if fut is not None:
+                in_flight += 1
+            next_idx += 1
+
+    try:
+        # Already-compressed PDFs/JPEGs: the fastest deflate level keeps CPU low
+        with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+            schedule()
+            while pending:
+                arcname, path, fut = pending.popleft()
+                data = None
+                fh = None
+                content_type = None
+                try:
+                    if fut is not None:
+                        data, content_type = fut.result()
+                    else:
+                        abs_path = os.path.normpath(os.path.join(static_root, path))
+                        if abs_path.startswith(os.path.normpath(static_root) + os.sep):
+                            fh = open(abs_path, 'rb')
+                except Exception:
+                    data, fh = None, None
+                schedule()
+                if data is None and fh is None:
+                    # Unreadable source: skip the entry and keep streaming the rest
+                    continue
+                if data is not None:
+                    head = data[:16]
+                else:
+                    head = fh.read(16)
+                    fh.seek(0)
+                arcname = _arcname_with_extension(arcname, head, content_type)
+                try:
+                    with zf.open(arcname, mode='w', force_zip64=True) as dest:
+                        if data is not None:
+                            for i in range(0, len(data), chunk_size):
+                                dest.write(data[i:i + chunk_size])
+                                out = sink.drain()
+                                if out:
+                                    yield out
+                        else:
+                            while True:
+                                block = fh.read(chunk_size)
+                                if not block:
+                                    break
+                                dest.write(block)
+                                out = sink.drain()
+                                if out:
+                                    yield out
+                finally:
+                    if fh is not None:
+                        fh.close()
+                out = sink.drain()
+                if out:
+                    yield out
+        out = sink.drain()
+        if out:
+            yield out
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
@@ -0,0 +1,107 @@
+"""Valuation request state machine.
+
+Every status change goes through `transition()`, which checks the move
+against `TRANSITIONS` (from state -> to state -> roles allowed to make it),
+stamps `status_changed_at` and appends a `ValuationRequestTransition` row
+used for SLA metrics. Callers commit.
+
+Main path: pending -> completed (company submits) -> approved (client
+accepts). The company or bank can ask for documents or reject; the client
+can decline a valuation or transfer the request, both back to pending.
+"""
+from datetime import datetime
+from typing import Iterable, Optional
+from models import (
+    db, ValuationRequestTransition, REQUEST_STATUSES,
+    STATUS_PENDING, STATUS_REVISION_REQUESTED, STATUS_COMPLETED, STATUS_APPROVED, STATUS_REJECTED,
+)
+
+ROLE_CLIENT = 'client'
+ROLE_COMPANY = 'company'
+ROLE_BANK = 'bank'
+ROLE_ADMIN = 'admin'
+
+# from state -> {to state: roles allowed}. Same-state entries are explicit
+# re-submissions / re-assignments (a transfer keeps 'pending').
+TRANSITIONS = {
+    STATUS_PENDING: {
+        STATUS_PENDING: {ROLE_CLIENT},
+        STATUS_COMPLETED: {ROLE_COMPANY},
+        STATUS_REVISION_REQUESTED: {ROLE_COMPANY, ROLE_BANK},
+        STATUS_REJECTED: {ROLE_COMPANY, ROLE_BANK},
+    },
+    STATUS_REVISION_REQUESTED: {
+        STATUS_PENDING: {ROLE_CLIENT, ROLE_BANK},
+        STATUS_COMPLETED: {ROLE_COMPANY},
+        STATUS_REVISION_REQUESTED: {ROLE_COMPANY, ROLE_BANK},
+        STATUS_REJECTED: {ROLE_COMPANY, ROLE_BANK},
+    },
+    STATUS_COMPLETED: {
+        STATUS_PENDING: {ROLE_CLIENT},
+        STATUS_COMPLETED: {ROLE_COMPANY},
+        STATUS_APPROVED: {ROLE_CLIENT},
+        STATUS_REVISION_REQUESTED: {ROLE_COMPANY, ROLE_BANK},
+        STATUS_REJECTED: {ROLE_COMPANY, ROLE_BANK},
+    },
+    STATUS_APPROVED: {
+        STATUS_PENDING: {ROLE_CLIENT},
+        STATUS_REJECTED: {ROLE_BANK},
+    },
+    STATUS_REJECTED: {
+        STATUS_PENDING: {ROLE_CLIENT},
+    },
+}
+
+
+class InvalidTransition(Exception):
+    """Raised when a status change is not allowed from the current state or for the actor."""
+
+    def __init__(self, from_status: Optional[str], to_status: str, role: Optional[str] = None):
+        self.from_status = from_status
+        self.to_status = to_status
+        self.role = role
+        super().__init__(f"cannot move request from {from_status!r} to {to_status!r} as {role!r}")
+
+
+def current_status(vr) -> str:
+    # Legacy rows may hold NULL or odd casing
+    status = (vr.status or STATUS_PENDING).lower()
+    return status if status in REQUEST_STATUSES else STATUS_PENDING
+
+
+def can_transition(vr, to_status: str, role: str) -> bool:
+    if to_status not in REQUEST_STATUSES:
+        return False
+    if role == ROLE_ADMIN:
+        # Admins may correct a request to any known state
+        return True
+    return role in TRANSITIONS.get(current_status(vr), {}).get(to_status, ())
+
+
+def allowed_targets(vr, role: str) -> Iterable[str]:
+    """States `role` may move `vr` to, excluding staying put."""
+    here = current_status(vr)
+    return [s for s in REQUEST_STATUSES if s != here and can_transition(vr, s, role)]
+
+
+def transition(vr, to_status: str, actor, note: Optional[str] = None) -> ValuationRequestTransition:
+    """Move `vr` to `to_status` on behalf of `actor` (a User); the caller commits."""
+    role = getattr(actor, 'role', None)
+    from_status = vr.status
+    if not can_transition(vr, to_status, role):
+        raise InvalidTransition(from_status, to_status, role)
+    now = datetime.utcnow()
+    vr.status = to_status
+    vr.status_changed_at = now
+    if to_status == STATUS_REJECTED:
+        vr.rejected_at = now
+    record = ValuationRequestTransition(
+        valuation_request_id=vr.id,
+        from_status=from_status,
+        to_status=to_status,
+        actor_id=getattr(actor, 'id', None),
+        note=note,
+        created_at=now,
+    )
+    db.session.add(record)
+    return record